@@ -0,0 +1,255 @@
+"""Full-text search index over archived (and homework) PDFs, stored in
+SQLite FTS5. Text is extracted once per content hash in a background pool."""
+import concurrent.futures
+import hashlib
+import logging
+import os
+import sqlite3
+import subprocess
+import time
+from typing import Dict, List, Optional, Union
+
+from home_automation import config as haconfig
+
+HASH_CHUNK_SIZE = 1024 * 1024
+EXTRACTION_TIMEOUT = 120
+INDEXED_EXTENSIONS = [".pdf"]
+SEARCH_RESULTS_LIMIT = 50
+
+_INDICES: Dict[str, "ArchiveIndex"] = {}
+
+
+class TextExtractionError(Exception):
+    """Text couldn't be extracted from a file."""
+
+
+def file_content_hash(path: str) -> str:
+    """Return the sha256 hex digest of the file's contents."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def extract_text(path: str) -> str:
+    """Extract the text of a PDF using `pdftotext` (poppler-utils)."""
+    try:
+        result = subprocess.run(
+            ["pdftotext", "-q", "-enc", "UTF-8", path, "-"],
+            capture_output=True,
+            timeout=EXTRACTION_TIMEOUT,
+            check=True,
+        )
+    except (OSError, subprocess.SubprocessError) as error:
+        raise TextExtractionError(path) from error
+    return result.stdout.decode("utf-8", errors="replace")
+
+
+def should_be_indexed(path: str) -> bool:
+    """Compressed copies have the same text as their original, so leave them out."""
+    fname = os.path.basename(path)
+    return (
+        os.path.splitext(fname)[1] in INDEXED_EXTENSIONS
+        and not fname.endswith(".small.pdf")
+        and not fname.startswith(".")
+    )
+
+
+def rename_paths(
+    connection: sqlite3.Connection, table: str, source: str, destination: str
+):
+    """Replace `source` (a file or directory) by `destination` in the `path`
+    column of `table` by prefix, without looking at the files themselves."""
+    prefix = source.rstrip(os.sep) + os.sep
+    connection.execute(
+        f"UPDATE OR REPLACE {table} SET path=? WHERE path=?", (destination, source)
+    )
+    connection.execute(
+        f"UPDATE OR REPLACE {table} SET path=? || substr(path, ?) \
+WHERE substr(path, 1, ?)=?",
+        (destination.rstrip(os.sep) + os.sep, len(prefix) + 1, len(prefix), prefix),
+    )
+
+
+class ArchiveIndex:
+    """Full-text index of documents, living in `storage.local`.
+
+    `documents` maps each path to the hash of its content, `contents` holds the
+    extracted text once per hash, so moving or copying a file never leads to a
+    second extraction."""
+
+    config: haconfig.Config
+    path: str
+    executor: concurrent.futures.ThreadPoolExecutor
+
+    def __init__(self, config: haconfig.Config):
+        self.config = config
+        self.path = config.storage.local.path
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=config.search.workers,
+            thread_name_prefix="home_automation.archive_index",
+        )
+        self._prepare_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _prepare_db(self):
+        """Create tables if necessary."""
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS documents \
+(path TEXT PRIMARY KEY, content_hash TEXT NOT NULL, indexed_at REAL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS documents_content_hash \
+ON documents (content_hash)"
+            )
+            connection.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS contents \
+USING fts5(content_hash UNINDEXED, text)"
+            )
+        connection.close()
+
+    def submit(self, path: str) -> Optional[concurrent.futures.Future]:
+        """Index `path` (a file or directory) in the background."""
+        if os.path.isdir(path):
+            for directory, _, fnames in os.walk(path):
+                for fname in fnames:
+                    self.submit(os.path.join(directory, fname))
+            return None
+        if not should_be_indexed(path):
+            return None
+        return self.executor.submit(self._index_file_logging_errors, path)
+
+    def _index_file_logging_errors(self, path: str):
+        try:
+            self.index_file(path)
+        except (OSError, sqlite3.Error, TextExtractionError) as error:
+            logging.warning("Couldn't index '%s': %s", path, error)
+
+    def index_file(self, path: str) -> bool:
+        """Index `path` now. Return whether text had to be extracted.
+
+        Text is extracted outside of any transaction, but only inserted if it's
+        still unknown when holding the write lock, so files with the same content
+        indexed concurrently (by other workers or processes) share one row."""
+        content_hash = file_content_hash(path)
+        connection = self._connect()
+        try:
+            known = connection.execute(
+                "SELECT 1 FROM contents WHERE content_hash=? LIMIT 1", (content_hash,)
+            ).fetchone()
+            text = None if known else extract_text(path)
+            connection.isolation_level = None  # transactions are begun explicitly
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                if text is not None and not connection.execute(
+                    "SELECT 1 FROM contents WHERE content_hash=? LIMIT 1",
+                    (content_hash,),
+                ).fetchone():
+                    connection.execute(
+                        "INSERT INTO contents (content_hash, text) VALUES (?, ?)",
+                        (content_hash, text),
+                    )
+                connection.execute(
+                    "INSERT OR REPLACE INTO documents VALUES (?, ?, ?)",
+                    (path, content_hash, time.time()),
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        finally:
+            connection.close()
+        return not known
+
+    def rename(self, source: str, destination: str):
+        """Update the index after `source` (file or directory) was renamed to
+        `destination` without its files changing. Nothing is walked or indexed."""
+        connection = self._connect()
+        with connection:
+            rename_paths(connection, "documents", source, destination)
+        connection.close()
+
+    def move(self, source: str, destination: str):
+        """Update the index after `source` (file or directory) was moved to
+        `destination`. Files not yet known are indexed in the background."""
+        self.rename(source, destination)
+        connection = self._connect()
+        known = {
+            row[0]
+            for row in connection.execute(
+                "SELECT path FROM documents WHERE path=? OR substr(path, 1, ?)=?",
+                (
+                    destination,
+                    len(destination.rstrip(os.sep)) + 1,
+                    destination.rstrip(os.sep) + os.sep,
+                ),
+            )
+        }
+        connection.close()
+        if os.path.isdir(destination):
+            for directory, _, fnames in os.walk(destination):
+                for fname in fnames:
+                    path = os.path.join(directory, fname)
+                    if path not in known:
+                        self.submit(path)
+        elif destination not in known:
+            self.submit(destination)
+
+    def remove(self, path: str):
+        """Remove `path` (a file or directory) from the index (text stays as long
+        as other paths share it)."""
+        connection = self._connect()
+        prefix = path.rstrip(os.sep) + os.sep
+        with connection:
+            connection.execute(
+                "DELETE FROM documents WHERE path=? OR substr(path, 1, ?)=?",
+                (path, len(prefix), prefix),
+            )
+            connection.execute(
+                "DELETE FROM contents WHERE content_hash NOT IN \
+(SELECT content_hash FROM documents)"
+            )
+        connection.close()
+
+    def search(
+        self, query: str, limit: int = SEARCH_RESULTS_LIMIT
+    ) -> List[Dict[str, Union[str, float]]]:
+        """Return the documents matching the FTS5 `query`, best matches first.
+        Documents deleted in the meantime are left out (and removed from the
+        index). Might throw sqlite3.OperationalError for invalid queries."""
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT documents.path, snippet(contents, 1, '[', ']', '…', 12), \
+bm25(contents) FROM contents JOIN documents \
+ON documents.content_hash = contents.content_hash \
+WHERE contents MATCH ? ORDER BY bm25(contents) LIMIT ?",
+                (query, limit),
+            ).fetchall()
+        finally:
+            connection.close()
+        results = []
+        for path, snippet, rank in rows:
+            if os.path.exists(path):
+                results.append({"path": path, "snippet": snippet, "rank": rank})
+            else:
+                self.remove(path)
+        return results
+
+    def close(self, wait: bool = True):
+        """Stop the background workers (waiting for pending files by default)."""
+        self.executor.shutdown(wait=wait)
+
+
+def get_archive_index(config: haconfig.Config) -> ArchiveIndex:
+    """Return this process' index for the configured database."""
+    index = _INDICES.get(config.storage.local.path)
+    if index is None:
+        index = ArchiveIndex(config)
+        _INDICES[config.storage.local.path] = index
+    return index
@@ -2,32 +2,40 @@
 primarily homework on NAS and some small helpers for day-to-day life."""
 import argparse
 import datetime
+import filecmp
 import os
 import re
 import shutil
+import sqlite3
+import zipfile
 from typing import Dict, List, Optional, Sequence
 
-import fileloghelper
-
-import home_automation.server.backend.state_manager
 import home_automation.utilities
 from home_automation import config as haconfig
+from home_automation import mail_outbox, tree_walker
+from home_automation.archive_middleware import (
+    ArchiveMiddleware,
+    SearchIndexArchiveMiddleware,
+    StatsArchiveMiddleware,
+    ThumbnailArchiveMiddleware,
+)
+from home_automation.archive_stats import get_archive_stats
 from home_automation.constants import ABBR_TO_SUBJECT, MONTH_TO_DIR
-from home_automation.server.backend import oauth2_helpers
+from home_automation.ignore_registry import get_ignore_registry
+from home_automation.quarantine import SUBSYSTEM_ARCHIVING, get_quarantine
+from home_automation.structured_logging import StructuredLogger
 
 BLACKLIST_FILES = [".DS_Store", "@eaDir"]
 BLACKLIST_EXT = ["aux", "log", "dvi"]
-
-TODAY = datetime.date.today()
-TRESHOLD_DATE = TODAY - datetime.timedelta(days=5)
-YEAR = str(TRESHOLD_DATE.year)
-MONTH = MONTH_TO_DIR[TRESHOLD_DATE.month]
+DEFAULT_THRESHOLD_DAYS = 5
+ARCHIVING_MAIL_DIGEST_KEY = "archiving"
 
 DATE_REGEX = (
     r"^[\w\s_\-]*(KW((?P<calendar_week>\d{1,2}))|"
     + r"(?P<date>(\d{2}\-\d{2}\-\d{4})|(\d{4}\-\d{2}\-\d{2})))[\w\s_\-]*\.pdf$"
 )
 YEAR_REGEX = r"^.+(?P<year>\d\d\d\d).+$"
+YEAR_DIR_REGEX = r"^\d{4}$"
 NO_TRANSFER_REGEX = r"^.*(?P<notransferflag>NO(_|-)?TRANSFER).*$"
 
 
@@ -39,24 +47,97 @@ class IsCompressedFileException(Exception):
     """An exception thrown when a file is already compressed."""
 
 
+def get_threshold_date(
+    threshold_days: int = DEFAULT_THRESHOLD_DAYS,
+    today: Optional[datetime.date] = None,
+) -> datetime.date:
+    """Return the date files without a parsable date are archived under
+    (`threshold_days` before `today`). Evaluated on every call so long-running
+    processes don't keep using the date they were started on."""
+    if today is None:
+        today = datetime.date.today()
+    return today - datetime.timedelta(days=threshold_days)
+
+
+def is_archivable_name(fname: str) -> bool:
+    """Return whether a directory entry called `fname` should be looked at
+    when archiving (not blacklisted, no synology `@` directory etc.)."""
+    ext = fname.split(".")[-1]
+    return (
+        (ext not in BLACKLIST_EXT)
+        and (not fname.startswith("@"))
+        and (fname not in BLACKLIST_FILES)
+    )
+
+
+class AppliedSubjects:
+    """The subject names (by abbreviation) the archive's directories were named
+    after when renaming them last, living in `storage.local`."""
+
+    path: str
+
+    def __init__(self, config: haconfig.Config):
+        self.path = config.storage.local.path
+        self._prepare_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _prepare_db(self):
+        """Create tables if necessary."""
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS applied_subjects \
+(abbreviation TEXT PRIMARY KEY, subject TEXT NOT NULL)"
+            )
+        connection.close()
+
+    def get(self) -> Dict[str, str]:
+        """Return {abbreviation: subject}, empty if nothing was renamed yet."""
+        connection = self._connect()
+        try:
+            return dict(
+                connection.execute("SELECT abbreviation, subject FROM applied_subjects")
+            )
+        finally:
+            connection.close()
+
+    def set(self, subjects: Dict[str, str]):
+        """Remember `subjects` ({abbreviation: subject}) as applied."""
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM applied_subjects")
+            connection.executemany(
+                "INSERT INTO applied_subjects VALUES (?, ?)", subjects.items()
+            )
+        connection.close()
+
+
 class ArchiveManager:  # pylint: disable=too-many-instance-attributes
     """ArchiveManager manages the archive. Wait, what?"""
 
     config: haconfig.Config
-    logger: fileloghelper.Logger
+    logger: StructuredLogger
     transferred_files: List[str]
     not_transferred_files: List[str]
     debug: bool
     abbr_to_subject: Dict[str, str]
+    threshold_days: int
+    middleware: List[ArchiveMiddleware]
 
     def __init__(self, config: haconfig.Config, debug=False):
         self.config = config
-        self.logger = fileloghelper.Logger(
-            os.path.join(config.log_dir, "archive_manager.log"), autosave=debug
+        self.logger = StructuredLogger(
+            os.path.join(config.log_dir, "archive_manager.log"),
+            config.logging,
+            debug=debug,
         )
         self.transferred_files = []
         self.not_transferred_files = []
         self.debug = debug
+        self.threshold_days = config.archiving.threshold_days
+        self.middleware = []
         # merge operator just in python 3.9+
         self.abbr_to_subject = {
             **ABBR_TO_SUBJECT,
@@ -94,7 +175,7 @@ class ArchiveManager:  # pylint: disable=too-many-instance-attributes
             if calendar_week is not None:
                 # https://stackoverflow.com/questions/17087314/get-date-from-week-number,
                 # using isoweeks
-                year = year_str if year_str else TODAY.year
+                year = year_str if year_str else datetime.date.today().year
                 date = datetime.datetime.strptime(
                     f"{year}-W{calendar_week.zfill(2)}-1", "%G-W%V-%u"
                 )
@@ -135,14 +216,15 @@ class ArchiveManager:  # pylint: disable=too-many-instance-attributes
                     path.startswith(self.config.homework_dir)
                     or not is_in_lowest_level_archive
                 ):
-                    year = YEAR
-                    month = MONTH
+                    threshold_date = get_threshold_date(self.threshold_days)
+                    year = str(threshold_date.year)
+                    month = MONTH_TO_DIR[threshold_date.month]
                     return return_timestamped_filepath()
                 # Put files that were in the wrong subject folder in the same
                 # substructure (e.g. /Subject/2020) but for another subject
-                for sub in self.abbr_to_subject.values():
-                    path = path.replace(sub, subject)
-                return path
+                parts = os.path.relpath(path, a_dir).split(os.sep)
+                parts[0] = subject
+                return os.path.join(a_dir, *parts)
             return return_timestamped_filepath()
         except (InvalidFormattingException, TypeError) as error:
             self.logger.warning(f"Error parsing '{path}'", False)
@@ -160,71 +242,148 @@ class ArchiveManager:  # pylint: disable=too-many-instance-attributes
             destination = self.get_destination_for_file(fname)
             if destination == fname:
                 return
-            dest_dir = os.path.split(destination)[-1]
+            dest_dir = os.path.split(destination)[0]
             if not os.path.isdir(dest_dir):
                 os.makedirs(dest_dir)
             self.logger.debug(
                 f"Trying to move '{fname}' to '{destination}'", self.debug
             )
-            shutil.move(fname, destination)
-            self.logger.success(
-                f"Transferred file from '{fname}' to '{destination}'", True
-            )
             small_f = os.path.join(
                 self.config.homework_dir, fname.replace(".pdf", ".small.pdf")
             )
-            if os.path.isfile(small_f):
-                os.remove(small_f)
-                self.logger.debug(f"Deleted {small_f}")
+            with get_ignore_registry(self.config).ignoring(
+                [fname, small_f], [fname] if os.path.isdir(fname) else []
+            ):
+                shutil.move(fname, destination)
+                self.logger.success(
+                    f"Transferred file from '{fname}' to '{destination}'", True
+                )
+                self.apply_middleware(fname, destination)
+                if os.path.isfile(small_f):
+                    os.remove(small_f)
+                    self.logger.debug(f"Deleted {small_f}")
             self.transferred_files.append(fname)
         except InvalidFormattingException as error:
             self.not_transferred_files.append(fname)
             raise error
 
-    def transfer_directory(self, path: str):
-        """Transfer all files and directories in given directory."""
+    def apply_middleware(self, source: str, destination: str):
+        """Let all middleware act on `source` having been moved to `destination`."""
+        for middleware in self.middleware:
+            if self.debug:
+                self.logger.debug(
+                    f"Invoking middleware: '{middleware.__class__.__name__}' \
+for '{destination}'"
+                )
+            try:
+                middleware.did_transfer(source, destination)
+            except Exception as error:  # pylint: disable=broad-except
+                self.logger.handle_exception(error)
 
-        def handle_file(filepath):
+    def apply_rename_middleware(self, source: str, destination: str):
+        """Let all middleware act on the directory `source` having been renamed
+        to (or merged into) `destination` without its files changing."""
+        for middleware in self.middleware:
             try:
-                if os.path.isdir(filepath):
-                    did_move_invalidly_formatted_directory = False
-                    # ...with validly formatted files
-                    subject = None
-                    try:
-                        subject, _, _ = self.parse_filename(filepath)
-                    except InvalidFormattingException:
-                        did_move_invalidly_formatted_directory = True
-                    if subject is not None:
-                        self.transfer_file(filepath)
-                    else:
-                        self.transfer_directory(filepath)
-                        if (
-                            did_move_invalidly_formatted_directory
-                            and os.path.split(filepath)[0] == self.config.homework_dir
-                        ):
-                            os.removedirs(filepath)
-                else:
-                    self.transfer_file(filepath)
-            except InvalidFormattingException:
-                self.logger.error(f"Invalid formatting on {filepath}")
-            except IsCompressedFileException:
-                self.logger.warning(f"Is compressed file: {filepath}", False)
+                middleware.did_rename(source, destination)
             except Exception as error:  # pylint: disable=broad-except
-                # better safe than sorry
-                self.logger.error(f"Error occured when transferring {filepath}.")
                 self.logger.handle_exception(error)
 
+    def apply_removal_middleware(self, path: str):
+        """Let all middleware act on `path` having been removed from the archive."""
+        for middleware in self.middleware:
+            try:
+                middleware.did_remove(path)
+            except Exception as error:  # pylint: disable=broad-except
+                self.logger.handle_exception(error)
+
+    def register_middleware(self, middleware: ArchiveMiddleware):
+        """Register a new `ArchiveMiddleware` to be called whenever a file gets moved."""
+        self.middleware.append(middleware)
+        self.logger.info(
+            f"Registered middleware '{middleware.__class__.__name__}'", self.debug
+        )
+
+    def transfer_entry(self, filepath: str):
+        """Transfer a single file or directory found while walking a directory.
+        Directories with a parsable subject are moved as a whole, others are
+        walked recursively. Errors are logged, not raised, and entries failing
+        unexpectedly are skipped while they are quarantined."""
+        quarantine = get_quarantine(self.config)
+        if quarantine.is_quarantined(filepath, SUBSYSTEM_ARCHIVING):
+            self.logger.debug(
+                f"Skipping {filepath} as archiving it failed before", self.debug
+            )
+            return
+        try:
+            if os.path.isdir(filepath):
+                did_move_invalidly_formatted_directory = False
+                # ...with validly formatted files
+                subject = None
+                try:
+                    subject, _, _ = self.parse_filename(filepath)
+                except InvalidFormattingException:
+                    did_move_invalidly_formatted_directory = True
+                if subject is not None:
+                    self.transfer_file(filepath)
+                else:
+                    self.transfer_directory(filepath)
+                    if (
+                        did_move_invalidly_formatted_directory
+                        and os.path.split(filepath)[0] == self.config.homework_dir
+                    ):
+                        with get_ignore_registry(self.config).ignoring([filepath]):
+                            os.removedirs(filepath)
+            else:
+                self.transfer_file(filepath)
+        except InvalidFormattingException:
+            self.logger.error(f"Invalid formatting on {filepath}")
+        except IsCompressedFileException:
+            self.logger.warning(f"Is compressed file: {filepath}", False)
+        except Exception as error:  # pylint: disable=broad-except
+            # better safe than sorry
+            quarantine.record_failure(filepath, SUBSYSTEM_ARCHIVING, error)
+            self.logger.error(f"Error occured when transferring {filepath}.")
+            self.logger.handle_exception(error)
+        else:
+            quarantine.record_success(filepath, SUBSYSTEM_ARCHIVING)
+
+    def transfer_directory(self, path: str):
+        """Transfer all files and directories in given directory. Directories
+        with a parsable subject are moved as a whole, the others are walked (in
+        parallel, see `tree_walker`) and removed afterwards if in `homework_dir`
+        and empty."""
         self.logger.context = "archiving"
         self.logger.debug(f"Transferring/Archiving {path}", self.debug)
-        for fname in os.listdir(path):
-            filepath = os.path.join(path, fname)
-            ext = fname.split(".")[-1]
-            if (
-                (ext not in BLACKLIST_EXT)
-                and (not fname.startswith("@"))
-                and (fname not in BLACKLIST_FILES)
-            ):
-                handle_file(filepath)
+        walked_dirs: Dict[str, None] = {}  # ordered set
+
+        def descend(entry: os.DirEntry) -> bool:
+            try:
+                self.parse_filename(entry.path)
+            except InvalidFormattingException:
+                walked_dirs[entry.path] = None
+                return True
+            return False
+
+        def onerror(error: OSError):
+            self.logger.error(f"Error reading {error.filename}.")
+            self.logger.handle_exception(error)
+
+        for _, entries in tree_walker.walk(
+            path, descend, is_archivable_name, onerror=onerror
+        ):
+            for entry in entries:
+                if entry.path not in walked_dirs:
+                    self.transfer_entry(entry.path)
+        for directory in reversed(walked_dirs):
+            if os.path.split(directory)[0] != self.config.homework_dir:
+                continue
+            try:
+                with get_ignore_registry(self.config).ignoring([directory]):
+                    os.removedirs(directory)
+            except OSError as error:
+                self.logger.error(f"Error removing {directory}.")
+                self.logger.handle_exception(error)
 
     def transfer_all_files(self):
         """Transfer all files from the root directory (not
@@ -233,8 +392,9 @@ class ArchiveManager:  # pylint: disable=too-many-instance-attributes
         self.transfer_directory(self.config.homework_dir)
         self.send_archiving_mail()
 
-    def send_archiving_mail(self):
-        """Send mail to notify that the archiving process has finished."""
+    def send_archiving_mail(self, mail_subject: str = "[NAS] Archiving at end of week"):
+        """Queue a mail notifying that the archiving process has finished
+        (see `mail_outbox`)."""
         if len(self.transferred_files) == 0 and len(self.not_transferred_files) == 0:
             self.logger.info("No files transferred or failed to be transferred.")
             return
@@ -246,18 +406,268 @@ class ArchiveManager:  # pylint: disable=too-many-instance-attributes
 ({len(self.not_transferred_files)}) were not archived:\n"
             mail_body += "\n".join(self.not_transferred_files)
         mail_body += f"\nThat's {len(self.transferred_files)} files."
-        mail_subject = "[NAS] Archiving at end of week"
-        state_manager = home_automation.server.backend.state_manager.StateManager(
-            self.config
+        mail_outbox.MailOutbox(self.config).enqueue(
+            mail_subject, mail_body, digest_key=ARCHIVING_MAIL_DIGEST_KEY
         )
-        creds = oauth2_helpers.get_google_oauth2_credentials(state_manager)
-        home_automation.utilities.send_mail(creds, mail_subject, mail_body)
-        self.logger.success("Sent mail notifying of the archiving process.")
+        self.logger.success("Queued mail notifying of the archiving process.")
+
+    def applied_subjects(self) -> Dict[str, str]:
+        """Return {abbreviation: subject} the archive's subject directories were
+        last renamed to, the default subjects if they never were."""
+        return {**ABBR_TO_SUBJECT, **AppliedSubjects(self.config).get()}
+
+    def detect_subject_renames(self) -> Dict[str, str]:
+        """Return {old subject directory: new subject directory} for every
+        top-level directory in the archive named after a subject whose
+        abbreviation now maps to another name (see `subject_abbreviations`
+        and `applied_subjects`)."""
+        renames = {}
+        current_subjects = set(self.abbr_to_subject.values())
+        for abbreviation, old in self.applied_subjects().items():
+            new = self.abbr_to_subject.get(abbreviation)
+            if (
+                new is not None
+                and new != old
+                and old not in current_subjects
+                and os.path.isdir(os.path.join(self.config.archive_dir, old))
+            ):
+                renames[old] = new
+        return renames
+
+    def _merge_directory(self, source: str, destination: str):
+        """Move everything in `source` to `destination`. Subtrees not present in
+        `destination` are renamed as a whole, only conflicting files are moved
+        one by one (identical duplicates are dropped, others get a suffix)."""
+        for fname in os.listdir(source):
+            src = os.path.join(source, fname)
+            dest = os.path.join(destination, fname)
+            if not os.path.lexists(dest):
+                os.rename(src, dest)
+            elif os.path.isdir(src) and os.path.isdir(dest):
+                self._merge_directory(src, dest)
+            elif os.path.isfile(src) and filecmp.cmp(src, dest, shallow=False):
+                self.apply_removal_middleware(src)
+                os.remove(src)
+                self.logger.debug(f"Dropped duplicate '{src}' of '{dest}'", self.debug)
+            else:
+                base, ext = os.path.splitext(fname)
+                counter = 2
+                while os.path.lexists(dest):
+                    dest = os.path.join(destination, f"{base} ({counter}){ext}")
+                    counter += 1
+                shutil.move(src, dest)
+                self.apply_middleware(src, dest)
+                self.logger.warning(
+                    f"Conflict when merging, moved '{src}' to '{dest}'", False
+                )
+        os.rmdir(source)
+
+    def rename_subject_directory(self, old: str, new: str):
+        """Rename the archive's subject directory `old` to `new`, merging
+        with `new` if it already exists."""
+        source = os.path.join(self.config.archive_dir, old)
+        destination = os.path.join(self.config.archive_dir, new)
+        if os.path.isdir(destination):
+            self._merge_directory(source, destination)
+            self.logger.success(f"Merged subject '{old}' into '{new}'", True)
+        else:
+            os.rename(source, destination)
+            self.logger.success(f"Renamed subject '{old}' to '{new}'", True)
+        self.apply_rename_middleware(source, destination)
+
+    def rename_subjects(self):
+        """Apply changes of `subject_abbreviations` to the archive by renaming
+        whole subject directories instead of moving every file on its own."""
+        applied = self.applied_subjects()
+        failed = set()
+        for old, new in self.detect_subject_renames().items():
+            try:
+                self.rename_subject_directory(old, new)
+            except OSError as error:
+                failed.add(old)
+                self.logger.error(f"Error renaming subject '{old}' to '{new}'.")
+                self.logger.handle_exception(error)
+        subjects = dict(self.abbr_to_subject)
+        for abbreviation, subject in applied.items():
+            if subject in failed:  # retried next time
+                subjects[abbreviation] = subject
+        AppliedSubjects(self.config).set(subjects)
+
+    def _cold_tier_dir(self) -> str:
+        directory = self.config.archiving.cold_tier.directory
+        if not directory:
+            raise haconfig.ConfigError("archiving.cold_tier.directory not configured.")
+        return directory
+
+    def get_cold_tier_path(self, subject: str, year: str) -> str:
+        """Return the path of the container holding `subject`'s `year`."""
+        return os.path.join(self._cold_tier_dir(), subject, f"{year}.zip")
+
+    def _files_to_pack(self, year_dir: str) -> Dict[str, str]:
+        """Return {name in container: path} for all files below `year_dir`. When
+        keeping only compressed files, originals with a `.small.pdf` are left out."""
+        keep_only_compressed = self.config.archiving.cold_tier.keep_only_compressed
+        files = {}
+        for directory, _, fnames in os.walk(year_dir):
+            for fname in fnames:
+                if not is_archivable_name(fname):
+                    continue
+                if (
+                    keep_only_compressed
+                    and fname.endswith(".pdf")
+                    and not fname.endswith(".small.pdf")
+                    and fname[:-4] + ".small.pdf" in fnames
+                ):
+                    continue
+                path = os.path.join(directory, fname)
+                files[os.path.relpath(path, year_dir)] = path
+        return files
+
+    @staticmethod
+    def _is_packed(zfile: zipfile.ZipFile, name: str, path: str) -> bool:
+        """Return whether the container's `name` has the same content as `path`."""
+        if zfile.getinfo(name).file_size != os.path.getsize(path):
+            return False
+        with zfile.open(name) as packed, open(path, "rb") as file:
+            while True:
+                chunk = file.read(1024 * 1024)
+                if chunk != packed.read(len(chunk)):
+                    return False
+                if not chunk:
+                    return True
+
+    def _remove_packed(self, year_dir: str, packed: List[str]) -> bool:
+        """Remove the `packed` files, originals left out in favor of packed
+        compressed versions and blacklisted files from `year_dir`. Anything else
+        (e.g. created while packing) is kept. Return whether `year_dir` is gone."""
+        packed_set = set(packed)
+        for path in packed:
+            os.remove(path)
+        for directory, dnames, fnames in os.walk(year_dir, topdown=False):
+            for dname in dnames:
+                if not is_archivable_name(dname):
+                    shutil.rmtree(os.path.join(directory, dname))
+            for fname in fnames:
+                path = os.path.join(directory, fname)
+                if not is_archivable_name(fname) or (
+                    fname.endswith(".pdf")
+                    and path[:-4] + ".small.pdf" in packed_set
+                    and self.config.archiving.cold_tier.keep_only_compressed
+                ):
+                    os.remove(path)
+            if not os.listdir(directory):
+                os.rmdir(directory)
+        if os.path.exists(year_dir):
+            self.logger.warning(
+                f"Kept '{year_dir}' as it contains files not in the cold tier", False
+            )
+            return False
+        return True
+
+    def pack_year(self, subject: str, year: str) -> str:
+        """Pack `archive_dir/subject/year` into a single zip container in the
+        cold tier (appending to an existing one) and remove what was packed.
+        Files are stored uncompressed (PDFs hardly compress anyway), so every
+        file can be read directly via the container's central directory.
+        Files already in the container are dropped if identical and stored
+        with a suffix (like `PH HA (2).pdf`) otherwise."""
+        year_dir = os.path.join(self.config.archive_dir, subject, year)
+        container = self.get_cold_tier_path(subject, year)
+        os.makedirs(os.path.dirname(container), exist_ok=True)
+        tmp_container = container + ".tmp"
+        if os.path.isfile(container):
+            shutil.copyfile(container, tmp_container)
+            mode = "a"
+        else:
+            mode = "w"
+        packed = {}
+        try:
+            with zipfile.ZipFile(tmp_container, mode, zipfile.ZIP_STORED) as zfile:
+                existing = set(zfile.namelist())
+                for name, path in sorted(self._files_to_pack(year_dir).items()):
+                    if name in existing and self._is_packed(zfile, name, path):
+                        self.logger.debug(
+                            f"Dropped duplicate '{path}' of '{name}'", self.debug
+                        )
+                        packed[name] = path
+                        continue
+                    base, ext = os.path.splitext(name)
+                    counter = 2
+                    while name in existing:
+                        name = f"{base} ({counter}){ext}"
+                        counter += 1
+                    if counter > 2:
+                        self.logger.warning(
+                            f"Conflict in '{container}', stored '{path}' as '{name}'",
+                            False,
+                        )
+                    zfile.write(path, name)
+                    existing.add(name)
+                    packed[name] = path
+            with zipfile.ZipFile(tmp_container, "r") as zfile:
+                corrupt = zfile.testzip()
+                if corrupt is not None:
+                    raise zipfile.BadZipFile(
+                        f"Corrupt entry '{corrupt}' in {container}"
+                    )
+                for name, path in packed.items():
+                    if not self._is_packed(zfile, name, path):
+                        raise zipfile.BadZipFile(
+                            f"'{name}' in {container} differs from '{path}'"
+                        )
+            os.replace(tmp_container, container)
+        finally:
+            if os.path.exists(tmp_container):
+                os.remove(tmp_container)
+        if self._remove_packed(year_dir, list(packed.values())):
+            self.apply_removal_middleware(year_dir)
+        else:
+            for path in packed.values():
+                self.apply_removal_middleware(path)
+        self.logger.success(f"Moved '{year_dir}' to cold tier '{container}'", True)
+        return container
+
+    def tier_old_years(self, today: Optional[datetime.date] = None) -> List[str]:
+        """Move every subject's school years older than
+        `archiving.cold_tier.min_age_years` to the cold tier.
+        Return the paths of the containers written to."""
+        self._cold_tier_dir()
+        if today is None:
+            today = datetime.date.today()
+        oldest_hot_year = today.year - self.config.archiving.cold_tier.min_age_years
+        self.logger.context = "tiering"
+        containers = []
+        for subject in sorted(os.listdir(self.config.archive_dir)):
+            subject_dir = os.path.join(self.config.archive_dir, subject)
+            if not is_archivable_name(subject) or not os.path.isdir(subject_dir):
+                continue
+            for year in sorted(os.listdir(subject_dir)):
+                if not re.match(YEAR_DIR_REGEX, year) or int(year) >= oldest_hot_year:
+                    continue
+                if not os.path.isdir(os.path.join(subject_dir, year)):
+                    continue
+                try:
+                    containers.append(self.pack_year(subject, year))
+                except (OSError, zipfile.BadZipFile) as error:
+                    self.logger.error(f"Error moving {subject}/{year} to cold tier.")
+                    self.logger.handle_exception(error)
+        return containers
+
+    def list_cold_tier(self, subject: str, year: str) -> List[str]:
+        """List the files of `subject`'s `year` in the cold tier."""
+        with zipfile.ZipFile(self.get_cold_tier_path(subject, year)) as zfile:
+            return zfile.namelist()
+
+    def read_from_cold_tier(self, subject: str, year: str, name: str) -> bytes:
+        """Read a single file from the cold tier without extracting the container."""
+        with zipfile.ZipFile(self.get_cold_tier_path(subject, year)) as zfile:
+            return zfile.read(name)
 
     def reorganize_all_files(self):
         """For every file, use `transfer_file` to reorganize it."""
         self.logger.context = "reorganization"
         self.logger.debug("Reorganizing!")
+        self.rename_subjects()
         self.transfer_directory(self.config.archive_dir)
         self.logger.info(f"Transferred {len(self.transferred_files)} files:", True)
         for fname in self.transferred_files:
@@ -265,18 +675,48 @@ class ArchiveManager:  # pylint: disable=too-many-instance-attributes
         # I mean, common!
 
 
+def create_manager(config: haconfig.Config, debug=False) -> ArchiveManager:
+    """Create an `ArchiveManager` with all middleware enabled in `config` registered."""
+    manager = ArchiveManager(config, debug)
+    manager.register_middleware(StatsArchiveMiddleware(config, manager.logger))
+    if config.search.enabled:
+        manager.register_middleware(
+            SearchIndexArchiveMiddleware(config, manager.logger)
+        )
+    if config.thumbnails.enabled:
+        manager.register_middleware(ThumbnailArchiveMiddleware(config, manager.logger))
+    return manager
+
+
 def archive(config: haconfig.Config):
     """Archive with the default config loaded (still from filesystem)"""
     home_automation.utilities.drop_privileges(config)
-    manager = ArchiveManager(config)
-    manager.transfer_all_files()
+    manager = create_manager(config)
+    try:
+        manager.transfer_all_files()
+    finally:
+        manager.logger.close()
 
 
 def reorganize(config: haconfig.Config):
     """Reorganize with the default config loaded (still from filesystem)"""
     home_automation.utilities.drop_privileges(config)
-    manager = ArchiveManager(config)
-    manager.reorganize_all_files()
+    manager = create_manager(config)
+    try:
+        manager.reorganize_all_files()
+    finally:
+        manager.logger.close()
+
+
+def tier(config: haconfig.Config):
+    """Move old school years to the cold tier with the default config loaded
+    (still from filesystem)"""
+    home_automation.utilities.drop_privileges(config)
+    manager = create_manager(config)
+    try:
+        manager.tier_old_years()
+    finally:
+        manager.logger.close()
 
 
 def main(arguments: Optional[Sequence[str]] = None):
@@ -285,7 +725,7 @@ def main(arguments: Optional[Sequence[str]] = None):
         description="Archive files from HAs or reorganize Archive."
     )
     parser.add_argument(
-        "action", type=str, help="Action to perform (archive, reorganize)"
+        "action", type=str, help="Action to perform (archive, reorganize, tier, stats)"
     )
     parser.add_argument(
         "--verbose",
@@ -299,16 +739,19 @@ def main(arguments: Optional[Sequence[str]] = None):
     args = parser.parse_args(arguments)
     config_data = haconfig.load_config(path=args.config)
     home_automation.utilities.drop_privileges(config_data)
-    manager = ArchiveManager(config_data, args.verbose)
+    manager = create_manager(config_data, args.verbose)
     manager.logger.header(True, True)
-    manager.logger.autosave = manager.debug
     if args.action == "archive":
         manager.transfer_all_files()
     elif args.action == "reorganize":
         manager.reorganize_all_files()
+    elif args.action == "tier":
+        manager.tier_old_years()
+    elif args.action == "stats":
+        get_archive_stats(config_data).rebuild()
     else:
         parser.print_help()
-    manager.logger.save()
+    manager.logger.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,91 @@
+"""The middleware framework used to act on each file (or directory) being archived."""
+import os
+
+from home_automation import config as haconfig
+from home_automation.archive_index import get_archive_index
+from home_automation.archive_stats import KEY_DEPTH, get_archive_stats
+from home_automation.structured_logging import StructuredLogger
+from home_automation.thumbnails import get_thumbnail_cache
+
+
+class ArchiveMiddleware:
+    """Middleware's `.did_transfer` method is called for each file (or directory)
+    `ArchiveManager` moved. It must not block for long, so expensive work should
+    be handed off to a background worker."""
+
+    logger: StructuredLogger
+    config: haconfig.Config
+
+    def __init__(self, config: haconfig.Config, logger: StructuredLogger):
+        self.config = config
+        self.logger = logger
+
+    def did_transfer(self, source: str, destination: str):  # pylint: disable=R0102
+        """Act on `source` having been moved to `destination`."""
+        raise NotImplementedError()
+
+    def did_rename(self, source: str, destination: str):
+        """Act on the directory `source` having been renamed to `destination`
+        (or merged into it) without its files changing, so nothing has to be
+        walked. Defaults to `did_transfer`."""
+        self.did_transfer(source, destination)
+
+    def did_remove(self, path: str):  # pylint: disable=unused-argument
+        """Act on `path` having been removed from the archive (e.g. when moved
+        to the cold tier). Files dropped while merging directories are still
+        there when this is called. Optional."""
+        return
+
+
+class SearchIndexArchiveMiddleware(ArchiveMiddleware):
+    """Keeps the full-text search index in sync with the archive."""
+
+    def did_transfer(self, source: str, destination: str):
+        get_archive_index(self.config).move(source, destination)
+
+    def did_rename(self, source: str, destination: str):
+        get_archive_index(self.config).rename(source, destination)
+
+    def did_remove(self, path: str):
+        get_archive_index(self.config).remove(path)
+
+
+class StatsArchiveMiddleware(ArchiveMiddleware):
+    """Keeps the archive's usage statistics up to date."""
+
+    def did_transfer(self, source: str, destination: str):
+        stats = get_archive_stats(self.config)
+        depth = stats.depth(destination)
+        if os.path.isdir(destination) and depth is not None and depth <= KEY_DEPTH:
+            # whole subjects/years/months moved (and possibly merged)
+            source_depth = stats.depth(source)
+            if source_depth is not None and source_depth <= KEY_DEPTH:
+                stats.forget(source)
+            stats.recount(destination)
+        else:
+            stats.record_move(source, destination)
+
+    def did_rename(self, source: str, destination: str):
+        stats = get_archive_stats(self.config)
+        depth = stats.depth(destination)
+        if depth is not None and depth <= KEY_DEPTH and depth == stats.depth(source):
+            stats.record_rename(source, destination)
+        else:
+            self.did_transfer(source, destination)
+
+    def did_remove(self, path: str):
+        stats = get_archive_stats(self.config)
+        if os.path.isfile(path):
+            stats.record_removed(path)
+        else:
+            stats.forget(path)
+
+
+class ThumbnailArchiveMiddleware(ArchiveMiddleware):
+    """Renders previews of newly archived files (in the background)."""
+
+    def did_transfer(self, source: str, destination: str):
+        get_thumbnail_cache(self.config).submit(destination)
+
+    def did_rename(self, source: str, destination: str):
+        get_thumbnail_cache(self.config).rename(source, destination)
@@ -0,0 +1,255 @@
+"""Rolled-up usage statistics of the archive (files, bytes and compressed
+bytes per subject/year/month), kept up to date incrementally in `storage.local`
+so they never have to be computed by walking the archive on request."""
+import os
+import sqlite3
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from home_automation import config as haconfig
+
+Key = Tuple[str, str, str]
+Usage = List[int]  # [files, bytes, compressed_bytes]
+
+COLUMNS = ["files", "bytes", "compressed_bytes"]
+KEY_COLUMNS = ["subject", "year", "month"]
+KEY_DEPTH = 3
+ADD_ON_CONFLICT = "ON CONFLICT (subject, year, month) DO UPDATE SET \
+files=files+excluded.files, bytes=bytes+excluded.bytes, \
+compressed_bytes=compressed_bytes+excluded.compressed_bytes"
+
+_STATS: Dict[str, "ArchiveStats"] = {}
+
+
+def is_compressed_file(path: str) -> bool:
+    """Compressed copies are counted in `compressed_bytes`, not as files of their own."""
+    return path.endswith(".small.pdf")
+
+
+class ArchiveStats:
+    """Usage counters of the archive, one row per subject/year/month.
+    Files that aren't in a month directory are counted with an empty month
+    (or year), files outside of `archive_dir` aren't counted at all."""
+
+    config: haconfig.Config
+    path: str
+
+    def __init__(self, config: haconfig.Config):
+        self.config = config
+        self.path = config.storage.local.path
+        self._prepare_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _prepare_db(self):
+        """Create tables if necessary."""
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS archive_usage \
+(subject TEXT NOT NULL, year TEXT NOT NULL, month TEXT NOT NULL, \
+files INTEGER NOT NULL DEFAULT 0, bytes INTEGER NOT NULL DEFAULT 0, \
+compressed_bytes INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (subject, year, month))"
+            )
+        connection.close()
+
+    def _relative_parts(self, path: str) -> Optional[List[str]]:
+        archive_dir = os.path.abspath(self.config.archive_dir)
+        path = os.path.abspath(path)
+        if os.path.commonpath([archive_dir, path]) != archive_dir:
+            return None
+        relpath = os.path.relpath(path, archive_dir)
+        if relpath == ".":
+            return []
+        return relpath.split(os.sep)
+
+    def depth(self, path: str) -> Optional[int]:
+        """Return how many levels deep `path` is in the archive, None if it isn't in it."""
+        parts = self._relative_parts(path)
+        return None if parts is None else len(parts)
+
+    def key_for(self, path: str) -> Optional[Key]:
+        """Return the (subject, year, month) file `path` is counted under,
+        None if it isn't in the archive."""
+        parts = self._relative_parts(path)
+        if not parts:
+            return None
+        directories = parts[:-1][:KEY_DEPTH]
+        directories += [""] * (KEY_DEPTH - len(directories))
+        return directories[0], directories[1], directories[2]
+
+    @staticmethod
+    def _walk(path: str) -> Iterator[Tuple[str, int]]:
+        """Yield (path relative to `path`, size) of `path` or all files below it."""
+        if os.path.isfile(path):
+            yield "", os.path.getsize(path)
+            return
+        for directory, _, fnames in os.walk(path):
+            for fname in fnames:
+                fpath = os.path.join(directory, fname)
+                try:
+                    yield os.path.relpath(fpath, path), os.path.getsize(fpath)
+                except FileNotFoundError:
+                    continue
+
+    def _add(
+        self, connection: sqlite3.Connection, usage: Dict[Key, Usage], sign: int = 1
+    ):
+        connection.executemany(
+            f"INSERT INTO archive_usage VALUES (?, ?, ?, ?, ?, ?) {ADD_ON_CONFLICT}",
+            [
+                (*key, sign * files, sign * size, sign * compressed)
+                for key, (files, size, compressed) in usage.items()
+            ],
+        )
+        connection.execute(
+            "DELETE FROM archive_usage WHERE files<=0 AND bytes<=0 AND compressed_bytes<=0"
+        )
+
+    def _delete_below(self, connection: sqlite3.Connection, path: str):
+        """Delete the rows of everything below directory `path` (at most
+        `KEY_DEPTH` levels deep in the archive)."""
+        parts = self._relative_parts(path)
+        if parts is None:
+            return
+        if len(parts) > KEY_DEPTH:
+            raise ValueError(f"'{path}' is more than {KEY_DEPTH} levels deep.")
+        conditions = [f"{column}=?" for column in KEY_COLUMNS[: len(parts)]]
+        where = " AND ".join(conditions) if conditions else "1"
+        connection.execute(f"DELETE FROM archive_usage WHERE {where}", parts)
+
+    @staticmethod
+    def _count(usage: Dict[Key, Usage], key: Optional[Key], path: str, size: int):
+        if key is None:
+            return
+        counters = usage.setdefault(key, [0, 0, 0])
+        if is_compressed_file(path):
+            counters[2] += size
+        else:
+            counters[0] += 1
+            counters[1] += size
+
+    def record_added(self, path: str):
+        """Count `path` (file or directory), which just appeared in the archive."""
+        self.record_move(None, path)
+
+    def record_move(self, source: Optional[str], destination: str):
+        """Count `destination` (file or directory), which was just moved there from
+        `source`. If `source` was in the archive, its counters are decreased."""
+        added: Dict[Key, Usage] = {}
+        removed: Dict[Key, Usage] = {}
+        for relpath, size in self._walk(destination):
+            dest_path = os.path.join(destination, relpath) if relpath else destination
+            self._count(added, self.key_for(dest_path), dest_path, size)
+            if source is not None:
+                src_path = os.path.join(source, relpath) if relpath else source
+                self._count(removed, self.key_for(src_path), src_path, size)
+        connection = self._connect()
+        with connection:
+            self._add(connection, removed, -1)
+            self._add(connection, added)
+        connection.close()
+
+    def record_removed(self, path: str):
+        """Uncount the file `path`, which is about to be removed from the archive."""
+        usage: Dict[Key, Usage] = {}
+        self._count(usage, self.key_for(path), path, os.path.getsize(path))
+        connection = self._connect()
+        with connection:
+            self._add(connection, usage, -1)
+        connection.close()
+
+    def record_rename(self, source: str, destination: str):
+        """Move the counters of directory `source` to `destination` (at the same
+        depth, at most `KEY_DEPTH` levels deep), which it was renamed to (or merged
+        into) without its files changing. Nothing is walked."""
+        source_parts = self._relative_parts(source)
+        destination_parts = self._relative_parts(destination)
+        if (
+            source_parts is None
+            or destination_parts is None
+            or len(source_parts) != len(destination_parts)
+            or len(source_parts) > KEY_DEPTH
+        ):
+            raise ValueError(f"Can't rename '{source}' to '{destination}'.")
+        if source_parts == destination_parts:
+            return
+        depth = len(source_parts)
+        selected = ", ".join(["?"] * depth + KEY_COLUMNS[depth:] + COLUMNS)
+        where = " AND ".join(f"{column}=?" for column in KEY_COLUMNS[:depth])
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                f"INSERT INTO archive_usage SELECT {selected} FROM archive_usage \
+WHERE {where} {ADD_ON_CONFLICT}",
+                destination_parts + source_parts,
+            )
+            self._delete_below(connection, source)
+        connection.close()
+
+    def recount(self, directory: str):
+        """Recount everything below `directory` (at most `KEY_DEPTH` levels deep),
+        e.g. after it was merged with another one."""
+        usage: Dict[Key, Usage] = {}
+        for relpath, size in self._walk(directory):
+            path = os.path.join(directory, relpath)
+            self._count(usage, self.key_for(path), path, size)
+        connection = self._connect()
+        with connection:
+            self._delete_below(connection, directory)
+            self._add(connection, usage)
+        connection.close()
+
+    def forget(self, directory: str):
+        """Drop the counters of `directory` (at most `KEY_DEPTH` levels deep),
+        which was removed from the archive."""
+        connection = self._connect()
+        with connection:
+            self._delete_below(connection, directory)
+        connection.close()
+
+    def rebuild(self):
+        """Recount the whole archive."""
+        self.recount(self.config.archive_dir)
+
+    def usage(self) -> Dict[str, Dict]:
+        """Return {"total": {...}, "subjects": {subject: {"total": {...},
+        "years": {year: {"total": {...}, "months": {month: {...}}}}}}}."""
+
+        def empty() -> Dict[str, int]:
+            return {column: 0 for column in COLUMNS}
+
+        def add(total: Dict[str, int], values: Dict[str, int]):
+            for column in COLUMNS:
+                total[column] += values[column]
+
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT subject, year, month, files, bytes, compressed_bytes \
+FROM archive_usage ORDER BY subject, year, month"
+            ).fetchall()
+        finally:
+            connection.close()
+        result: Dict[str, Dict] = {"total": empty(), "subjects": {}}
+        for subject, year, month, *counters in rows:
+            values = dict(zip(COLUMNS, counters))
+            subject_usage = result["subjects"].setdefault(
+                subject, {"total": empty(), "years": {}}
+            )
+            year_usage = subject_usage["years"].setdefault(
+                year, {"total": empty(), "months": {}}
+            )
+            year_usage["months"][month] = values
+            for total in (year_usage["total"], subject_usage["total"], result["total"]):
+                add(total, values)
+        return result
+
+
+def get_archive_stats(config: haconfig.Config) -> ArchiveStats:
+    """Return this process' statistics for the configured database."""
+    stats = _STATS.get(config.storage.local.path)
+    if stats is None:
+        stats = ArchiveStats(config)
+        _STATS[config.storage.local.path] = stats
+    return stats
@@ -2,18 +2,23 @@
 import argparse
 import asyncio
 import os
-from typing import List, Optional, Union
-
-import fileloghelper
+import time
+from typing import TYPE_CHECKING, Iterable, List, Optional, Union
 
 from home_automation import config as haconfig
-from home_automation import utilities
-from home_automation.compression_middleware import (
-    ChangeStatusInThingsMiddleware,
-    CompressionMiddleware,
-    FlashLightsInHomeAssistantMiddleware,
-)
+from home_automation import tree_walker, utilities
 from home_automation.constants import ABBR_TO_SUBJECT
+from home_automation.ignore_registry import get_ignore_registry
+from home_automation.middleware_registry import (
+    COMPRESSION_MIDDLEWARE,
+    MiddlewareRegistry,
+)
+from home_automation.quarantine import SUBSYSTEM_COMPRESSION, get_quarantine
+from home_automation.structured_logging import StructuredLogger
+
+if TYPE_CHECKING:
+    # only imported (with httpx etc.) once a file is actually compressed
+    from home_automation.compression_middleware import CompressionMiddleware
 
 BLACKLIST = ["@eaDir"]
 BLACKLIST_BEGINNINGS = ["Scan ", ".", "_", "Scanned Document"]
@@ -29,14 +34,17 @@ class LoopBreakingException(Exception):
 class CompressionManager:
     """Manages compressing files."""
 
-    logger: fileloghelper.Logger
+    logger: StructuredLogger
     config: haconfig.Config
     debug: bool
-    middleware: List[CompressionMiddleware]
+    middleware: List["CompressionMiddleware"]
+    registry: Optional[MiddlewareRegistry]
 
     def __init__(self, config: haconfig.Config, debug=False, testing=False):
-        self.logger = fileloghelper.Logger(
-            os.path.join(LOG_DIR, "compression_manager.log"), autosave=debug
+        self.logger = StructuredLogger(
+            os.path.join(LOG_DIR, "compression_manager.log"),
+            config.logging,
+            debug=debug,
         )
         self.config = config
         if not testing:
@@ -44,9 +52,12 @@ class CompressionManager:
             self.logger.header(True, True)
         self.debug = debug
         self.middleware = []
+        self.registry = None
 
     async def compress_directory(self, directory: Optional[str] = None):
-        """For each file or directory in `directory`, compress it."""
+        """For each file in `directory` and its subdirectories (read in
+        parallel, see `tree_walker`), compress it. Files are compressed while
+        the rest of the directory is still being walked."""
         if directory:
             dir_to_compress = directory
         else:
@@ -54,32 +65,72 @@ class CompressionManager:
 
         self.logger.context = "compressing"
         self.logger.debug(f"Compressing directory '{dir_to_compress}'")
-        dirlist = os.listdir(dir_to_compress)
 
-        for fname in dirlist:
-            path = os.path.join(dir_to_compress, fname)
+        walker = tree_walker.walk(
+            dir_to_compress, include=lambda fname: fname not in BLACKLIST
+        )
+        async for _, entries in utilities.iterate_blocking(walker):
+            dirlist = [entry.name for entry in entries]
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False) or not entry.name.endswith(
+                    ".pdf"
+                ):
+                    continue
+                try:
+                    await self.compress_file(entry.path, dirlist)
+                except KeyError as error:
+                    self.logger.handle_exception(error)
+
+    async def compress_paths(self, paths: Iterable[str]):
+        """Compress the PDFs among `paths` (e.g. the ones that changed)
+        and in directories among them (recursively)."""
+        self.logger.context = "compressing"
+        for path in paths:
+            if any(part in BLACKLIST for part in path.split(os.sep)):
+                continue
+            if os.path.isdir(path):
+                await self.compress_directory(path)
+                continue
+            if not path.endswith(".pdf") or not os.path.isfile(path):
+                continue
             try:
-                if os.path.isdir(path):
-                    if fname not in BLACKLIST:
-                        await self.compress_directory(path)
-                elif path.endswith(".pdf"):
-                    if path.endswith(".small.pdf"):
-                        fname = fname[:-10]
-                    else:
-                        fname = ".".join(fname.split(".")[:-1])
-                    if self.file_should_be_skipped(path, fname, dirlist):
-                        continue
-
-                    await self.apply_middleware(path)
-
-                    self.logger.info(f"Compressing '{path}'")
-                    cmd = f"gs -sDEVICE=pdfwrite -dCompatibilityLevel=1.4 \
-                            -dPDFSETTINGS=/ebook -dNOPAUSE -dBATCH \
-                            -sOutputFile='{path.replace('.pdf', '.small.pdf')}' '{path}'"
-                    os.system(cmd)
-            except KeyError as error:
+                dirlist = os.listdir(os.path.dirname(path))
+                await self.compress_file(path, dirlist)
+            except (KeyError, OSError) as error:
                 self.logger.handle_exception(error)
 
+    async def compress_file(self, path: str, dirlist: List[str]):
+        """Compress the PDF at `path` unless it should be skipped. `dirlist` are the
+        names of all entries in the same directory."""
+        fname = os.path.basename(path)
+        if path.endswith(".small.pdf"):
+            fname = fname[:-10]
+        else:
+            fname = ".".join(fname.split(".")[:-1])
+        if self.file_should_be_skipped(path, fname, dirlist):
+            return
+
+        await self.apply_middleware(path)
+
+        quarantine = get_quarantine(self.config)
+        self.logger.info(f"Compressing '{path}'")
+        compressed_path = path.replace(".pdf", ".small.pdf")
+        cmd = f"gs -sDEVICE=pdfwrite -dCompatibilityLevel=1.4 \
+                -dPDFSETTINGS=/ebook -dNOPAUSE -dBATCH \
+                -sOutputFile='{compressed_path}' '{path}'"
+        with get_ignore_registry(self.config).ignoring([compressed_path]):
+            status = await utilities.run_blocking(os.system, cmd)
+        if not os.path.isfile(compressed_path):
+            retry_at = quarantine.record_failure(
+                path, SUBSYSTEM_COMPRESSION, f"gs exited with status {status}"
+            )
+            self.logger.error(
+                f"Couldn't compress '{path}', skipping it until {time.ctime(retry_at)}"
+            )
+            return
+        quarantine.record_success(path, SUBSYSTEM_COMPRESSION)
+        await self.apply_post_compression_middleware(path, compressed_path)
+
     def file_should_be_skipped(self, path: str, fname: str, dirlist: List[str]):
         """Decide, whether file should be skipped.
         Deal with logging and return True/False respectively."""
@@ -103,17 +154,29 @@ class CompressionManager:
         except LoopBreakingException:
             skip(path)
             return True
+        # before opening it for writing, which causes another (close) event
+        if get_quarantine(self.config).is_quarantined(path, SUBSYSTEM_COMPRESSION):
+            self.logger.debug(f"Skipping {path} as compressing it failed before")
+            return True
         try:
-            with open(path, "r+", encoding="utf-8"):
-                pass
+            # closing it causes an event, although nothing was written
+            with get_ignore_registry(self.config).ignoring([path]):
+                with open(path, "r+", encoding="utf-8"):
+                    pass
         except (FileNotFoundError, PermissionError) as error:
             self.logger.handle_exception(error)
             return True
         return False
 
+    def middleware_for(self, path: str) -> List["CompressionMiddleware"]:
+        """Return the registered middleware and the one from `registry` for `path`."""
+        if self.registry is None:
+            return self.middleware
+        return self.middleware + self.registry.middleware_for(path)
+
     async def apply_middleware(self, path: str):
         """Let all middleware act on `path`."""
-        for middleware in self.middleware:
+        for middleware in self.middleware_for(path):
             task = asyncio.create_task(middleware.act(path))
             if self.debug:
                 self.logger.debug(
@@ -128,6 +191,33 @@ class CompressionManager:
             except Exception as error:  # pylint: disable=broad-except
                 self.logger.handle_exception(error)
 
+    async def apply_post_compression_middleware(self, path: str, compressed_path: str):
+        """Let all middleware act on `path` having been compressed to `compressed_path`."""
+        for middleware in self.middleware_for(path):
+            try:
+                await middleware.did_compress(path, compressed_path)
+            except Exception as error:  # pylint: disable=broad-except
+                self.logger.handle_exception(error)
+
+    async def compress(self, paths: Optional[Iterable[str]] = None):
+        """Compress the PDFs among `paths` (or in homework_dir and
+        extra_compress_dirs if not given) and clean up."""
+        if paths is not None:
+            await self.compress_paths(paths)
+        else:
+            await self.compress_directory()
+            for directory in self.config.extra_compress_dirs or []:
+                await self.compress_directory(directory)
+        self.clean_up_directory()
+
+    async def close(self):
+        """Close the middleware (e.g. its connections) and the log."""
+        for middleware in self.middleware:
+            await middleware.close()
+        if self.registry is not None:
+            await self.registry.close()
+        self.logger.close()
+
     def clean_up_directory(self, directory: Optional[str] = None):
         """Clean files added by another service, like ".M HA" etc.\
                 (might come from Documents by Readdle or so)"""
@@ -144,14 +234,15 @@ class CompressionManager:
                 try:
                     length = len(fname.split(" ")[0])
                     if length in (2, 3):
-                        os.remove(path)
+                        with get_ignore_registry(self.config).ignoring([path]):
+                            os.remove(path)
                         self.logger.success(f"Removed {path}")
                 except KeyError:
                     continue
                 except Exception as error:  # pylint: disable=broad-except
                     self.logger.handle_exception(error)
 
-    def register_middleware(self, middleware: CompressionMiddleware):
+    def register_middleware(self, middleware: "CompressionMiddleware"):
         """Register a new `CompressionMiddleware` to be called whenever a new file gets compressed.
         Required to be actually useful."""
         self.middleware.append(middleware)
@@ -160,6 +251,15 @@ class CompressionManager:
         )
 
 
+def create_manager(config: haconfig.Config, debug=False) -> CompressionManager:
+    """Create a `CompressionManager` with the middleware enabled in `config`."""
+    manager = CompressionManager(config, debug)
+    manager.registry = MiddlewareRegistry.for_group(
+        COMPRESSION_MIDDLEWARE, config, manager.logger
+    )
+    return manager
+
+
 async def main(arguments: Optional[Union[str, List[str]]] = None):
     """Main entry point with parsing argumets from cli."""
     if isinstance(arguments, str):
@@ -172,31 +272,21 @@ async def main(arguments: Optional[Union[str, List[str]]] = None):
     await compress(config)
 
 
-async def compress(config: Optional[haconfig.Config] = None):
-    """Run. compress homework_dir + extra_compress_dirs and clean up."""
+async def compress(
+    config: Optional[haconfig.Config] = None, paths: Optional[Iterable[str]] = None
+):
+    """Run. compress homework_dir + extra_compress_dirs (or only `paths`,
+    if given) and clean up."""
     if config:
         config_data = config
     else:
         config_data = haconfig.load_config()
     utilities.drop_privileges(config_data)
-
-    manager = CompressionManager(config_data)
-
-    middleware = [
-        FlashLightsInHomeAssistantMiddleware(config_data, manager.logger),
-        ChangeStatusInThingsMiddleware(config_data, manager.logger),
-    ]
-
-    for midware in middleware:
-        manager.register_middleware(midware)
-
-    await manager.compress_directory()
-
-    if config_data.extra_compress_dirs:
-        for directory in config_data.extra_compress_dirs:
-            await manager.compress_directory(directory)
-
-    manager.clean_up_directory()
+    manager = create_manager(config_data)
+    try:
+        await manager.compress(paths)
+    finally:
+        await manager.close()
 
 
 def run_main(arguments: Optional[Union[str, List[str]]] = None):
@@ -204,9 +294,9 @@ def run_main(arguments: Optional[Union[str, List[str]]] = None):
     asyncio.run(main(arguments))
 
 
-def run_compress(config: haconfig.Config):
+def run_compress(config: haconfig.Config, paths: Optional[Iterable[str]] = None):
     """Run the compress coroutine via asyncio.run."""
-    asyncio.run(compress(config))
+    asyncio.run(compress(config, paths))
 
 
 if __name__ == "__main__":
@@ -2,11 +2,15 @@
 # pylint: disable=global-statement
 import os
 import re
+from typing import Optional
 
-import fileloghelper
 import httpx
 
+from home_automation.archive_index import get_archive_index
+from home_automation.archive_stats import get_archive_stats
+from home_automation.thumbnails import get_thumbnail_cache
 from home_automation.constants import ABBR_TO_SUBJECT
+from home_automation.structured_logging import StructuredLogger
 from home_automation import config as haconfig
 from home_automation.config import ConfigError
 
@@ -27,17 +31,43 @@ class CompressionMiddleware:
     For example, it can be used to communicate with other services.
     Each coroutine is executed separately."""
 
-    logger: fileloghelper.Logger
+    logger: StructuredLogger
     config: haconfig.Config
+    _client: Optional[httpx.AsyncClient]
 
-    def __init__(self, config: haconfig.Config, logger: fileloghelper.Logger):
+    def __init__(self, config: haconfig.Config, logger: StructuredLogger):
         self.config = config
         self.logger = logger
+        self._client = None
+
+    @classmethod
+    def enabled(cls, config: haconfig.Config) -> bool:  # pylint: disable=W0613
+        """Whether to use this middleware with `config` at all."""
+        return True
 
     async def act(self, path: str):  # pylint: disable=R0102,unused-argument
         """Act on the file being compressed."""
         raise NotImplementedError()
 
+    async def did_compress(
+        self, path: str, compressed_path: str
+    ):  # pylint: disable=unused-argument
+        """Act on `path` having been compressed to `compressed_path`. Optional."""
+        return
+
+    def client(self, verify: bool = True) -> httpx.AsyncClient:
+        """Return the HTTP client of this middleware. It is kept open (until
+        `close`), so connections are reused for the next files."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(verify=verify, timeout=TIMEOUT)
+        return self._client
+
+    async def close(self):
+        """Close the HTTP client (if any)."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
     def handle_response(self, response: httpx.Response):  # pylint: disable=R0102
         """Just throw an exception if something isn't right!"""
         if not response.status_code == 200:
@@ -73,15 +103,12 @@ class FlashLightsInHomeAssistantMiddleware(CompressionMiddleware):
         ):
             raise ConfigError("Home Assistant data not configured.")
         headers = {"Authorization": "Bearer " + self.config.home_assistant.token}
-        async with httpx.AsyncClient(
-            verify=not self.config.home_assistant.insecure_https
-        ) as client:
-            response = await client.post(
-                self.config.home_assistant.url
-                + "/api/services/script/flash_miguels_room",
-                headers=headers,
-                timeout=TIMEOUT,
-            )
+        client = self.client(verify=not self.config.home_assistant.insecure_https)
+        response = await client.post(
+            self.config.home_assistant.url + "/api/services/script/flash_miguels_room",
+            headers=headers,
+            timeout=TIMEOUT,
+        )
         self.handle_response(response)
 
 
@@ -104,13 +131,43 @@ class ChangeStatusInThingsMiddleware(SubjectCompressionMiddleware):
             raise ConfigError("Things server URL not configured.")
         _, filename = os.path.split(path)
         subject = filename.split(" ")[0].upper()
-        async with httpx.AsyncClient(
-            verify=not self.config.things_server.insecure_https
-        ) as client:
-            response = await client.post(
-                self.config.things_server.url
-                + "/api/v1/markhomeworkasdone?"
-                + f"subject={subject}",
-                timeout=TIMEOUT,
-            )
+        client = self.client(verify=not self.config.things_server.insecure_https)
+        response = await client.post(
+            self.config.things_server.url
+            + "/api/v1/markhomeworkasdone?"
+            + f"subject={subject}",
+            timeout=TIMEOUT,
+        )
         self.handle_response(response)
+
+
+class SearchIndexCompressionMiddleware(CompressionMiddleware):
+    """Indexes new files for full-text search (in the background)."""
+
+    @classmethod
+    def enabled(cls, config: haconfig.Config) -> bool:
+        return config.search.enabled
+
+    async def act(self, path: str):
+        get_archive_index(self.config).submit(path)
+
+
+class StatsCompressionMiddleware(CompressionMiddleware):
+    """Counts compressed files in the archive's usage statistics."""
+
+    async def act(self, path: str):
+        return
+
+    async def did_compress(self, path: str, compressed_path: str):
+        get_archive_stats(self.config).record_added(compressed_path)
+
+
+class ThumbnailCompressionMiddleware(CompressionMiddleware):
+    """Renders previews of new files (in the background)."""
+
+    @classmethod
+    def enabled(cls, config: haconfig.Config) -> bool:
+        return config.thumbnails.enabled
+
+    async def act(self, path: str):
+        get_thumbnail_cache(self.config).submit(path)
@@ -5,7 +5,6 @@ import pwd
 import socket as socketlib
 from typing import Any, Dict, List, Optional, Union
 
-import git as gitlib
 import yaml
 
 
@@ -13,13 +12,23 @@ class ConfigEmail:
     """Email configuration."""
 
     address: Optional[str]
+    outbox_interval: int
+    digest_delay: int
+    max_attempts: int
 
-    def __init__(self, data: Optional[Dict[str, str]] = None):
+    def __init__(self, data: Optional[Dict[str, Union[str, int]]] = None):
         if not data:
-            self.address = None
-            return
+            data = {}
         address = data.get("address")
+        outbox_interval = data.get("outbox_interval")
+        digest_delay = data.get("digest_delay")
+        max_attempts = data.get("max_attempts")
         self.address = address if isinstance(address, str) else None
+        self.outbox_interval = (
+            outbox_interval if isinstance(outbox_interval, int) else 60
+        )
+        self.digest_delay = digest_delay if isinstance(digest_delay, int) else 600
+        self.max_attempts = max_attempts if isinstance(max_attempts, int) else 10
 
     def __str__(self) -> str:
         return str(vars(self))
@@ -28,12 +37,20 @@ class ConfigEmail:
         return str(self)
 
     def __eq__(self, other) -> bool:
-        return self.address == other.address
+        return (
+            self.address == other.address
+            and self.outbox_interval == other.outbox_interval
+            and self.digest_delay == other.digest_delay
+            and self.max_attempts == other.max_attempts
+        )
 
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary."""
         return {
             "address": self.address,
+            "outbox_interval": self.outbox_interval,
+            "digest_delay": self.digest_delay,
+            "max_attempts": self.max_attempts,
         }
 
 
@@ -265,21 +282,40 @@ class ConfigProcess:
 class ConfigRunner:  # pylint: disable=too-few-public-methods
     """home_automation.runner configuration."""
 
-    cron_user: Optional[str]
+    debounce: float
+    max_delay: float
+    stable_for: float
 
-    def __init__(self, data: Optional[Dict[str, str]] = None):
+    def __init__(self, data: Optional[Dict[str, Union[str, int, float]]] = None):
         if not data:
-            self.cron_user = None
-            return
-        cron_user = data.get("cron_user")
-        self.cron_user = cron_user
+            data = {}
+        debounce = data.get("debounce")
+        max_delay = data.get("max_delay")
+        stable_for = data.get("stable_for")
+        self.debounce = (
+            float(debounce) if isinstance(debounce, (int, float)) else 1.0
+        )
+        self.max_delay = (
+            float(max_delay) if isinstance(max_delay, (int, float)) else 60.0
+        )
+        self.stable_for = (
+            float(stable_for) if isinstance(stable_for, (int, float)) else 2.0
+        )
 
     def __eq__(self, other) -> bool:
-        return self.cron_user == other.cron_user
+        return (
+            self.debounce == other.debounce
+            and self.max_delay == other.max_delay
+            and self.stable_for == other.stable_for
+        )
 
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary."""
-        return {"cron_user": self.cron_user}
+        return {
+            "debounce": self.debounce,
+            "max_delay": self.max_delay,
+            "stable_for": self.stable_for,
+        }
 
 
 class ConfigKubernetes:
@@ -425,6 +461,8 @@ class ConfigGit:
 
     def valid(self) -> bool:
         """Check if configuration is valid."""
+        import git as gitlib  # pylint: disable=import-outside-toplevel
+
         remotes_valid = all(isinstance(x, str) for x in self.remotes)
         repo = gitlib.Repo(os.curdir)
         branch_found = self.branch is None or self.branch in [
@@ -646,9 +684,13 @@ class ConfigStorageSQLite:
 
     path: str
 
-    def __init__(self, data: Optional[Dict[str, str]] = None):
+    def __init__(
+        self,
+        data: Optional[Dict[str, str]] = None,
+        default_path: str = "home_automation_backend.db",
+    ):
         if not data:
-            self.path = "home_automation_backend.db"
+            self.path = default_path
             return
         self.path = data["path"]
 
@@ -715,12 +757,17 @@ class ConfigStorage:
 
     file: Optional[ConfigStorageSQLite]
     redis: Optional[ConfigStorageRedis]
+    # always SQLite, for data that doesn't fit in key-value storage
+    # (search index, statistics, queues etc.)
+    local: ConfigStorageSQLite
 
     def __init__(self, data: Optional[Dict[str, Dict]] = None):
         if not data:
             self.file = ConfigStorageSQLite()
             self.redis = None
+            self.local = ConfigStorageSQLite(None, "home_automation_local.db")
             return
+        self.local = ConfigStorageSQLite(data.get("local"), "home_automation_local.db")
         file = data.get("file")
         if file:
             self.file = ConfigStorageSQLite(file)
@@ -733,13 +780,18 @@ class ConfigStorage:
             self.redis = None
 
     def __eq__(self, other) -> bool:
-        return self.file == other.file and self.redis == other.redis
+        return (
+            self.file == other.file
+            and self.redis == other.redis
+            and self.local == other.local
+        )
 
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary."""
         return {
             "file": self.file.to_dict() if self.file else None,
             "redis": self.redis.to_dict() if self.redis else None,
+            "local": self.local.to_dict(),
         }
 
     def valid(self) -> bool:
@@ -786,46 +838,315 @@ class ConfigMiddlewareLaTeX:
     """Configuration for the LaTeXToPDFMiddleware."""
 
     delete_byproducts: bool
+    max_passes: int
+    format_dir: Optional[str]
 
-    def __init__(self, data: Optional[Dict[str, bool]] = None):
+    def __init__(self, data: Optional[Dict[str, Union[bool, int, str]]] = None):
         if not data:
-            self.delete_byproducts = False
-            return
+            data = {}
         self.delete_byproducts = data.get("delete_byproducts", False)
+        max_passes = data.get("max_passes")
+        format_dir = data.get("format_dir")
+        self.max_passes = (
+            max_passes if isinstance(max_passes, int) and max_passes > 0 else 5
+        )
+        self.format_dir = format_dir if isinstance(format_dir, str) else None
 
     def __eq__(self, other) -> bool:
         if not other:
             return False
-        return self.delete_byproducts == other.delete_byproducts
+        return (
+            self.delete_byproducts == other.delete_byproducts
+            and self.max_passes == other.max_passes
+            and self.format_dir == other.format_dir
+        )
 
-    def to_dict(self) -> Dict[str, bool]:
+    def to_dict(self) -> Dict[str, Union[bool, int, Optional[str]]]:
         """Convert to dictionary."""
         return {
             "delete_byproducts": self.delete_byproducts,
+            "max_passes": self.max_passes,
+            "format_dir": self.format_dir,
         }
 
 
+MARKDOWN_RENDERERS = ["pandoc", "html"]
+
+
 class ConfigMiddleware:
     """Middleware configuration."""
 
     latex: Optional[ConfigMiddlewareLaTeX]
+    render_workers: int
+    scratch_dir: Optional[str]
+    markdown_renderer: str
 
-    def __init__(self, data: Optional[Dict[str, Dict]] = None):
+    def __init__(self, data: Optional[Dict[str, Any]] = None):
         if data:
             self.latex = ConfigMiddlewareLaTeX(data.get("latex"))
+            render_workers = data.get("render_workers")
+            scratch_dir = data.get("scratch_dir")
+            markdown_renderer = data.get("markdown_renderer")
         else:
             self.latex = None
+            render_workers = None
+            scratch_dir = None
+            markdown_renderer = None
+        self.render_workers = render_workers if isinstance(render_workers, int) else 4
+        self.scratch_dir = scratch_dir if isinstance(scratch_dir, str) else None
+        self.markdown_renderer = (
+            markdown_renderer if markdown_renderer in MARKDOWN_RENDERERS else "pandoc"
+        )
 
     def __eq__(self, other) -> bool:
-        return self.latex == other.latex
+        return (
+            self.latex == other.latex
+            and self.render_workers == other.render_workers
+            and self.scratch_dir == other.scratch_dir
+            and self.markdown_renderer == other.markdown_renderer
+        )
 
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary."""
         return {
             "latex": self.latex.to_dict() if self.latex else None,
+            "render_workers": self.render_workers,
+            "scratch_dir": self.scratch_dir,
+            "markdown_renderer": self.markdown_renderer,
         }
 
 
+class ConfigArchiving:
+    """Configuration for the continuous archiver."""
+
+    class ConfigArchivingColdTier:
+        """Configuration for moving old school years to cold storage."""
+
+        directory: Optional[str]
+        min_age_years: int
+        keep_only_compressed: bool
+
+        def __init__(self, data: Optional[Dict[str, Union[str, int, bool]]] = None):
+            if not data:
+                data = {}
+            directory = data.get("directory")
+            min_age_years = data.get("min_age_years")
+            keep_only_compressed = data.get("keep_only_compressed")
+            self.directory = directory if isinstance(directory, str) else None
+            self.min_age_years = (
+                min_age_years if isinstance(min_age_years, int) else 2
+            )
+            self.keep_only_compressed = (
+                keep_only_compressed
+                if isinstance(keep_only_compressed, bool)
+                else False
+            )
+
+        def __eq__(self, other) -> bool:
+            return (
+                self.directory == other.directory
+                and self.min_age_years == other.min_age_years
+                and self.keep_only_compressed == other.keep_only_compressed
+            )
+
+        def to_dict(self) -> Dict[str, Union[Optional[str], int, bool]]:
+            """Convert to dictionary."""
+            return {
+                "directory": self.directory,
+                "min_age_years": self.min_age_years,
+                "keep_only_compressed": self.keep_only_compressed,
+            }
+
+    threshold_days: int
+    max_files_per_day: int
+    tick_interval: int
+    digest_interval_days: int
+    cold_tier: ConfigArchivingColdTier
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None):
+        if not data:
+            data = {}
+        threshold_days = data.get("threshold_days")
+        max_files_per_day = data.get("max_files_per_day")
+        tick_interval = data.get("tick_interval")
+        digest_interval_days = data.get("digest_interval_days")
+        cold_tier = data.get("cold_tier")
+        self.threshold_days = threshold_days if isinstance(threshold_days, int) else 5
+        self.max_files_per_day = (
+            max_files_per_day if isinstance(max_files_per_day, int) else 25
+        )
+        self.tick_interval = tick_interval if isinstance(tick_interval, int) else 600
+        self.digest_interval_days = (
+            digest_interval_days if isinstance(digest_interval_days, int) else 7
+        )
+        self.cold_tier = ConfigArchiving.ConfigArchivingColdTier(
+            cold_tier if isinstance(cold_tier, dict) else None
+        )
+
+    def __eq__(self, other) -> bool:
+        return (
+            self.threshold_days == other.threshold_days
+            and self.max_files_per_day == other.max_files_per_day
+            and self.tick_interval == other.tick_interval
+            and self.digest_interval_days == other.digest_interval_days
+            and self.cold_tier == other.cold_tier
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary."""
+        return {
+            "threshold_days": self.threshold_days,
+            "max_files_per_day": self.max_files_per_day,
+            "tick_interval": self.tick_interval,
+            "digest_interval_days": self.digest_interval_days,
+            "cold_tier": self.cold_tier.to_dict(),
+        }
+
+
+class ConfigSearch:
+    """Configuration for the full-text search index over archived files."""
+
+    enabled: bool
+    workers: int
+
+    def __init__(self, data: Optional[Dict[str, Union[bool, int]]] = None):
+        if not data:
+            data = {}
+        enabled = data.get("enabled")
+        workers = data.get("workers")
+        self.enabled = enabled if isinstance(enabled, bool) else False
+        self.workers = workers if isinstance(workers, int) else 2
+
+    def __eq__(self, other) -> bool:
+        return self.enabled == other.enabled and self.workers == other.workers
+
+    def to_dict(self) -> Dict[str, Union[bool, int]]:
+        """Convert to dictionary."""
+        return {"enabled": self.enabled, "workers": self.workers}
+
+
+class ConfigThumbnails:
+    """Configuration for the first-page previews of PDFs served by the backend."""
+
+    enabled: bool
+    directory: str
+    max_size_mb: int
+    width: int
+    workers: int
+
+    def __init__(self, data: Optional[Dict[str, Union[bool, str, int]]] = None):
+        if not data:
+            data = {}
+        enabled = data.get("enabled")
+        directory = data.get("directory")
+        max_size_mb = data.get("max_size_mb")
+        width = data.get("width")
+        workers = data.get("workers")
+        self.enabled = enabled if isinstance(enabled, bool) else False
+        self.directory = directory if isinstance(directory, str) else "thumbnails"
+        self.max_size_mb = max_size_mb if isinstance(max_size_mb, int) else 256
+        self.width = width if isinstance(width, int) else 320
+        self.workers = workers if isinstance(workers, int) else 1
+
+    def __eq__(self, other) -> bool:
+        return (
+            self.enabled == other.enabled
+            and self.directory == other.directory
+            and self.max_size_mb == other.max_size_mb
+            and self.width == other.width
+            and self.workers == other.workers
+        )
+
+    def to_dict(self) -> Dict[str, Union[bool, str, int]]:
+        """Convert to dictionary."""
+        return {
+            "enabled": self.enabled,
+            "directory": self.directory,
+            "max_size_mb": self.max_size_mb,
+            "width": self.width,
+            "workers": self.workers,
+        }
+
+
+class ConfigLogging:
+    """Configuration for the structured (JSON lines) logs."""
+
+    level: str
+    max_bytes: int
+    backup_count: int
+    flush_interval: float
+    buffer_size: int
+    per_subsystem: bool
+
+    def __init__(self, data: Optional[Dict[str, Union[str, int, float, bool]]] = None):
+        if not data:
+            data = {}
+        level = data.get("level")
+        max_bytes = data.get("max_bytes")
+        backup_count = data.get("backup_count")
+        flush_interval = data.get("flush_interval")
+        buffer_size = data.get("buffer_size")
+        per_subsystem = data.get("per_subsystem")
+        self.level = level.upper() if isinstance(level, str) else "INFO"
+        self.max_bytes = (
+            max_bytes if isinstance(max_bytes, int) else 10 * 1024 * 1024
+        )
+        self.backup_count = backup_count if isinstance(backup_count, int) else 5
+        self.flush_interval = (
+            float(flush_interval) if isinstance(flush_interval, (int, float)) else 2.0
+        )
+        self.buffer_size = buffer_size if isinstance(buffer_size, int) else 512
+        self.per_subsystem = (
+            per_subsystem if isinstance(per_subsystem, bool) else False
+        )
+
+    def __eq__(self, other) -> bool:
+        return (
+            self.level == other.level
+            and self.max_bytes == other.max_bytes
+            and self.backup_count == other.backup_count
+            and self.flush_interval == other.flush_interval
+            and self.buffer_size == other.buffer_size
+            and self.per_subsystem == other.per_subsystem
+        )
+
+    def to_dict(self) -> Dict[str, Union[str, int, float, bool]]:
+        """Convert to dictionary."""
+        return {
+            "level": self.level,
+            "max_bytes": self.max_bytes,
+            "backup_count": self.backup_count,
+            "flush_interval": self.flush_interval,
+            "buffer_size": self.buffer_size,
+            "per_subsystem": self.per_subsystem,
+        }
+
+
+class ConfigQuarantine:
+    """Configuration for skipping files that failed to be processed repeatedly."""
+
+    backoff_base: int
+    max_backoff: int
+
+    def __init__(self, data: Optional[Dict[str, int]] = None):
+        if not data:
+            data = {}
+        backoff_base = data.get("backoff_base")
+        max_backoff = data.get("max_backoff")
+        self.backoff_base = backoff_base if isinstance(backoff_base, int) else 300
+        self.max_backoff = max_backoff if isinstance(max_backoff, int) else 86400
+
+    def __eq__(self, other) -> bool:
+        return (
+            self.backoff_base == other.backoff_base
+            and self.max_backoff == other.max_backoff
+        )
+
+    def to_dict(self) -> Dict[str, int]:
+        """Convert to dictionary."""
+        return {"backoff_base": self.backoff_base, "max_backoff": self.max_backoff}
+
+
 class Config:  # pylint: disable=too-many-instance-attributes
     """Configuration data."""
 
@@ -853,6 +1174,11 @@ class Config:  # pylint: disable=too-many-instance-attributes
     storage: ConfigStorage
     admin: ConfigAdminPermissions
     middleware: ConfigMiddleware
+    archiving: ConfigArchiving
+    search: ConfigSearch
+    thumbnails: ConfigThumbnails
+    logging: ConfigLogging
+    quarantine: ConfigQuarantine
 
     # opress dangerous default values as that's only dangerous if they are modified
     def __init__(
@@ -881,6 +1207,11 @@ class Config:  # pylint: disable=too-many-instance-attributes
         storage: Optional[Dict[str, Dict]] = None,
         admin: Optional[Dict[Optional[str], Optional[str]]] = None,
         middleware: Optional[Dict[str, Dict]] = None,
+        archiving: Optional[Dict[str, Any]] = None,
+        search: Optional[Dict[str, Union[bool, int]]] = None,
+        thumbnails: Optional[Dict[str, Union[bool, str, int]]] = None,
+        logging: Optional[Dict[str, Union[str, int, float, bool]]] = None,
+        quarantine: Optional[Dict[str, int]] = None,
     ):  # pylint: disable=too-many-arguments,too-many-locals
         self.log_dir = log_dir
         self.homework_dir = homework_dir
@@ -908,6 +1239,11 @@ class Config:  # pylint: disable=too-many-instance-attributes
         self.storage = ConfigStorage(storage)
         self.admin = ConfigAdminPermissions(admin)
         self.middleware = ConfigMiddleware(middleware)
+        self.archiving = ConfigArchiving(archiving)
+        self.search = ConfigSearch(search)
+        self.thumbnails = ConfigThumbnails(thumbnails)
+        self.logging = ConfigLogging(logging)
+        self.quarantine = ConfigQuarantine(quarantine)
 
     def __str__(self) -> str:
         return str(vars(self))
@@ -941,6 +1277,11 @@ class Config:  # pylint: disable=too-many-instance-attributes
             and self.storage == other.storage
             and self.admin == other.admin
             and self.middleware == other.middleware
+            and self.archiving == other.archiving
+            and self.search == other.search
+            and self.thumbnails == other.thumbnails
+            and self.logging == other.logging
+            and self.quarantine == other.quarantine
         )
 
     def to_dict(self) -> Dict[str, Any]:
@@ -974,6 +1315,11 @@ class Config:  # pylint: disable=too-many-instance-attributes
             "storage": self.storage.to_dict() if self.storage else None,
             "admin": self.admin.to_dict() if self.admin else None,
             "middleware": self.middleware.to_dict() if self.middleware else None,
+            "archiving": self.archiving.to_dict() if self.archiving else None,
+            "search": self.search.to_dict() if self.search else None,
+            "thumbnails": self.thumbnails.to_dict() if self.thumbnails else None,
+            "logging": self.logging.to_dict() if self.logging else None,
+            "quarantine": self.quarantine.to_dict() if self.quarantine else None,
         }
 
 
@@ -0,0 +1,221 @@
+"""Archive files continuously as they cross the age threshold instead of
+moving everything in one big batch at the end of the week."""
+import collections
+import datetime
+import os
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from home_automation import config as haconfig
+from home_automation.archive_manager import (
+    ArchiveManager,
+    create_manager,
+    is_archivable_name,
+)
+
+DIGEST_MAIL_SUBJECT = "[NAS] Weekly archiving digest"
+
+
+class TimerWheel:
+    """A hashed timing wheel. Each slot covers `resolution`; keys due further
+    ahead than one revolution simply stay in their slot until their due date
+    has actually passed. Scheduling and cancelling are O(1), advancing only
+    touches the slots passed since the last advance."""
+
+    resolution: datetime.timedelta
+    _slots: List[Dict[str, datetime.datetime]]
+    _slot_of: Dict[str, int]
+    _last_tick: Optional[int]
+
+    def __init__(
+        self,
+        resolution: datetime.timedelta = datetime.timedelta(days=1),
+        slots: int = 64,
+    ):
+        if slots <= 0:
+            raise ValueError("A timer wheel needs at least one slot.")
+        self.resolution = resolution
+        self._slots = [{} for _ in range(slots)]
+        self._slot_of = {}
+        self._last_tick = None
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._slot_of
+
+    def _tick(self, when: datetime.datetime) -> int:
+        return int(when.timestamp() // self.resolution.total_seconds())
+
+    def due_date(self, key: str) -> Optional[datetime.datetime]:
+        """Return when `key` is due or None if it isn't scheduled."""
+        slot = self._slot_of.get(key)
+        if slot is None:
+            return None
+        return self._slots[slot][key]
+
+    def schedule(self, key: str, due: datetime.datetime):
+        """Schedule `key` to become due at `due` (rescheduling if already present)."""
+        self.cancel(key)
+        tick = self._tick(due)
+        if self._last_tick is not None and tick < self._last_tick:
+            # already overdue, put it where the next advance will look
+            tick = self._last_tick
+        slot = tick % len(self._slots)
+        self._slots[slot][key] = due
+        self._slot_of[key] = slot
+
+    def cancel(self, key: str):
+        """Remove `key` from the wheel, if scheduled."""
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    def advance(self, now: datetime.datetime) -> List[str]:
+        """Advance the wheel to `now` and return all keys due by then, oldest first."""
+        current = self._tick(now)
+        if self._last_tick is None or current - self._last_tick >= len(self._slots):
+            ticks = range(current - len(self._slots) + 1, current + 1)
+        else:
+            # also revisit the current slot as more keys might have become due in it
+            ticks = range(self._last_tick, current + 1)
+        self._last_tick = current
+        expired: List[Tuple[datetime.datetime, str]] = []
+        for tick in ticks:
+            slot = self._slots[tick % len(self._slots)]
+            for key, due in list(slot.items()):
+                if due <= now:
+                    expired.append((due, key))
+                    del slot[key]
+                    del self._slot_of[key]
+        expired.sort()
+        return [key for _, key in expired]
+
+
+class ContinuousArchiver:
+    """Watches the top level of `homework_dir` and archives every entry once its
+    age (by modification time) crosses `archiving.threshold_days`. At most
+    `archiving.max_files_per_day` entries are moved per day, the rest is carried
+    over to the next day. Every `archiving.digest_interval_days` a digest mail
+    of the moves in between is sent.
+
+    Due entries wait in `backlog` (in order), `_backlogged` holds the ones still
+    waiting: entries are removed from it only, the deque skips them lazily."""
+
+    config: haconfig.Config
+    manager: ArchiveManager
+    wheel: TimerWheel
+    backlog: Deque[str]
+    _backlogged: Set[str]
+    _mtimes: Dict[str, float]
+    _budget_day: Optional[datetime.date]
+    _moved_today: int
+    last_digest: datetime.datetime
+
+    def __init__(
+        self,
+        config: haconfig.Config,
+        manager: Optional[ArchiveManager] = None,
+        now: Optional[datetime.datetime] = None,
+    ):
+        self.config = config
+        self.manager = manager if manager else create_manager(config)
+        self.wheel = TimerWheel(
+            datetime.timedelta(days=1), config.archiving.threshold_days + 1
+        )
+        self.backlog = collections.deque()
+        self._backlogged = set()
+        self._mtimes = {}
+        self._budget_day = None
+        self._moved_today = 0
+        self.last_digest = now if now else datetime.datetime.now()
+
+    @property
+    def threshold(self) -> datetime.timedelta:
+        """The age an entry needs to have to be archived."""
+        return datetime.timedelta(days=self.config.archiving.threshold_days)
+
+    def scan(self):
+        """(Re-)schedule all entries currently in `homework_dir`. Entries that
+        were modified since the last scan get rescheduled, vanished ones dropped."""
+        seen = set()
+        with os.scandir(self.config.homework_dir) as entries:
+            for entry in entries:
+                if not is_archivable_name(entry.name) or entry.name.endswith(
+                    ".small.pdf"
+                ):
+                    continue
+                try:
+                    mtime = entry.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                seen.add(entry.path)
+                if self._mtimes.get(entry.path) == mtime:
+                    continue
+                self._mtimes[entry.path] = mtime
+                self._backlogged.discard(entry.path)
+                due = datetime.datetime.fromtimestamp(mtime) + self.threshold
+                self.wheel.schedule(entry.path, due)
+        for path in list(self._mtimes):
+            if path not in seen:
+                del self._mtimes[path]
+                self.wheel.cancel(path)
+                self._backlogged.discard(path)
+
+    def _remaining_budget(self, now: datetime.datetime) -> int:
+        if self._budget_day != now.date():
+            self._budget_day = now.date()
+            self._moved_today = 0
+        return max(self.config.archiving.max_files_per_day - self._moved_today, 0)
+
+    def archive_due(self, now: Optional[datetime.datetime] = None) -> List[str]:
+        """Archive entries that became due (respecting today's batch limit)
+        and return the paths of the ones moved out of `homework_dir`."""
+        if now is None:
+            now = datetime.datetime.now()
+        for path in self.wheel.advance(now):
+            if path not in self._backlogged:
+                self._backlogged.add(path)
+                self.backlog.append(path)
+        archived = []
+        budget = self._remaining_budget(now)
+        while self.backlog and budget > 0:
+            path = self.backlog.popleft()
+            if path not in self._backlogged:
+                continue
+            self._backlogged.discard(path)
+            if not os.path.exists(path):
+                self._mtimes.pop(path, None)
+                continue
+            self.manager.logger.context = "archiving"
+            self.manager.transfer_entry(path)
+            if os.path.exists(path):
+                # e.g. invalidly formatted, only retried once it's modified again
+                continue
+            self._mtimes.pop(path, None)
+            archived.append(path)
+            self._moved_today += 1
+            budget -= 1
+        return archived
+
+    def send_digest_if_due(self, now: Optional[datetime.datetime] = None) -> bool:
+        """Send the digest of all moves since the last digest if it is due."""
+        if now is None:
+            now = datetime.datetime.now()
+        interval = datetime.timedelta(days=self.config.archiving.digest_interval_days)
+        if now - self.last_digest < interval:
+            return False
+        self.manager.send_archiving_mail(DIGEST_MAIL_SUBJECT)
+        self.manager.transferred_files = []
+        self.manager.not_transferred_files = []
+        self.last_digest = now
+        return True
+
+    def tick(self, now: Optional[datetime.datetime] = None) -> List[str]:
+        """Scan, archive due entries and send the digest if appropriate."""
+        if now is None:
+            now = datetime.datetime.now()
+        self.scan()
+        archived = self.archive_due(now)
+        self.send_digest_if_due(now)
+        return archived
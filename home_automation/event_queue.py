@@ -0,0 +1,284 @@
+"""Collect changed paths (e.g. from watchdog events) and hand them over in batches.
+
+Copying many files at once causes a burst of events, often several per file.
+Paths are coalesced until nothing changed for `debounce` seconds (or changes
+are pending for `max_delay` seconds), so the burst is processed in a single
+pass, on a thread of its own instead of the one receiving the events.
+
+Files still being written (e.g. large scans uploaded over Wi-Fi) are held back
+until they are stable, see `StabilityDetector`.
+
+Batches are handled either on a thread of the queue's own (`start`) or by a
+coroutine on an event loop (`serve`), which `put` wakes up from other threads."""
+import asyncio
+import inspect
+import logging
+import os
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+# called with the changed paths, or None if everything is to be processed;
+# may return an awaitable when the queue is `serve`d
+BatchHandler = Callable[[Optional[List[str]]], Optional[Awaitable[None]]]
+FileState = Tuple[int, int]  # size, mtime
+
+
+def _file_state(path: str) -> Optional[FileState]:
+    """Return the state of the file at `path`, None for directories and
+    files that don't exist (anymore), which are always stable."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if not os.path.isfile(path):
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class StabilityDetector:
+    """Tells whether files are completely written: either they were closed after
+    writing (`closed`, e.g. from inotify's IN_CLOSE_WRITE) and haven't changed
+    since, or their size and modification time didn't change for `stable_for`
+    seconds. Not thread-safe."""
+
+    stable_for: float
+    clock: Callable[[], float]
+    _observed: Dict[str, Tuple[Optional[FileState], float]]
+    _closed: Dict[str, Optional[FileState]]
+
+    def __init__(
+        self, stable_for: float = 2.0, clock: Callable[[], float] = time.monotonic
+    ):
+        self.stable_for = stable_for
+        self.clock = clock
+        self._observed = {}
+        self._closed = {}
+
+    def observe(self, path: str):
+        """Remember the current state of `path` (when it changed)."""
+        state = _file_state(path)
+        observed = self._observed.get(path)
+        if observed is None or observed[0] != state:
+            self._observed[path] = (state, self.clock())
+
+    def closed(self, path: str):
+        """Remember that `path` was closed after writing."""
+        self._closed[path] = _file_state(path)
+        self.observe(path)
+
+    def stable_at(self, path: str) -> Optional[float]:
+        """Return when `path` is stable if it doesn't change anymore,
+        or None if it is already."""
+        state = _file_state(path)
+        if state is None:
+            return None
+        if path in self._closed and self._closed[path] == state:
+            return None
+        observed = self._observed.get(path)
+        if observed is None or observed[0] != state:
+            self._closed.pop(path, None)
+            self._observed[path] = (state, self.clock())
+            return self.clock() + self.stable_for
+        stable_at = observed[1] + self.stable_for
+        return stable_at if stable_at > self.clock() else None
+
+    def forget(self, path: str):
+        """Forget `path` (after it was handed over)."""
+        self._observed.pop(path, None)
+        self._closed.pop(path, None)
+
+
+class EventQueue:
+    """Changed paths waiting to be passed to `handler` (see above). Batches are
+    handled one after another; changes meanwhile are part of the next batch.
+    Paths that aren't stable yet according to `stability` are checked again
+    once they might be."""
+
+    handler: BatchHandler
+    debounce: float
+    max_delay: float
+    clock: Callable[[], float]
+    stability: Optional[StabilityDetector]
+    _pending: Dict[str, None]  # ordered set
+    _everything: bool
+    _first_change: Optional[float]
+    _last_change: Optional[float]
+    _recheck_at: Optional[float]
+    _condition: threading.Condition
+    _thread: Optional[threading.Thread]
+    _loop: Optional[asyncio.AbstractEventLoop]
+    _wakeup: Optional[asyncio.Event]
+    _stopped: bool
+
+    def __init__(
+        self,
+        handler: BatchHandler,
+        debounce: float = 1.0,
+        max_delay: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+        stability: Optional[StabilityDetector] = None,
+    ):
+        self.handler = handler
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.clock = clock
+        self.stability = stability
+        self._pending = {}
+        self._everything = False
+        self._first_change = None
+        self._last_change = None
+        self._recheck_at = None
+        self._condition = threading.Condition()
+        self._thread = None
+        self._loop = None
+        self._wakeup = None
+        self._stopped = False
+
+    def put(self, paths: Iterable[str], closed: bool = False):
+        """Add changed `paths` (without blocking), `closed` after writing."""
+        with self._condition:
+            for path in paths:
+                self._pending[path] = None
+                if self.stability is not None:
+                    if closed:
+                        self.stability.closed(path)
+                    else:
+                        self.stability.observe(path)
+            self._changed()
+
+    def put_everything(self):
+        """Have everything processed with the next batch."""
+        with self._condition:
+            self._everything = True
+            self._changed()
+
+    def _changed(self):
+        now = self.clock()
+        if self._first_change is None:
+            self._first_change = now
+        self._last_change = now
+        self._condition.notify()
+        self._wake_loop()
+
+    def _wake_loop(self):
+        if self._loop is not None and self._wakeup is not None:
+            # called from e.g. watchdog's observer thread
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def due_in(self) -> Optional[float]:
+        """Return in how many seconds the pending changes are due
+        (<= 0 if they are), or None if there are none."""
+        with self._condition:
+            due_times = []
+            if self._first_change is not None and self._last_change is not None:
+                due_times.append(
+                    min(
+                        self._last_change + self.debounce,
+                        self._first_change + self.max_delay,
+                    )
+                )
+            if self._recheck_at is not None:
+                due_times.append(self._recheck_at)
+            if not due_times:
+                return None
+            return min(due_times) - self.clock()
+
+    def take(self) -> Optional[List[str]]:
+        """Return the pending paths that are stable (None for everything) and
+        forget them. The others are checked again once they might be stable."""
+        with self._condition:
+            self._first_change = None
+            self._last_change = None
+            self._recheck_at = None
+            if self._everything:
+                if self.stability is not None:
+                    for path in self._pending:
+                        self.stability.forget(path)
+                self._everything = False
+                self._pending = {}
+                return None
+            paths, unstable = [], {}
+            for path in self._pending:
+                stable_at = (
+                    self.stability.stable_at(path)
+                    if self.stability is not None
+                    else None
+                )
+                if stable_at is None:
+                    paths.append(path)
+                    if self.stability is not None:
+                        self.stability.forget(path)
+                else:
+                    unstable[path] = None
+                    if self._recheck_at is None or stable_at < self._recheck_at:
+                        self._recheck_at = stable_at
+            self._pending = unstable
+            return paths
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    due_in = self.due_in()
+                    if due_in is not None and due_in <= 0:
+                        break
+                    self._condition.wait(due_in)
+                if self._stopped:
+                    return
+                paths = self.take()
+                if paths == []:
+                    continue
+            try:
+                self.handler(paths)
+            except Exception:  # pylint: disable=broad-except
+                logging.getLogger(__name__).exception("Couldn't handle %s", paths)
+
+    async def serve(self):
+        """Handle batches on the running event loop until `stop`ped, awaiting
+        what `handler` returns (if anything)."""
+        with self._condition:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+        try:
+            while True:
+                self._wakeup.clear()
+                with self._condition:
+                    if self._stopped:
+                        return
+                    due_in = self.due_in()
+                    paths = (
+                        self.take() if due_in is not None and due_in <= 0 else []
+                    )
+                if paths == []:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), due_in)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                try:
+                    result = self.handler(paths)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception:  # pylint: disable=broad-except
+                    logging.getLogger(__name__).exception("Couldn't handle %s", paths)
+        finally:
+            with self._condition:
+                self._loop = None
+                self._wakeup = None
+
+    def start(self):
+        """Start handling batches on a background thread."""
+        self._thread = threading.Thread(
+            target=self._run, name="home_automation.event_queue", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop after the batch currently handled (pending paths are dropped)."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+            self._wake_loop()
+        if self._thread is not None:
+            self._thread.join(timeout)
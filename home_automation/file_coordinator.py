@@ -1,43 +1,244 @@
 """File coordinator."""
+import argparse
 import asyncio
+import contextlib
 import os
+import time
 from logging import Logger
-from typing import List, Optional
+from typing import (
+    AsyncIterator,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
 
+from home_automation import config as haconfig
+from home_automation import tree_walker, utilities
 from home_automation.config import Config
 from home_automation.file_coordinator_middleware import (
+    SHARED_BYPRODUCT_DIRS,
     FileCoordinatorMiddleware,
-    LaTeXToPDFMiddleware,
-    MarkdownToPDFMiddleware,
 )
+from home_automation.middleware_registry import (
+    FILE_COORDINATOR_MIDDLEWARE,
+    MiddlewareRegistry,
+)
+from home_automation.quarantine import SUBSYSTEM_RENDERING, get_quarantine
+from home_automation.render_cache import get_render_cache
+
+
+def _descend(entry: os.DirEntry) -> bool:
+    return not (
+        entry.name.startswith(".")
+        or entry.name.startswith("_")
+        or entry.name in SHARED_BYPRODUCT_DIRS
+    )
+
+
+def is_within(path: str, directory: str) -> bool:
+    """Return whether `path` is `directory` or inside of it."""
+    path = os.path.abspath(path)
+    directory = os.path.abspath(directory)
+    return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
 
 
-class FileCoordinator:  # pylint: disable=too-few-public-methods
-    """`FileCoordinator` is invoked on appropriate directories just like
-    `CompressionManager`, except it handles everything else than compressing."""
+class FileCoordinator:
+    """`FileCoordinator` is invoked on changed paths (or whole directories) just
+    like `CompressionManager`, except it handles everything else than compressing."""
 
     config: Config
     logger: Optional[Logger]
-    middlewares: List[FileCoordinatorMiddleware]
+    registry: MiddlewareRegistry
+    _workers: Optional[asyncio.Semaphore]
+    _document_locks: Dict[str, Tuple[asyncio.Lock, int]]
 
     def __init__(self, config: Config, logger: Optional[Logger] = None):
         self.config = config
         self.logger = logger
-        self.middlewares = [
-            LaTeXToPDFMiddleware(config, logger),
-            MarkdownToPDFMiddleware(config, logger),
+        self.registry = MiddlewareRegistry.for_group(
+            FILE_COORDINATOR_MIDDLEWARE, config, logger
+        )
+        self._workers = None
+        self._document_locks = {}
+
+    @contextlib.asynccontextmanager
+    async def _document_lock(self, path: str) -> AsyncIterator[None]:
+        """Hold the lock of `path`'s document, which is dropped once nobody
+        holds or waits for it anymore."""
+        # e.g. "a.tex" and "a.md" would both render to "a.pdf"
+        document = os.path.splitext(path)[0]
+        lock, users = self._document_locks.get(document, (asyncio.Lock(), 0))
+        self._document_locks[document] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._document_locks[document]
+            if users > 1:
+                self._document_locks[document] = (lock, users - 1)
+            else:
+                del self._document_locks[document]
+
+    async def handle_file(
+        self, middleware: FileCoordinatorMiddleware, path: str
+    ) -> bool:
+        """Let `middleware` act on `path` if it's to be handled by it. At most
+        `middleware.render_workers` files are handled at the same time and
+        files of the same document (same name without extension) one after another.
+        Files that failed before are skipped while they are quarantined. Errors
+        are logged (and quarantine the file if raised by `middleware.act`), so
+        they never affect the other files."""
+        if self._workers is None:
+            self._workers = asyncio.Semaphore(self.config.middleware.render_workers)
+        try:
+            return await self._handle_file(middleware, path)
+        except Exception as error:  # pylint: disable=broad-except
+            if self.logger:
+                self.logger.exception("Couldn't handle %s: %s", path, error)
+            return False
+
+    async def _handle_file(
+        self, middleware: FileCoordinatorMiddleware, path: str
+    ) -> bool:
+        quarantine = get_quarantine(self.config)
+        async with self._document_lock(path):
+            # test only now, a concurrent job for the document might have rendered it
+            if not await middleware.test(path):
+                return False
+            content_hash = await utilities.run_blocking(middleware.content_hash, path)
+            if quarantine.is_quarantined(path, SUBSYSTEM_RENDERING, content_hash):
+                if self.logger:
+                    self.logger.debug("Skipping %s as it failed before", path)
+                return False
+            async with self._workers:
+                try:
+                    await middleware.act(path)
+                except Exception as error:  # pylint: disable=broad-except
+                    retry_at = quarantine.record_failure(
+                        path, SUBSYSTEM_RENDERING, error, content_hash
+                    )
+                    if self.logger:
+                        self.logger.error(
+                            "Couldn't handle %s, skipping it until %s: %s",
+                            path,
+                            time.ctime(retry_at),
+                            error,
+                        )
+                    return False
+            quarantine.record_success(path, SUBSYSTEM_RENDERING)
+        return True
+
+    def _collect(self, paths: Iterable[str]) -> Dict[str, Set[str]]:
+        """Return the files to handle for `paths` by directory."""
+        files: Dict[str, Set[str]] = {}
+        render_cache = get_render_cache(self.config)
+        for path in paths:
+            path = os.path.normpath(path)
+            # e.g. documents including a changed file via \input
+            for dependent in render_cache.dependents(path):
+                files.setdefault(os.path.dirname(dependent), set()).add(dependent)
+            if os.path.isdir(path):
+                for dirpath, entries in tree_walker.walk(path, descend=_descend):
+                    files.setdefault(dirpath, set()).update(
+                        entry.path
+                        for entry in entries
+                        if not entry.is_dir(follow_symlinks=False)
+                    )
+            elif os.path.isfile(path):
+                files.setdefault(os.path.dirname(path), set()).add(path)
+        return files
+
+    async def _handle_directory_files(self, directory: str, paths: Iterable[str]):
+        jobs = [
+            (middleware, self.handle_file(middleware, path))
+            for path in sorted(paths)
+            for middleware in self.registry.middleware_for(path)
         ]
+        results = await asyncio.gather(*[job for _, job in jobs])
+        handled_by: List[FileCoordinatorMiddleware] = []
+        for (middleware, _), handled in zip(jobs, results):
+            if handled and middleware not in handled_by:
+                handled_by.append(middleware)
+        for middleware in handled_by:
+            middleware.cleanup_directory(directory)
+
+    async def handle_paths(self, paths: Iterable[str]):
+        """Handle only the files at `paths` (e.g. the ones that changed), all files
+        below directories among them and documents depending on any of them.
+        Each file is only passed to the middleware registered for it."""
+        files = await utilities.run_blocking(self._collect, list(paths))
+        await asyncio.gather(
+            *[
+                self._handle_directory_files(directory, directory_files)
+                for directory, directory_files in files.items()
+            ]
+        )
 
     async def handle_directory(self, path: str):
-        """Handle the directory."""
-        for fname in os.listdir(path):
-            full_path = os.path.join(path, fname)
-            for middleware in self.middlewares:
-                if await middleware.test(full_path):
-                    await middleware.act(full_path)
+        """Handle all files in the directory (not its subdirectories) concurrently."""
+        await self.handle_paths(
+            os.path.join(path, fname)
+            for fname in os.listdir(path)
+            if not os.path.isdir(os.path.join(path, fname))
+        )
+
+    async def scan(self, path: str):
+        """Handle all files in the directory and its subdirectories."""
+        await self.handle_paths([path])
+
+    async def handle_changes(self, path: str, changed: Optional[Iterable[str]] = None):
+        """Handle the `changed` paths inside `path`, or everything inside `path`
+        if not given."""
+        if changed is None:
+            await self.scan(path)
+        else:
+            await self.handle_paths(
+                other for other in changed if is_within(other, path)
+            )
 
+    async def close(self):
+        """Close the middleware loaded so far."""
+        await self.registry.close()
 
-def run_file_coordinator(config: Config, path: str, logger: Optional[Logger] = None):
-    """Run the file coordinator."""
+
+def run_file_coordinator(
+    config: Config,
+    path: str,
+    logger: Optional[Logger] = None,
+    changed: Optional[Iterable[str]] = None,
+):
+    """Run the file coordinator on the `changed` paths inside `path`,
+    or on everything inside `path` if not given."""
     coordinator = FileCoordinator(config, logger)
-    asyncio.run(coordinator.handle_directory(path))
+
+    async def handle():
+        try:
+            await coordinator.handle_changes(path, changed)
+        finally:
+            await coordinator.close()
+
+    asyncio.run(handle())
+
+
+def main(arguments: Optional[Sequence[str]] = None):
+    """Handle all files below the given paths (default: the homework directory)."""
+    parser = argparse.ArgumentParser(
+        description="Render documents (recursively) once, like on changes."
+    )
+    parser.add_argument(
+        "paths", nargs="*", help="files or directories (default: homework_dir)"
+    )
+    parser = utilities.argparse_add_argument_for_config_file_path(parser)
+    args = parser.parse_args(arguments)
+    config_data = haconfig.load_config(path=args.config)
+    utilities.drop_privileges(config_data)
+    coordinator = FileCoordinator(config_data)
+    asyncio.run(coordinator.handle_paths(args.paths or [config_data.homework_dir]))
+
+
+if __name__ == "__main__":
+    main()
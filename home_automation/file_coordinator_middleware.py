@@ -1,13 +1,226 @@
 """Middleware for `FileCoordinator`"""
+import asyncio
+import contextlib
+import hashlib
 import os
+import re
 import shutil
+import subprocess
+import tempfile
 from abc import ABC, abstractmethod
 from logging import Logger
-from typing import Optional
+from typing import ContextManager, Dict, Iterator, Optional, Tuple
 
-from home_automation.config import Config
+from home_automation.archive_index import file_content_hash
+from home_automation import markdown_renderer, utilities
+from home_automation.config import Config, ConfigMiddlewareLaTeX
+from home_automation.ignore_registry import get_ignore_registry
+from home_automation.render_cache import (
+    LATEX_COMMENT_PATTERN,
+    LATEX_DEPENDENCY_PATTERN,
+    RenderCache,
+    get_render_cache,
+    resolve,
+)
 
 BYPRODUCTS_FILE_EXTENSIONS = ["aux", "dvi", "log", "out", "synctex.gz", "toc"]
+SHARED_BYPRODUCT_DIRS = ["texlive2020"]
+# files written by one pdflatex pass and read by the next one
+AUXILIARY_FILE_EXTENSIONS = ["aux", "toc", "lof", "lot", "out"]
+RERUN_PATTERN = re.compile(
+    rb"Rerun to get|Rerun LaTeX|Please rerun LaTeX|Label\(s\) may have changed"
+)
+# lines pdflatex writes into every .aux file, not worth another pass on their own
+TRIVIAL_AUX_LINE_PATTERN = re.compile(rb"^\\(relax|gdef ?\\@abspage@last\{\d+\})$")
+OUTPUT_WRITTEN_PATTERN = re.compile(rb"Output written on")
+# where mylatexformat stops dumping the preamble
+PREAMBLE_END_PATTERN = re.compile(r"\\begin\s*\{document\}|\\endofdump")
+
+
+async def run_command(*args: str, cwd: Optional[str] = None) -> int:
+    """Run a command as a subprocess without blocking the event loop
+    and return its exit code."""
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        cwd=cwd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return await process.wait()
+
+
+def _output_base(path: str, directory: Optional[str]) -> str:
+    if directory is None:
+        return os.path.splitext(path)[0]
+    return os.path.join(directory, os.path.splitext(os.path.basename(path))[0])
+
+
+def auxiliary_file_hashes(
+    path: str, directory: Optional[str] = None
+) -> Dict[str, Optional[str]]:
+    """Return the hashes of the auxiliary files of the LaTeX file `path` written
+    to `directory` (default: next to `path`), None for those that don't exist
+    or have no relevant content."""
+    hashes: Dict[str, Optional[str]] = {}
+    base = _output_base(path, directory)
+    for extension in AUXILIARY_FILE_EXTENSIONS:
+        try:
+            with open(f"{base}.{extension}", "rb") as file:
+                lines = [line.strip() for line in file.read().splitlines()]
+        except FileNotFoundError:
+            lines = []
+        lines = [
+            line for line in lines if line and not TRIVIAL_AUX_LINE_PATTERN.match(line)
+        ]
+        hashes[extension] = (
+            hashlib.sha256(b"\n".join(lines)).hexdigest() if lines else None
+        )
+    return hashes
+
+
+def log_requests_rerun(path: str, directory: Optional[str] = None) -> bool:
+    """Return whether the log of the LaTeX file `path` (written to `directory`,
+    default: next to `path`) asks for another pass."""
+    try:
+        with open(_output_base(path, directory) + ".log", "rb") as file:
+            return RERUN_PATTERN.search(file.read()) is not None
+    except FileNotFoundError:
+        return False
+
+
+def log_reports_output(path: str, directory: Optional[str] = None) -> bool:
+    """Return whether the log of the LaTeX file `path` (written to `directory`,
+    default: next to `path`) says a PDF was written."""
+    try:
+        with open(_output_base(path, directory) + ".log", "rb") as file:
+            return OUTPUT_WRITTEN_PATTERN.search(file.read()) is not None
+    except FileNotFoundError:
+        return False
+
+
+def latex_preamble(path: str) -> Optional[str]:
+    """Return the preamble of the LaTeX document `path` (without comments),
+    None if it has none (e.g. parts of other documents)."""
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as file:
+            source = LATEX_COMMENT_PATTERN.sub("", file.read())
+    except OSError:
+        return None
+    match = PREAMBLE_END_PATTERN.search(source)
+    if not match or "\\documentclass" not in source[: match.start()]:
+        return None
+    return source[: match.start()]
+
+
+class LaTeXFormatCache:
+    """Precompiled formats (`.fmt`) of document preambles, dumped with the
+    mylatexformat package. Documents sharing a preamble are compiled with
+    `-fmt` then, so their packages don't have to be loaded on every run.
+
+    Formats are keyed by the preamble, the files it includes and the pdflatex
+    binary (formats of other versions can't be loaded). Preambles that can't
+    be dumped are remembered and compiled as usual."""
+
+    directory: str
+    _locks: Dict[str, asyncio.Lock]
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._locks = {}
+
+    @staticmethod
+    def key(path: str, preamble: str) -> str:
+        """Return the key of the format for the preamble of the document `path`."""
+        sha = hashlib.sha256(preamble.encode("utf-8"))
+        engine = shutil.which("pdflatex")
+        if engine:
+            sha.update(f"\0{engine}\0{os.stat(engine).st_mtime_ns}".encode("utf-8"))
+        directories = [os.path.dirname(path), os.path.expanduser("~")]
+        for _, arguments in LATEX_DEPENDENCY_PATTERN.findall(preamble):
+            for reference in arguments.split(","):
+                if not reference.strip():
+                    continue
+                dependency = resolve(reference, directories, [".tex", ".sty"])
+                content_hash = (
+                    file_content_hash(dependency) if os.path.isfile(dependency) else "-"
+                )
+                sha.update(f"\0{dependency}\0{content_hash}".encode("utf-8"))
+        return sha.hexdigest()
+
+    def _lock(self, key: str) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+    async def get(self, path: str) -> Optional[str]:
+        """Return the format (path without `.fmt`) to compile `path` with,
+        dumping it first if necessary. None if there is none."""
+        preamble = await utilities.run_blocking(latex_preamble, path)
+        if preamble is None:
+            return None
+        key = await utilities.run_blocking(self.key, path, preamble)
+        fmt = os.path.join(self.directory, key)
+        async with self._lock(fmt):
+            if os.path.isfile(fmt + ".fmt"):
+                return fmt
+            if os.path.isfile(fmt + ".failed"):
+                return None
+            if await self._dump(fmt, preamble):
+                return fmt
+            self.mark_failed(fmt)
+            return None
+
+    async def _dump(self, fmt: str, preamble: str) -> bool:
+        os.makedirs(self.directory, exist_ok=True)
+        source = fmt + ".tex"
+        # jobs of other processes might dump the same format
+        jobname = f"{os.path.basename(fmt)}.{os.getpid()}"
+        with open(source, "w", encoding="utf-8") as file:
+            file.write(preamble + "\\begin{document}\\end{document}\n")
+        try:
+            await run_command(
+                "pdflatex",
+                "-ini",
+                "-interaction=nonstopmode",
+                f"-jobname={jobname}",
+                f"-output-directory={self.directory}",
+                "&pdflatex",
+                "mylatexformat.ltx",
+                source,
+                cwd=os.path.expanduser("~"),
+            )
+            dumped = os.path.join(self.directory, jobname + ".fmt")
+            if not os.path.isfile(dumped):
+                return False
+            os.replace(dumped, fmt + ".fmt")
+            return True
+        finally:
+            for leftover in [source, os.path.join(self.directory, jobname + ".log")]:
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+    @staticmethod
+    def mark_failed(fmt: str):
+        """Don't use (or dump again) the format `fmt`."""
+        with open(fmt + ".failed", "w", encoding="utf-8"):
+            pass
+        if os.path.exists(fmt + ".fmt"):
+            os.remove(fmt + ".fmt")
+
+
+class RenderError(Exception):
+    """A document couldn't be rendered."""
+
+
+def _file_identity(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
 
 
 class FileCoordinatorMiddleware(ABC):
@@ -26,51 +239,231 @@ class FileCoordinatorMiddleware(ABC):
 
     @abstractmethod
     async def act(self, path: str):
-        """Act on the file."""
+        """Act on the file. Raise `RenderError` (or OSError) if that failed, so
+        the file is quarantined instead of being retried on every change."""
+
+    @classmethod
+    def enabled(cls, config: Config) -> bool:  # pylint: disable=unused-argument
+        """Whether to use this middleware with `config` at all."""
+        return True
+
+    def cleanup_directory(self, directory: str):  # pylint: disable=unused-argument
+        """Clean up after all files in `directory` were handled. Optional."""
+        return
+
+    def content_hash(self, path: str) -> str:
+        """Return what failures of `path` are remembered by (see `quarantine`)."""
+        return file_content_hash(path)
 
 
 class LaTeXRelatedMiddleware(FileCoordinatorMiddleware, ABC):
     """Middleware for LaTeX related files"""
 
+    @property
+    def render_cache(self) -> RenderCache:
+        """Fingerprints of the rendered documents."""
+        return get_render_cache(self.config)
+
+    @staticmethod
+    def output_path(path: str) -> str:
+        """Return the PDF `path` is rendered to."""
+        return os.path.splitext(path)[0] + ".pdf"
+
+    def needs_rendering(self, path: str) -> bool:
+        """Return whether the PDF is missing or `path` or one of its
+        dependencies changed since it was rendered."""
+        return not self.render_cache.is_up_to_date(path, self.output_path(path))
+
+    def ignoring_byproducts(self, path: str) -> ContextManager[None]:
+        """Return a context in which the events caused by byproducts
+        written next to `path` are ignored (see `ignore_registry`)."""
+        base = os.path.splitext(path)[0]
+        extensions = sorted(set(BYPRODUCTS_FILE_EXTENSIONS + AUXILIARY_FILE_EXTENSIONS))
+        return get_ignore_registry(self.config).ignoring(
+            [f"{base}.{extension}" for extension in extensions],
+            [
+                os.path.join(os.path.dirname(path), shared_dir)
+                for shared_dir in SHARED_BYPRODUCT_DIRS
+            ],
+        )
+
+    def content_hash(self, path: str) -> str:
+        """Return the fingerprint of `path`, so fixing one of
+        its dependencies lifts the quarantine, too."""
+        return self.render_cache.fingerprint(path)
+
+    @contextlib.contextmanager
+    def build_directory(self, path: str) -> Iterator[str]:
+        """Yield the directory to render `path` in: a new directory in
+        `middleware.scratch_dir` if configured (removed afterwards),
+        otherwise the directory of `path` itself."""
+        scratch_dir = self.config.middleware.scratch_dir
+        if not scratch_dir:
+            yield os.path.dirname(path)
+            return
+        os.makedirs(scratch_dir, exist_ok=True)
+        with tempfile.TemporaryDirectory(
+            prefix="home_automation-", dir=scratch_dir
+        ) as directory:
+            yield directory
+
+    def publish(self, path: str, build_directory: str) -> bool:
+        """Copy the PDF rendered from `path` in `build_directory` next to `path`,
+        replacing the previous one atomically. Return whether there was one."""
+        output = self.output_path(path)
+        built = os.path.join(build_directory, os.path.basename(output))
+        if os.path.abspath(built) == os.path.abspath(output):
+            return os.path.isfile(output)
+        if not os.path.isfile(built):
+            if self.logger:
+                self.logger.warning("No PDF was rendered from %s", path)
+            return False
+        # hidden, so it's neither compressed nor archived in the meantime
+        tmp_output = os.path.join(
+            os.path.dirname(output), f".{os.path.basename(output)}.{os.getpid()}.tmp"
+        )
+        # the resulting PDF is a change like any other (to be compressed)
+        with get_ignore_registry(self.config).ignoring([tmp_output]):
+            try:
+                shutil.copyfile(built, tmp_output)
+                os.replace(tmp_output, output)
+            finally:
+                if os.path.exists(tmp_output):
+                    os.remove(tmp_output)
+        return True
+
+    def check_rendered(
+        self,
+        path: str,
+        published: bool,
+        previous_output: Optional[Tuple[int, int, int]],
+    ):
+        """Raise `RenderError` unless a new PDF was published for `path`
+        (`previous_output` is the `_file_identity` of the one before)."""
+        output = self.output_path(path)
+        if not published or _file_identity(output) == previous_output:
+            raise RenderError(f"No PDF was rendered from {path}")
+
+    def record_rendered(self, path: str, fingerprint: str):
+        """Remember rendering `path` (with `fingerprint` from before rendering)."""
+        if os.path.isfile(self.output_path(path)):
+            self.render_cache.record(path, fingerprint)
+
     def cleanup(self, path: str):
-        """Clean up LaTeX byproducts if configured so."""
+        """Clean up LaTeX byproducts of `path` if configured so."""
         if self.config.middleware.latex:
             if self.config.middleware.latex.delete_byproducts:
                 for byproduct in BYPRODUCTS_FILE_EXTENSIONS:
-                    byproduct_path = path.replace(".tex", f".{byproduct}")
+                    byproduct_path = f"{os.path.splitext(path)[0]}.{byproduct}"
                     if os.path.isfile(byproduct_path):
                         os.remove(byproduct_path)
                         if self.logger:
                             self.logger.info("Deleted byproduct: %s", byproduct_path)
-                directory = os.path.dirname(path)
-                texlive_dir = os.path.join(directory, "texlive2020")
-                if os.path.isdir(texlive_dir):
-                    shutil.rmtree(texlive_dir)
-                    if self.logger:
-                        self.logger.info("Deleted byproduct: %s", texlive_dir)
+
+    def cleanup_directory(self, directory: str):
+        """Clean up LaTeX byproducts shared by all documents in `directory`
+        if configured so. Only done once nothing is rendered there anymore."""
+        if self.config.middleware.latex:
+            if self.config.middleware.latex.delete_byproducts:
+                for shared_dir in SHARED_BYPRODUCT_DIRS:
+                    texlive_dir = os.path.join(directory, shared_dir)
+                    if os.path.isdir(texlive_dir):
+                        with get_ignore_registry(self.config).ignoring(
+                            [texlive_dir], [texlive_dir]
+                        ):
+                            shutil.rmtree(texlive_dir)
+                        if self.logger:
+                            self.logger.info("Deleted byproduct: %s", texlive_dir)
 
 
 class LaTeXToPDFMiddleware(LaTeXRelatedMiddleware):
     """Middleware that converts LaTeX files to PDFs."""
 
+    format_cache: Optional[LaTeXFormatCache]
+
+    def __init__(self, config: Config, logger: Optional[Logger] = None):
+        super().__init__(config, logger)
+        latex_config = config.middleware.latex or ConfigMiddlewareLaTeX()
+        self.format_cache = (
+            LaTeXFormatCache(latex_config.format_dir)
+            if latex_config.format_dir
+            else None
+        )
+
     async def test(self, path: str) -> bool:
         """Test if the path is to be handles by this middleware."""
-        if os.path.isfile(path.replace(".tex", ".pdf")):
-            return False
-        return path.endswith(".tex") and not (
-            path.startswith(".") or path.startswith("_")
+        return (
+            path.endswith(".tex")
+            and not (path.startswith(".") or path.startswith("_"))
+            and await utilities.run_blocking(self.needs_rendering, path)
         )
 
+    async def compile(
+        self, path: str, directory: str, fmt: Optional[str] = None
+    ) -> int:
+        """Compile `path` into `directory` (with the format `fmt`, if given)
+        as often as necessary and return how often."""
+        home = os.path.expanduser("~")
+        latex_config = self.config.middleware.latex or ConfigMiddlewareLaTeX()
+        log = _output_base(path, directory) + ".log"
+        if os.path.exists(log):
+            os.remove(log)  # so a failing first pass isn't mistaken for a success
+        hashes = auxiliary_file_hashes(path, directory)
+        passes = 0
+        while True:
+            passes += 1
+            await run_command(
+                "pdflatex",
+                "-interaction=nonstopmode",
+                *([f"-fmt={fmt}"] if fmt else []),
+                f"-output-directory={directory}",
+                path,
+                cwd=home,
+            )
+            # like latexmk: rerun until the auxiliary files reach a fixpoint
+            previous_hashes, hashes = hashes, auxiliary_file_hashes(path, directory)
+            if hashes == previous_hashes and not log_requests_rerun(path, directory):
+                return passes
+            if passes >= latex_config.max_passes:
+                if self.logger:
+                    self.logger.warning(
+                        "Cross-references still unresolved after %s passes: %s",
+                        passes,
+                        path,
+                    )
+                return passes
+
     async def act(self, path: str):
         """Act on the file."""
-        directory = os.path.dirname(path)
-        home = os.path.expanduser("~")
-        command = f"cd '{home}' && pdflatex -output-directory='{directory}' '{path}'"
-        os.system(command)
-        os.system(command)  # always compile twice (e.g. for a table of contents)
-        if self.logger:
-            self.logger.info("Rendered LaTeX file to PDF: %s", path)
-        self.cleanup(path)
+        with self.ignoring_byproducts(path):
+            fingerprint = await utilities.run_blocking(
+                self.render_cache.fingerprint, path
+            )
+            previous_output = _file_identity(self.output_path(path))
+            fmt = await self.format_cache.get(path) if self.format_cache else None
+            with self.build_directory(path) as directory:
+                passes = await self.compile(path, directory, fmt)
+                if fmt and not log_reports_output(path, directory):
+                    if self.logger:
+                        self.logger.warning(
+                            "Couldn't compile %s with format %s, retrying without",
+                            path,
+                            fmt,
+                        )
+                    passes += await self.compile(path, directory)
+                    if not log_reports_output(path, directory):
+                        # the document is broken, not the format
+                        raise RenderError(f"Couldn't compile {path}")
+                    LaTeXFormatCache.mark_failed(fmt)
+                published = self.publish(path, directory)
+            self.check_rendered(path, published, previous_output)
+            if self.logger:
+                self.logger.info(
+                    "Rendered LaTeX file to PDF in %s passes: %s", passes, path
+                )
+            self.record_rendered(path, fingerprint)
+            if not self.config.middleware.scratch_dir:
+                self.cleanup(path)
 
 
 class MarkdownToPDFMiddleware(LaTeXToPDFMiddleware):
@@ -78,17 +471,50 @@ class MarkdownToPDFMiddleware(LaTeXToPDFMiddleware):
 
     async def test(self, path: str) -> bool:
         """Test if the path is to be handles by this middleware."""
-        if os.path.isfile(path.replace(".md", ".pdf")):
+        return (
+            path.endswith(".md")
+            and not (path.startswith(".") or path.startswith("_"))
+            and await utilities.run_blocking(self.needs_rendering, path)
+        )
+
+    def can_render_in_process(self, path: str) -> bool:
+        """Return whether `path` is to be rendered without pandoc."""
+        if self.config.middleware.markdown_renderer != "html":
+            return False
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                source = file.read()
+        except (OSError, UnicodeDecodeError):
             return False
-        return path.endswith(".md") and not (
-            path.startswith(".") or path.startswith("_")
+        return not markdown_renderer.needs_pandoc(source) and (
+            markdown_renderer.get_markdown_renderer().available
         )
 
     async def act(self, path: str):
         """Act on the file."""
         home = os.path.expanduser("~")
-        command = f"cd '{home}' && pandoc -o '{path.replace('.md', '.pdf')}' '{path}'"
-        os.system(command)
+        fingerprint = await utilities.run_blocking(self.render_cache.fingerprint, path)
+        previous_output = _file_identity(self.output_path(path))
+        with self.build_directory(path) as directory:
+            output = os.path.join(directory, os.path.basename(self.output_path(path)))
+            renderer = "pandoc"
+            if self.can_render_in_process(path):
+                try:
+                    await markdown_renderer.get_markdown_renderer().render(path, output)
+                    renderer = "html"
+                except markdown_renderer.MarkdownRenderError as error:
+                    if self.logger:
+                        self.logger.warning(
+                            "Couldn't render %s in-process, using pandoc: %s",
+                            path,
+                            error,
+                        )
+            if renderer == "pandoc":
+                await run_command("pandoc", "-o", output, path, cwd=home)
+            published = self.publish(path, directory)
+        self.check_rendered(path, published, previous_output)
         if self.logger:
-            self.logger.info("Rendered Markdown file to PDF: %s", path)
-        self.cleanup(path)
+            self.logger.info("Rendered Markdown file to PDF (%s): %s", renderer, path)
+        self.record_rendered(path, fingerprint)
+        if not self.config.middleware.scratch_dir:
+            self.cleanup(path)
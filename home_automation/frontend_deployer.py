@@ -1,24 +1,24 @@
 #!/usr/bin/python3
 # pylint: disable=invalid-name
 """Deploy frontend container in k8s."""
+# pylint: disable=import-outside-toplevel
 import argparse
 import base64
 import json
 import logging
 import re
-from typing import List, Tuple
-
-import docker
-import docker.errors
-import semver
-from docker.models.images import Image
-from kubernetes import client as klient
+from typing import TYPE_CHECKING, List, Tuple
 
 import home_automation
 from home_automation import utilities
 from home_automation.config import Config, ConfigError, load_config
 from home_automation.server.backend.state_manager import StateManager
 
+if TYPE_CHECKING:
+    # the docker & kubernetes clients take long to import, so only when deploying
+    from docker.models.images import Image
+    from kubernetes import client as klient
+
 logging.basicConfig(level=logging.INFO)
 
 
@@ -39,6 +39,8 @@ Image name already contains a tag."
 
 def _create_new_namespace_if_necessary(config: Config):
     """Create the namespace if it doesn't exist."""
+    from kubernetes import client as klient
+
     k_client = utilities.get_k8s_client(config)
     v1 = klient.CoreV1Api(k_client)
     namespaces = v1.list_namespace().items
@@ -57,7 +59,9 @@ def _create_new_namespace_if_necessary(config: Config):
         logging.info("Namespace found.")
 
 
-def _get_new_deployment(config: Config) -> klient.V1Deployment:
+def _get_new_deployment(config: Config) -> "klient.V1Deployment":
+    from kubernetes import client as klient
+
     tag = _get_image_tag(config)
     _, registry_name = _parse_registry_url(config)
     env_vars = [
@@ -110,7 +114,9 @@ def _get_new_deployment(config: Config) -> klient.V1Deployment:
     )
 
 
-def _get_new_service(config: Config) -> klient.V1Service:
+def _get_new_service(config: Config) -> "klient.V1Service":
+    from kubernetes import client as klient
+
     return klient.V1Service(
         api_version="v1",
         kind="Service",
@@ -138,7 +144,9 @@ Could not extract host from it."
     return host, registry_name
 
 
-def _get_new_registry_authentication_secret(config: Config) -> klient.V1Secret:
+def _get_new_registry_authentication_secret(config: Config) -> "klient.V1Secret":
+    from kubernetes import client as klient
+
     assert config.docker.registry
     assert config.docker.registry.auth
     host, registry_name = _parse_registry_url(config)
@@ -165,6 +173,8 @@ def _get_new_registry_authentication_secret(config: Config) -> klient.V1Secret:
 
 def _create_registry_secret_if_necessary(config: Config):
     """Create the registry secret if it doesn't exist and if credentials are given."""
+    from kubernetes import client as klient
+
     if not config.docker.registry or not config.docker.registry.auth:
         return
     _, registry_name = _parse_registry_url(config)
@@ -183,6 +193,8 @@ def _create_registry_secret_if_necessary(config: Config):
 
 def deploy_frontend_service(config: Config):
     """Deploy the frontend service."""
+    from kubernetes import client as klient
+
     k_client = utilities.get_k8s_client(config)
     v1 = klient.CoreV1Api(k_client)
     services = v1.list_namespaced_service(namespace=config.frontend.namespace).items
@@ -203,6 +215,8 @@ def deploy_frontend_service(config: Config):
 
 def deploy_frontend_deployment(config: Config):
     """Only deploy the frontend, don't build the image."""
+    from kubernetes import client as klient
+
     k_client = utilities.get_k8s_client(config)
     apps_v1 = klient.AppsV1Api(k_client)
     query_result = apps_v1.list_namespaced_deployment(
@@ -238,10 +252,13 @@ def deploy_frontend_deployment(config: Config):
 
 def build_image_if_appropriate(config: Config):
     """Build the image if it is appropriate."""
+    import docker
+    import docker.errors
+
     client = docker.from_env()
     current_tag = _get_image_tag(config)
     try:
-        image: Image = client.images.get(current_tag)
+        image: "Image" = client.images.get(current_tag)
         if current_tag not in image.tags:
             raise docker.errors.ImageNotFound(f"Image '{current_tag}' not found.")
         logging.info("Image '%s' already found.", current_tag)
@@ -255,6 +272,9 @@ def build_image_if_appropriate(config: Config):
 
 def build_image(config: Config):
     """Build the frontend image."""
+    import docker
+    import semver
+
     state_manager = StateManager(config)
     state_manager.update_status("building_frontend_image", 1)
     tag = _get_image_tag(config)
@@ -329,6 +349,8 @@ def build_and_deploy_frontend(config: Config):
 
 def delete_frontend(config: Config):
     """Delete the frontend, including the namespace."""
+    from kubernetes import client as klient
+
     logging.info("Deleting entire frontend (including deployment & namespace)...")
     k_client = utilities.get_k8s_client(config)
     v1 = klient.CoreV1Api(k_client)
@@ -2,14 +2,15 @@
 import asyncio
 import logging
 import re
-from typing import Any, Dict, Optional, Tuple, Union
-
-import httpx
-from kubernetes import client as klient
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple, Union
 
 from home_automation import utilities
 from home_automation.config import Config, ConfigError, load_config
 
+if TYPE_CHECKING:
+    # httpx takes long to import, so (like the kubernetes client) only when updating
+    import httpx
+
 PORTAINER_CALLS_TIMEOUT = 5
 CURRENT_HASS_VERSION_REGEX = (
     r"image: homeassistant/home-assistant:(?P<version>\d\d\d\d\.\d\d?\.\d+)"
@@ -21,7 +22,7 @@ class UpdaterError(Exception):
 
 
 async def _log_in_to_portainer(
-    config: Config, client: httpx.AsyncClient
+    config: Config, client: "httpx.AsyncClient"
 ) -> Dict[str, str]:
     """Log in to portainer and return authorization header. Might raise ServerAPIError."""
     if not config.portainer:
@@ -45,7 +46,7 @@ async def _log_in_to_portainer(
 
 
 async def _get_portainer_stack(
-    config: Config, client: httpx.AsyncClient, headers: Dict[str, str]
+    config: Config, client: "httpx.AsyncClient", headers: Dict[str, str]
 ) -> Dict[str, str]:
     """Get portainer stack data. Might raise ServerAPIError."""
     if not config.portainer:
@@ -101,7 +102,7 @@ def _get_current_version_from_portainer_stack(stack: Dict[str, str]):
 
 async def _get_version_to_update_to(
     config: Config,
-    client: httpx.AsyncClient,
+    client: "httpx.AsyncClient",
     user_payload: Optional[Dict[str, str]] = None,
 ) -> str:
     """Get version of home assistant to update to. Might throw ServerAPIError."""
@@ -131,7 +132,7 @@ async def _get_version_to_update_to(
 
 async def _update_home_assistant_with_portainer(  # pylint: disable=too-many-arguments
     config: Config,
-    client: httpx.AsyncClient,
+    client: "httpx.AsyncClient",
     current_version: str,
     version_to_update_to: str,
     stack: Dict[str, str],
@@ -192,6 +193,8 @@ async def _update_home_assistant_with_portainer(  # pylint: disable=too-many-arg
 
 async def update_home_assistant_with_portainer(config: Config):
     """Use portainer to update Home Assistant."""
+    import httpx  # pylint: disable=import-outside-toplevel
+
     try:
         async with httpx.AsyncClient(
             verify=not config.portainer.insecure_https
@@ -220,6 +223,10 @@ async def update_home_assistant_with_portainer(config: Config):
 
 async def update_home_assistant_with_kubernetes(config: Config):
     """Use kubernetes to update Home Assistant."""
+    # pylint: disable=import-outside-toplevel
+    import httpx
+    from kubernetes import client as klient
+
     if not config.home_assistant.deployment:
         raise ConfigError(
             "No home_assistant.deployment configuration (for k8s) provided."
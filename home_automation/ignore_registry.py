@@ -0,0 +1,154 @@
+"""Paths home_automation itself is about to write, move or delete.
+
+Compressed PDFs, LaTeX byproducts, archived files etc. cause file system events
+just like changes by users do. Components declare what they touch (see
+`ignoring`), so the watchdog runner doesn't react to its own changes. Declared
+paths are stored in `storage.local`, as the archiver runs in a process of its
+own, and stay ignored for a few seconds after the operation ended, as events
+are delivered asynchronously."""
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from home_automation import config as haconfig
+
+# how long events are still ignored after the operation ended
+GRACE_PERIOD = 5.0
+# upper bound for operations of processes that died in the meantime
+MAX_DURATION = 60 * 60
+# how long the ignored paths declared by other processes may be outdated
+REFRESH_INTERVAL = 0.2
+
+_REGISTRIES: Dict[str, "IgnoreRegistry"] = {}
+
+
+class IgnoreRegistry:
+    """Ignored paths (and directories with everything below them), see above."""
+
+    config: haconfig.Config
+    path: str
+    clock: Callable[[], float]
+    _entries: List[Tuple[str, bool, float]]
+    _refreshed_at: Optional[float]
+    _lock: threading.Lock
+
+    def __init__(self, config: haconfig.Config, clock: Callable[[], float] = time.time):
+        self.config = config
+        self.path = config.storage.local.path
+        self.clock = clock
+        self._entries = []
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+        self._prepare_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _prepare_db(self):
+        """Create tables if necessary."""
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS ignored_paths \
+(id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT NOT NULL, \
+recursive INTEGER NOT NULL, until REAL NOT NULL)"
+            )
+        connection.close()
+
+    def add(self, paths: Iterable[str], directories: Iterable[str] = ()) -> List[int]:
+        """Ignore events for `paths` and everything below `directories`
+        until `release`d and return the ids to do so."""
+        now = self.clock()
+        entries = [
+            (os.path.normpath(path), recursive, now + MAX_DURATION)
+            for recursive, entry_paths in [(False, paths), (True, directories)]
+            for path in entry_paths
+        ]
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute("DELETE FROM ignored_paths WHERE until<?", (now,))
+                ids = [
+                    connection.execute(
+                        "INSERT INTO ignored_paths (path, recursive, until) \
+VALUES (?, ?, ?)",
+                        entry,
+                    ).lastrowid
+                    for entry in entries
+                ]
+        finally:
+            connection.close()
+        with self._lock:
+            self._entries.extend(entries)
+        return ids
+
+    def release(self, ids: Iterable[int]):
+        """Stop ignoring the paths added with `ids` after `GRACE_PERIOD`."""
+        ids = list(ids)
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    "UPDATE ignored_paths SET until=? WHERE id=?",
+                    [(self.clock() + GRACE_PERIOD, entry_id) for entry_id in ids],
+                )
+        finally:
+            connection.close()
+        self.refresh()
+
+    @contextlib.contextmanager
+    def ignoring(
+        self, paths: Iterable[str] = (), directories: Iterable[str] = ()
+    ) -> Iterator[None]:
+        """Ignore events for `paths` and everything below `directories`
+        while in this context."""
+        ids = self.add(paths, directories)
+        try:
+            yield
+        finally:
+            self.release(ids)
+
+    def refresh(self):
+        """Read the ignored paths (declared by any process)."""
+        now = self.clock()
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT path, recursive, until FROM ignored_paths WHERE until>=?",
+                (now,),
+            ).fetchall()
+        finally:
+            connection.close()
+        with self._lock:
+            self._entries = [
+                (path, bool(recursive), until) for path, recursive, until in rows
+            ]
+            self._refreshed_at = now
+
+    def is_ignored(self, path: str) -> bool:
+        """Return whether events for `path` are to be ignored."""
+        now = self.clock()
+        if self._refreshed_at is None or now - self._refreshed_at >= REFRESH_INTERVAL:
+            self.refresh()
+        path = os.path.normpath(path)
+        with self._lock:
+            for ignored, recursive, until in self._entries:
+                if until < now:
+                    continue
+                if path == ignored or (
+                    recursive and path.startswith(ignored.rstrip(os.sep) + os.sep)
+                ):
+                    return True
+        return False
+
+
+def get_ignore_registry(config: haconfig.Config) -> IgnoreRegistry:
+    """Return this process' ignore registry for the configured database."""
+    registry = _REGISTRIES.get(config.storage.local.path)
+    if registry is None:
+        registry = IgnoreRegistry(config)
+        _REGISTRIES[config.storage.local.path] = registry
+    return registry
@@ -0,0 +1,145 @@
+"""Report how long importing home_automation's entry points takes.
+
+Each module is imported in a fresh interpreter with `-X importtime`, so the
+numbers are what a runner process, gunicorn worker or CLI invocation pays on
+startup. Heavy dependencies are supposed to be imported lazily (when first
+used), use `--budget` to check they still are."""
+import argparse
+import subprocess
+import sys
+from typing import List, Optional, Sequence
+
+ENTRY_POINTS = [
+    "home_automation.runner",
+    "home_automation.server.backend.app",
+    "home_automation.archive_manager",
+    "home_automation.compression_manager",
+    "home_automation.file_coordinator",
+]
+
+
+class ImportTime:  # pylint: disable=too-few-public-methods
+    """One line of `-X importtime`'s output (times in microseconds)."""
+
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+    def __init__(self, module: str, self_us: int, cumulative_us: int, depth: int):
+        self.module = module
+        self.self_us = self_us
+        self.cumulative_us = cumulative_us
+        self.depth = depth
+
+
+class ImportReport:  # pylint: disable=too-few-public-methods
+    """How long importing `module` took and what took longest."""
+
+    module: str
+    times: List[ImportTime]
+    error: Optional[str]
+
+    def __init__(
+        self, module: str, times: List[ImportTime], error: Optional[str] = None
+    ):
+        self.module = module
+        self.times = times
+        self.error = error
+
+    @property
+    def total_us(self) -> int:
+        """Return how long importing `module` took in total."""
+        return sum(time.cumulative_us for time in self.times if time.depth == 0)
+
+    def heaviest(self, count: int) -> List[ImportTime]:
+        """Return the `count` direct imports of `module` that took longest."""
+        direct = [time for time in self.times if time.depth == 1]
+        return sorted(direct, key=lambda time: time.cumulative_us, reverse=True)[
+            :count
+        ]
+
+
+def parse_import_times(output: str) -> List[ImportTime]:
+    """Parse the output (stderr) of `python -X importtime`."""
+    times = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # the header
+        name = fields[2].rstrip()
+        stripped = name.lstrip()
+        # the top-level import is indented by one space, each level by two more
+        depth = (len(name) - len(stripped) - 1) // 2
+        times.append(
+            ImportTime(stripped, int(fields[0]), int(fields[1]), max(depth, 0))
+        )
+    return times
+
+
+def measure(module: str, python: str = sys.executable) -> ImportReport:
+    """Import `module` in a fresh interpreter and return how long it took."""
+    process = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    times = parse_import_times(process.stderr)
+    # only the imports done on behalf of `module`, not the interpreter's own
+    for index, time in enumerate(times):
+        if time.depth == 0 and time.module == module:
+            first = index
+            while first > 0 and times[first - 1].depth > 0:
+                first -= 1
+            times = times[first : index + 1]
+            break
+    error = None
+    if process.returncode != 0:
+        lines = [
+            line
+            for line in process.stderr.splitlines()
+            if not line.startswith("import time:")
+        ]
+        error = lines[-1] if lines else f"exit code {process.returncode}"
+    return ImportReport(module, times, error)
+
+
+def main(arguments: Optional[Sequence[str]] = None) -> int:
+    """Print the import times of the entry points (or the given modules)."""
+    parser = argparse.ArgumentParser(description="Report import times.")
+    parser.add_argument(
+        "modules", nargs="*", help="modules to import (default: entry points)"
+    )
+    parser.add_argument(
+        "--top", type=int, default=5, help="how many of the heaviest imports to list"
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=None,
+        help="exit with 1 if importing any module takes longer (in ms)",
+    )
+    args = parser.parse_args(arguments)
+    over_budget = False
+    for module in args.modules or ENTRY_POINTS:
+        report = measure(module)
+        if report.error is not None:
+            print(f"{module:<50} failed: {report.error}")
+            over_budget = True
+            continue
+        total_ms = report.total_us / 1000
+        marker = ""
+        if args.budget is not None and total_ms > args.budget:
+            marker = f" (over budget of {args.budget:.0f} ms)"
+            over_budget = True
+        print(f"{module:<50} {total_ms:>7.0f} ms{marker}")
+        for time in report.heaviest(args.top):
+            print(f"    {time.module:<46} {time.cumulative_us / 1000:>7.0f} ms")
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
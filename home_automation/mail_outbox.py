@@ -0,0 +1,195 @@
+"""A persistent outbox for notification mails. Jobs only queue their mails
+(which is instant), a background sender delivers them, retrying with
+exponential backoff, so a slow or unreachable Gmail API never fails a job.
+Notifications sharing a digest key are coalesced into a single mail."""
+import sqlite3
+import time
+from typing import Callable, Dict, List, Optional, Union
+
+from home_automation import config as haconfig
+from home_automation import utilities
+from home_automation.server.backend import oauth2_helpers
+from home_automation.server.backend.state_manager import StateManager
+
+BACKOFF_BASE = 60
+BACKOFF_MAX = 6 * 60 * 60
+SENT_MAIL_RETENTION = 30 * 24 * 60 * 60
+DIGEST_SEPARATOR = "\n\n" + "-" * 40 + "\n\n"
+
+STATUS_PENDING = "pending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+
+Sender = Callable[[str, str], None]
+
+
+def get_backoff(attempts: int) -> float:
+    """Return how long to wait before the next attempt after `attempts` failed ones."""
+    return min(BACKOFF_BASE * 2 ** max(attempts - 1, 0), BACKOFF_MAX)
+
+
+class MailOutbox:
+    """Mails waiting to be sent, stored in `storage.local`."""
+
+    config: haconfig.Config
+    path: str
+    sender: Optional[Sender]
+
+    def __init__(self, config: haconfig.Config, sender: Optional[Sender] = None):
+        self.config = config
+        self.path = config.storage.local.path
+        self.sender = sender
+        self._prepare_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _prepare_db(self):
+        """Create tables if necessary."""
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS mail_outbox \
+(id INTEGER PRIMARY KEY AUTOINCREMENT, subject TEXT NOT NULL, body TEXT NOT NULL, \
+digest_key TEXT, notifications INTEGER NOT NULL DEFAULT 1, created_at REAL NOT NULL, \
+next_attempt_at REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, \
+status TEXT NOT NULL, last_error TEXT)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS mail_outbox_status \
+ON mail_outbox (status, next_attempt_at)"
+            )
+        connection.close()
+
+    def enqueue(
+        self,
+        subject: str,
+        body: str,
+        digest_key: Optional[str] = None,
+        now: Optional[float] = None,
+    ) -> int:
+        """Queue a mail and return its id. Mails with a `digest_key` are held
+        back for `email.digest_delay` seconds and further mails with the same key
+        queued in the meantime are appended to it instead of being sent on their own."""
+        if now is None:
+            now = time.time()
+        connection = self._connect()
+        try:
+            with connection:
+                if digest_key is not None:
+                    row = connection.execute(
+                        # only digests not due yet, so none being sent right now
+                        "SELECT id FROM mail_outbox WHERE digest_key=? AND status=? \
+AND attempts=0 AND next_attempt_at>? ORDER BY id LIMIT 1",
+                        (digest_key, STATUS_PENDING, now),
+                    ).fetchone()
+                    if row:
+                        connection.execute(
+                            "UPDATE mail_outbox SET body=body || ? || ?, \
+notifications=notifications+1 WHERE id=?",
+                            (DIGEST_SEPARATOR, body, row[0]),
+                        )
+                        return row[0]
+                    not_before = now + self.config.email.digest_delay
+                else:
+                    not_before = now
+                cursor = connection.execute(
+                    "INSERT INTO mail_outbox (subject, body, digest_key, created_at, \
+next_attempt_at, status) VALUES (?, ?, ?, ?, ?, ?)",
+                    (subject, body, digest_key, now, not_before, STATUS_PENDING),
+                )
+                return cursor.lastrowid
+        finally:
+            connection.close()
+
+    def _send(self, subject: str, body: str):
+        if self.sender is not None:
+            self.sender(subject, body)
+            return
+        credentials = oauth2_helpers.get_google_oauth2_credentials(
+            StateManager(self.config)
+        )
+        utilities.send_mail(self.config, credentials, subject, body)
+
+    def send_due(self, now: Optional[float] = None) -> int:
+        """Try sending all mails that are due and return how many were sent.
+        Failed mails are retried with exponential backoff up to
+        `email.max_attempts` times."""
+        if now is None:
+            now = time.time()
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT id, subject, body, notifications, attempts FROM mail_outbox \
+WHERE status=? AND next_attempt_at<=? ORDER BY id",
+                (STATUS_PENDING, now),
+            ).fetchall()
+            sent = 0
+            for mail_id, subject, body, notifications, attempts in rows:
+                if notifications > 1:
+                    subject = f"{subject} ({notifications} notifications)"
+                try:
+                    self._send(subject, body)
+                except Exception as error:  # pylint: disable=broad-except
+                    attempts += 1
+                    status = (
+                        STATUS_FAILED
+                        if attempts >= self.config.email.max_attempts
+                        else STATUS_PENDING
+                    )
+                    with connection:
+                        connection.execute(
+                            "UPDATE mail_outbox SET attempts=?, next_attempt_at=?, \
+status=?, last_error=? WHERE id=?",
+                            (
+                                attempts,
+                                now + get_backoff(attempts),
+                                status,
+                                repr(error),
+                                mail_id,
+                            ),
+                        )
+                    continue
+                with connection:
+                    connection.execute(
+                        "UPDATE mail_outbox SET status=?, attempts=? WHERE id=?",
+                        (STATUS_SENT, attempts + 1, mail_id),
+                    )
+                sent += 1
+            return sent
+        finally:
+            connection.close()
+
+    def get_mails(
+        self, status: Optional[str] = None
+    ) -> List[Dict[str, Union[int, float, str, None]]]:
+        """Return all mails (with `status`, if given), oldest first."""
+        connection = self._connect()
+        connection.row_factory = sqlite3.Row
+        try:
+            if status is None:
+                rows = connection.execute("SELECT * FROM mail_outbox ORDER BY id")
+            else:
+                rows = connection.execute(
+                    "SELECT * FROM mail_outbox WHERE status=? ORDER BY id", (status,)
+                )
+            return [dict(row) for row in rows]
+        finally:
+            connection.close()
+
+    def clean_up(
+        self, max_age: float = SENT_MAIL_RETENTION, now: Optional[float] = None
+    ) -> int:
+        """Delete sent mails older than `max_age` seconds and return how many."""
+        if now is None:
+            now = time.time()
+        connection = self._connect()
+        try:
+            with connection:
+                cursor = connection.execute(
+                    "DELETE FROM mail_outbox WHERE status=? AND created_at<?",
+                    (STATUS_SENT, now - max_age),
+                )
+            return cursor.rowcount
+        finally:
+            connection.close()
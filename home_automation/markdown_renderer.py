@@ -0,0 +1,166 @@
+"""Render Markdown to PDF in-process (Markdown → HTML → PDF with WeasyPrint).
+
+Simple notes don't need pandoc and a whole LaTeX engine: the parser, the
+stylesheet and the font configuration are set up once per process and
+documents are rendered in milliseconds. Documents using features only pandoc
+supports (math, raw LaTeX, citations, LaTeX metadata) are left to pandoc."""
+import asyncio
+import concurrent.futures
+import html
+import os
+import re
+import threading
+from typing import Any, Optional, Tuple
+
+MARKDOWN_EXTENSIONS = ["extra", "sane_lists", "toc"]
+STYLESHEET = """
+@page { size: A4; margin: 2cm; }
+body { font-family: sans-serif; font-size: 11pt; line-height: 1.4; }
+h1, h2, h3 { line-height: 1.2; }
+pre, code { font-family: monospace; font-size: 9.5pt; }
+pre { background: #f4f4f4; padding: 0.5em; white-space: pre-wrap; }
+table { border-collapse: collapse; }
+th, td { border: 1px solid #999; padding: 0.2em 0.5em; }
+img { max-width: 100%; }
+"""
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title></head>
+<body>{body}</body></html>"""
+
+UNSUPPORTED_PATTERNS = [
+    re.compile(r"(?<![\\$])\$[^\s$][^$]*\$"),  # inline math
+    re.compile(r"\$\$"),  # display math
+    re.compile(r"\\[(\[]"),  # \( \) and \[ \] math
+    re.compile(r"\\[a-zA-Z]+\s*[{\[]"),  # raw LaTeX commands
+    re.compile(r"\[[^\]]*@[\w:-]+[^\]]*\]"),  # citations
+    re.compile(
+        r"\A---\s*\n(?:.*\n)*?(?:bibliography|header-includes|documentclass"
+        r"|geometry|csl|toc):",
+        re.IGNORECASE,
+    ),  # metadata only pandoc understands
+]
+METADATA_PATTERN = re.compile(r"\A---\s*\n(.*?\n)(?:---|\.\.\.)\s*\n", re.DOTALL)
+TITLE_PATTERN = re.compile(r"^title:\s*(.+?)\s*$", re.MULTILINE)
+HEADING_PATTERN = re.compile(r"^#\s+(.+?)\s*#*\s*$", re.MULTILINE)
+
+_RENDERER: Optional["MarkdownRenderer"] = None
+
+
+class MarkdownRenderError(Exception):
+    """A Markdown document couldn't be rendered in-process."""
+
+
+def needs_pandoc(source: str) -> bool:
+    """Return whether the Markdown `source` uses features only pandoc supports."""
+    return any(pattern.search(source) for pattern in UNSUPPORTED_PATTERNS)
+
+
+def split_metadata(source: str) -> Tuple[Optional[str], str]:
+    """Return the title from the metadata block of `source` (if any)
+    and the document without the metadata block."""
+    match = METADATA_PATTERN.match(source)
+    if not match:
+        heading = HEADING_PATTERN.search(source)
+        return (heading.group(1) if heading else None), source
+    title = TITLE_PATTERN.search(match.group(1))
+    return (title.group(1).strip("\"'") if title else None), source[match.end() :]
+
+
+class MarkdownRenderer:
+    """Renders Markdown files to PDFs on a single background thread
+    (WeasyPrint isn't thread-safe) and keeps what can be reused between
+    documents. `available` is False if the libraries aren't installed."""
+
+    _executor: concurrent.futures.ThreadPoolExecutor
+    _lock: threading.Lock
+    _markdown: Any
+    _weasyprint: Any
+    _stylesheet: Any
+    _font_config: Any
+    _import_error: Optional[BaseException]
+
+    def __init__(self):
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="home_automation.markdown_renderer"
+        )
+        self._lock = threading.Lock()
+        self._markdown = None
+        self._weasyprint = None
+        self._stylesheet = None
+        self._font_config = None
+        self._import_error = None
+
+    def _load(self):
+        # pylint: disable=import-outside-toplevel
+        with self._lock:
+            if self._weasyprint is not None or self._import_error is not None:
+                return
+            if self._markdown is None:
+                try:
+                    import markdown
+                except ImportError as error:
+                    self._import_error = error
+                    return
+                self._markdown = markdown.Markdown(
+                    extensions=MARKDOWN_EXTENSIONS, output_format="html"
+                )
+            try:
+                import weasyprint
+                from weasyprint.text.fonts import FontConfiguration
+            # WeasyPrint raises OSError if pango isn't installed
+            except (ImportError, OSError) as error:
+                self._import_error = error
+                return
+            self._font_config = FontConfiguration()
+            self._stylesheet = weasyprint.CSS(
+                string=STYLESHEET, font_config=self._font_config
+            )
+            self._weasyprint = weasyprint
+
+    @property
+    def available(self) -> bool:
+        """Whether Markdown and WeasyPrint can be used."""
+        self._load()
+        return self._weasyprint is not None
+
+    def to_html(self, source: str) -> str:
+        """Convert the Markdown `source` to a standalone HTML document."""
+        self._load()
+        if self._markdown is None:
+            raise MarkdownRenderError(str(self._import_error))
+        title, source = split_metadata(source)
+        body = self._markdown.reset().convert(source)
+        return HTML_TEMPLATE.format(title=html.escape(title or ""), body=body)
+
+    def render_sync(self, path: str, output: str):
+        """Render the Markdown file `path` to the PDF `output`."""
+        self._load()
+        if self._weasyprint is None:
+            raise MarkdownRenderError(str(self._import_error))
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                document = self.to_html(file.read())
+            self._weasyprint.HTML(
+                string=document, base_url=os.path.dirname(path) + os.sep
+            ).write_pdf(
+                output,
+                stylesheets=[self._stylesheet],
+                font_config=self._font_config,
+            )
+        except MarkdownRenderError:
+            raise
+        except Exception as error:  # pylint: disable=broad-except
+            raise MarkdownRenderError(f"{path}: {error}") from error
+
+    async def render(self, path: str, output: str):
+        """Render the Markdown file `path` to the PDF `output` in the background."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self.render_sync, path, output)
+
+
+def get_markdown_renderer() -> MarkdownRenderer:
+    """Return this process' Markdown renderer."""
+    global _RENDERER  # pylint: disable=global-statement
+    if _RENDERER is None:
+        _RENDERER = MarkdownRenderer()
+    return _RENDERER
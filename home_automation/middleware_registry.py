@@ -0,0 +1,179 @@
+"""Registry of middleware by the files it handles.
+
+Middleware is declared as `(pattern, "module:Class")`, where `pattern` is a
+filename glob like `*.tex`. Simple `*.<extension>` patterns are looked up in a
+dict, so only the middleware matching a file is ever asked about it, and the
+module of a middleware is only imported once a matching file appears.
+
+Besides the built-in middleware, other packages can register middleware via
+entry points in the groups below, named by the pattern, e.g.
+
+    entry_points={
+        "home_automation.file_coordinator_middleware": [
+            "*.docx = my_package.middleware:DocxToPDFMiddleware",
+        ],
+    }"""
+import fnmatch
+import importlib
+import logging
+import os
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from home_automation import config as haconfig
+
+FILE_COORDINATOR_MIDDLEWARE = "home_automation.file_coordinator_middleware"
+COMPRESSION_MIDDLEWARE = "home_automation.compression_middleware"
+
+BUILTIN_MIDDLEWARE: Dict[str, List[Tuple[str, str]]] = {
+    FILE_COORDINATOR_MIDDLEWARE: [
+        ("*.tex", f"{FILE_COORDINATOR_MIDDLEWARE}:LaTeXToPDFMiddleware"),
+        ("*.md", f"{FILE_COORDINATOR_MIDDLEWARE}:MarkdownToPDFMiddleware"),
+    ],
+    COMPRESSION_MIDDLEWARE: [
+        ("*.pdf", f"{COMPRESSION_MIDDLEWARE}:FlashLightsInHomeAssistantMiddleware"),
+        ("*.pdf", f"{COMPRESSION_MIDDLEWARE}:ChangeStatusInThingsMiddleware"),
+        ("*.pdf", f"{COMPRESSION_MIDDLEWARE}:StatsCompressionMiddleware"),
+        ("*.pdf", f"{COMPRESSION_MIDDLEWARE}:SearchIndexCompressionMiddleware"),
+        ("*.pdf", f"{COMPRESSION_MIDDLEWARE}:ThumbnailCompressionMiddleware"),
+    ],
+}
+
+
+class MiddlewareLoadError(Exception):
+    """A middleware couldn't be imported or instantiated."""
+
+
+def entry_point_middleware(group: str) -> List[Tuple[str, str]]:
+    """Return the (pattern, target) pairs registered via entry points in `group`."""
+    # pylint: disable=import-outside-toplevel
+    from importlib import metadata
+
+    if sys.version_info >= (3, 10):
+        entry_points: Iterable[Any] = metadata.entry_points(group=group)
+    else:
+        entry_points = metadata.entry_points().get(group, [])
+    return [(entry_point.name, entry_point.value) for entry_point in entry_points]
+
+
+def _extension_of(pattern: str) -> Optional[str]:
+    """Return the extension of `*.<extension>` patterns, otherwise None."""
+    if not pattern.startswith("*."):
+        return None
+    extension = pattern[1:]
+    # os.path.splitext only returns the last extension
+    if extension.count(".") != 1 or any(char in extension for char in "*?[]"):
+        return None
+    return extension.lower()
+
+
+class MiddlewareRegistry:
+    """Middleware of one group (see above), created on first use with
+    `(config, logger)`. Middleware classes may define a classmethod
+    `enabled(config)` to opt out depending on the configuration."""
+
+    config: haconfig.Config
+    logger: Any
+    _by_extension: Dict[str, List[str]]
+    _by_pattern: List[Tuple[str, str]]
+    _instances: Dict[str, Optional[Any]]
+
+    def __init__(
+        self,
+        config: haconfig.Config,
+        logger: Any = None,
+        middleware: Iterable[Tuple[str, str]] = (),
+    ):
+        self.config = config
+        self.logger = logger
+        self._by_extension = {}
+        self._by_pattern = []
+        self._instances = {}
+        for pattern, target in middleware:
+            self.register(pattern, target)
+
+    @classmethod
+    def for_group(
+        cls, group: str, config: haconfig.Config, logger: Any = None
+    ) -> "MiddlewareRegistry":
+        """Return a registry of the built-in middleware of `group`
+        and the one registered via entry points."""
+        return cls(
+            config,
+            logger,
+            BUILTIN_MIDDLEWARE.get(group, []) + entry_point_middleware(group),
+        )
+
+    def register(self, pattern: str, target: Any):
+        """Register `target` (a "module:Class" string or an instance) for files
+        matching `pattern`."""
+        if isinstance(target, str):
+            key = target
+        else:
+            key = f"{type(target).__module__}:{type(target).__qualname__}"
+            self._instances[key] = target
+        extension = _extension_of(pattern)
+        if extension is not None:
+            targets = self._by_extension.setdefault(extension, [])
+            if key not in targets:
+                targets.append(key)
+        elif (pattern, key) not in self._by_pattern:
+            self._by_pattern.append((pattern, key))
+
+    def _load(self, target: str) -> Optional[Any]:
+        if target in self._instances:
+            return self._instances[target]
+        module_name, _, class_name = target.partition(":")
+        try:
+            middleware_class = getattr(importlib.import_module(module_name), class_name)
+            enabled = getattr(middleware_class, "enabled", None)
+            if enabled is not None and not enabled(self.config):
+                instance = None
+            else:
+                instance = middleware_class(self.config, self.logger)
+        except Exception as error:  # pylint: disable=broad-except
+            # don't try again for every file
+            self._instances[target] = None
+            raise MiddlewareLoadError(target) from error
+        self._instances[target] = instance
+        return instance
+
+    def targets_for(self, path: str) -> List[str]:
+        """Return the middleware (as "module:Class") registered for `path`."""
+        fname = os.path.basename(path)
+        targets: List[str] = []
+        _, extension = os.path.splitext(fname)
+        targets.extend(self._by_extension.get(extension.lower(), []))
+        for pattern, target in self._by_pattern:
+            if fnmatch.fnmatch(fname, pattern) and target not in targets:
+                targets.append(target)
+        return targets
+
+    def middleware_for(self, path: str) -> List[Any]:
+        """Return the (enabled) middleware handling `path`, importing it if
+        necessary. Middleware that can't be loaded is logged and skipped."""
+        middleware = []
+        for target in self.targets_for(path):
+            try:
+                instance = self._load(target)
+            except MiddlewareLoadError as error:
+                logging.getLogger(__name__).exception(
+                    "Couldn't load middleware %s", error
+                )
+                continue
+            if instance is not None:
+                middleware.append(instance)
+        return middleware
+
+    @property
+    def loaded(self) -> List[Any]:
+        """The middleware instantiated so far."""
+        return [instance for instance in self._instances.values() if instance]
+
+    async def close(self):
+        """Let the middleware instantiated so far release what it keeps between
+        files (e.g. connections), if it has a `close` coroutine method."""
+        for instance in self.loaded:
+            close = getattr(instance, "close", None)
+            if close is not None:
+                await close()
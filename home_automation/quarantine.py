@@ -0,0 +1,192 @@
+"""Files that repeatedly failed to be processed (compressed, rendered, archived).
+
+A corrupt PDF or a `.tex` file with a syntax error would otherwise be retried on
+every single change in its directory. Instead, failed files are skipped until
+their next retry (with exponential backoff), or until their content changes."""
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional, Union
+
+from home_automation import config as haconfig
+from home_automation.archive_index import file_content_hash
+
+SUBSYSTEM_COMPRESSION = "compression"
+SUBSYSTEM_RENDERING = "rendering"
+SUBSYSTEM_ARCHIVING = "archiving"
+
+_QUARANTINES: Dict[str, "Quarantine"] = {}
+
+
+class Quarantine:
+    """Failed files by path and content hash, stored in `storage.local`."""
+
+    config: haconfig.Config
+    path: str
+
+    def __init__(self, config: haconfig.Config):
+        self.config = config
+        self.path = config.storage.local.path
+        self._prepare_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _prepare_db(self):
+        """Create tables if necessary."""
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS quarantine \
+(path TEXT NOT NULL, subsystem TEXT NOT NULL, content_hash TEXT, \
+failures INTEGER NOT NULL, last_error TEXT, first_failed_at REAL NOT NULL, \
+last_failed_at REAL NOT NULL, next_retry_at REAL NOT NULL, \
+PRIMARY KEY (path, subsystem))"
+            )
+        connection.close()
+
+    def get_backoff(self, failures: int) -> float:
+        """Return how long to skip a file after `failures` failures in a row."""
+        return min(
+            self.config.quarantine.backoff_base * 2 ** max(failures - 1, 0),
+            self.config.quarantine.max_backoff,
+        )
+
+    @staticmethod
+    def _content_hash(path: str) -> Optional[str]:
+        try:
+            return file_content_hash(path) if os.path.isfile(path) else None
+        except OSError:
+            return None
+
+    def is_quarantined(
+        self,
+        path: str,
+        subsystem: str,
+        content_hash: Optional[str] = None,
+        now: Optional[float] = None,
+    ) -> bool:
+        """Return whether `path` is to be skipped by `subsystem`: it failed before
+        with the same content (`content_hash` defaults to the hash of the file)
+        and isn't to be retried yet."""
+        if now is None:
+            now = time.time()
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                "SELECT content_hash, next_retry_at FROM quarantine \
+WHERE path=? AND subsystem=?",
+                (path, subsystem),
+            ).fetchone()
+        finally:
+            connection.close()
+        if row is None or row[1] <= now:
+            return False
+        # only hashed for quarantined files
+        if content_hash is None:
+            content_hash = self._content_hash(path)
+        return content_hash == row[0]
+
+    def record_failure(
+        self,
+        path: str,
+        subsystem: str,
+        error: Union[BaseException, str],
+        content_hash: Optional[str] = None,
+        now: Optional[float] = None,
+    ) -> float:
+        """Remember that `subsystem` failed to process `path` and return when to
+        retry it. Failures of a file with different content start over."""
+        if now is None:
+            now = time.time()
+        if content_hash is None:
+            content_hash = self._content_hash(path)
+        connection = self._connect()
+        try:
+            with connection:
+                row = connection.execute(
+                    "SELECT content_hash, failures, first_failed_at FROM quarantine \
+WHERE path=? AND subsystem=?",
+                    (path, subsystem),
+                ).fetchone()
+                if row is not None and row[0] == content_hash:
+                    failures, first_failed_at = row[1] + 1, row[2]
+                else:
+                    failures, first_failed_at = 1, now
+                next_retry_at = now + self.get_backoff(failures)
+                connection.execute(
+                    "INSERT OR REPLACE INTO quarantine VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        path,
+                        subsystem,
+                        content_hash,
+                        failures,
+                        error if isinstance(error, str) else repr(error),
+                        first_failed_at,
+                        now,
+                        next_retry_at,
+                    ),
+                )
+            return next_retry_at
+        finally:
+            connection.close()
+
+    def record_success(self, path: str, subsystem: str):
+        """Forget previous failures of `subsystem` on `path`."""
+        self.clear(path, subsystem)
+
+    def get_entries(
+        self, subsystem: Optional[str] = None
+    ) -> List[Dict[str, Union[int, float, str, None]]]:
+        """Return all failed files (of `subsystem`, if given), most recent first.
+        `quarantined` tells whether they are currently skipped."""
+        now = time.time()
+        connection = self._connect()
+        connection.row_factory = sqlite3.Row
+        try:
+            if subsystem is None:
+                rows = connection.execute(
+                    "SELECT * FROM quarantine ORDER BY last_failed_at DESC"
+                )
+            else:
+                rows = connection.execute(
+                    "SELECT * FROM quarantine WHERE subsystem=? \
+ORDER BY last_failed_at DESC",
+                    (subsystem,),
+                )
+            entries = [dict(row) for row in rows]
+        finally:
+            connection.close()
+        for entry in entries:
+            entry["quarantined"] = entry["next_retry_at"] > now
+        return entries
+
+    def clear(self, path: Optional[str] = None, subsystem: Optional[str] = None) -> int:
+        """Forget the failures of `path` (or all files) by `subsystem` (or all
+        subsystems), so they are retried on the next occasion. Return how many."""
+        conditions, parameters = [], []
+        if path is not None:
+            conditions.append("path=?")
+            parameters.append(path)
+        if subsystem is not None:
+            conditions.append("subsystem=?")
+            parameters.append(subsystem)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        connection = self._connect()
+        try:
+            with connection:
+                cursor = connection.execute(
+                    f"DELETE FROM quarantine{where}", parameters
+                )
+            return cursor.rowcount
+        finally:
+            connection.close()
+
+
+def get_quarantine(config: haconfig.Config) -> Quarantine:
+    """Return this process' quarantine for the configured database."""
+    quarantine = _QUARANTINES.get(config.storage.local.path)
+    if quarantine is None:
+        quarantine = Quarantine(config)
+        _QUARANTINES[config.storage.local.path] = quarantine
+    return quarantine
@@ -0,0 +1,248 @@
+"""Which LaTeX/Markdown documents are rendered from their current sources.
+
+A document's fingerprint is a hash of its source and everything it pulls in
+(`\\input`, `\\include`, images, bibliographies, ...), so it's re-rendered
+exactly when one of them changed, instead of only if its PDF is missing."""
+import hashlib
+import os
+import re
+import sqlite3
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from home_automation import config as haconfig
+from home_automation.archive_index import file_content_hash
+
+LATEX_DEPENDENCY_PATTERN = re.compile(
+    r"\\(input|include|subfile|includegraphics|includepdf|bibliography|addbibresource)"
+    r"\s*(?:\[[^\]]*\])?\s*\{([^}]*)\}"
+)
+LATEX_COMMENT_PATTERN = re.compile(r"(?<!\\)%.*")
+MARKDOWN_IMAGE_PATTERN = re.compile(r"!\[[^\]]*\]\(\s*<?([^)\s>]+)")
+MARKDOWN_BIBLIOGRAPHY_PATTERN = re.compile(r"^bibliography:\s*(\S+)\s*$", re.MULTILINE)
+
+# extensions tried (in order) for references without one
+DEPENDENCY_EXTENSIONS = {
+    "input": [".tex"],
+    "include": [".tex"],
+    "subfile": [".tex"],
+    "includegraphics": [".pdf", ".png", ".jpg", ".jpeg", ".eps"],
+    "includepdf": [".pdf"],
+    "bibliography": [".bib"],
+    "addbibresource": [],
+}
+
+_CACHES: Dict[str, "RenderCache"] = {}
+
+
+def _candidates(reference: str, extensions: List[str]) -> List[str]:
+    if os.path.splitext(reference)[1]:
+        return [reference] + [reference + extension for extension in extensions]
+    return [reference + extension for extension in extensions] + [reference]
+
+
+def resolve(
+    reference: str, directories: List[str], extensions: Optional[List[str]] = None
+) -> str:
+    """Return the path `reference` refers to, looking in `directories` and trying
+    `extensions`. If it doesn't exist (yet), where it's expected is returned."""
+    reference = os.path.expanduser(reference.strip().strip('"'))
+    if os.path.isabs(reference):
+        directories = [""]
+    candidates = _candidates(reference, extensions or [])
+    for directory in directories:
+        for candidate in candidates:
+            path = os.path.join(directory, candidate)
+            if os.path.isfile(path):
+                return os.path.normpath(path)
+    return os.path.normpath(os.path.join(directories[0], candidates[0]))
+
+
+def _read_text(path: str) -> str:
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as file:
+            return file.read()
+    except OSError:
+        return ""
+
+
+def latex_dependencies(path: str) -> List[str]:
+    """Return the files the LaTeX document `path` depends on (recursively)."""
+    # pdflatex is run in the home directory, but references next to
+    # the document are the common case
+    directories = [os.path.dirname(path), os.path.expanduser("~")]
+    dependencies: List[str] = []
+    seen: Set[str] = {os.path.normpath(path)}
+    pending = [path]
+    while pending:
+        source = LATEX_COMMENT_PATTERN.sub("", _read_text(pending.pop()))
+        for command, arguments in LATEX_DEPENDENCY_PATTERN.findall(source):
+            for reference in arguments.split(","):
+                if not reference.strip():
+                    continue
+                dependency = resolve(
+                    reference, directories, DEPENDENCY_EXTENSIONS[command]
+                )
+                if dependency in seen:
+                    continue
+                seen.add(dependency)
+                dependencies.append(dependency)
+                if dependency.endswith(".tex"):
+                    pending.append(dependency)
+    return dependencies
+
+
+def markdown_dependencies(path: str) -> List[str]:
+    """Return the files the Markdown document `path` depends on
+    (images and a bibliography given in the metadata block)."""
+    directories = [os.path.dirname(path), os.path.expanduser("~")]
+    source = _read_text(path)
+    dependencies: List[str] = []
+    references = MARKDOWN_IMAGE_PATTERN.findall(source)
+    references += MARKDOWN_BIBLIOGRAPHY_PATTERN.findall(source)
+    for reference in references:
+        if "://" in reference:
+            continue
+        dependency = resolve(reference, directories)
+        if dependency not in dependencies:
+            dependencies.append(dependency)
+    return dependencies
+
+
+def dependencies_of(path: str) -> List[str]:
+    """Return the files the document `path` depends on (without itself)."""
+    if path.endswith(".tex"):
+        return latex_dependencies(path)
+    if path.endswith(".md"):
+        return markdown_dependencies(path)
+    return []
+
+
+class RenderCache:
+    """Fingerprints of rendered documents, stored in `storage.local`.
+
+    Content hashes are remembered by size and modification time, so
+    unchanged dependencies (e.g. large images) aren't read again."""
+
+    config: haconfig.Config
+    path: str
+    _hashes: Dict[Tuple[str, int, int], str]
+
+    def __init__(self, config: haconfig.Config):
+        self.config = config
+        self.path = config.storage.local.path
+        self._hashes = {}
+        self._prepare_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _prepare_db(self):
+        """Create tables if necessary."""
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rendered_documents \
+(source TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, rendered_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS document_dependencies \
+(source TEXT NOT NULL, dependency TEXT NOT NULL, PRIMARY KEY (dependency, source))"
+            )
+        connection.close()
+
+    def _content_hash(self, path: str) -> Optional[str]:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        content_hash = self._hashes.get(key)
+        if content_hash is None:
+            content_hash = file_content_hash(path)
+            self._hashes[key] = content_hash
+        return content_hash
+
+    def fingerprint(self, path: str) -> str:
+        """Return the fingerprint of the document `path` and its dependencies."""
+        sha = hashlib.sha256()
+        for dependency in [path] + dependencies_of(path):
+            content_hash = self._content_hash(dependency)
+            sha.update(f"{dependency}\0{content_hash or '-'}\n".encode("utf-8"))
+        return sha.hexdigest()
+
+    def get(self, path: str) -> Optional[str]:
+        """Return the fingerprint `path` was last rendered with."""
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                "SELECT fingerprint FROM rendered_documents WHERE source=?", (path,)
+            ).fetchone()
+            return row[0] if row else None
+        finally:
+            connection.close()
+
+    def record(self, path: str, fingerprint: str, now: Optional[float] = None):
+        """Remember that `path` was rendered with `fingerprint`
+        (and which files it depends on, see `dependents`)."""
+        if now is None:
+            now = time.time()
+        dependencies = dependencies_of(path)
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO rendered_documents VALUES (?, ?, ?)",
+                    (path, fingerprint, now),
+                )
+                connection.execute(
+                    "DELETE FROM document_dependencies WHERE source=?", (path,)
+                )
+                connection.executemany(
+                    "INSERT OR IGNORE INTO document_dependencies VALUES (?, ?)",
+                    [(path, dependency) for dependency in dependencies],
+                )
+        finally:
+            connection.close()
+
+    def dependents(self, path: str) -> List[str]:
+        """Return the rendered documents depending on `path`."""
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT source FROM document_dependencies WHERE dependency=? \
+ORDER BY source",
+                (os.path.normpath(path),),
+            ).fetchall()
+            return [row[0] for row in rows]
+        finally:
+            connection.close()
+
+    def is_up_to_date(self, path: str, output: str) -> bool:
+        """Return whether `output` was rendered from the current state of the
+        document `path`. Outputs rendered before fingerprints were recorded are
+        adopted if they are newer than the document and all its dependencies."""
+        if not os.path.isfile(output):
+            return False
+        fingerprint = self.fingerprint(path)
+        recorded = self.get(path)
+        if recorded is not None:
+            return recorded == fingerprint
+        output_mtime = os.path.getmtime(output)
+        for dependency in [path] + dependencies_of(path):
+            try:
+                if os.path.getmtime(dependency) > output_mtime:
+                    return False
+            except FileNotFoundError:
+                continue
+        self.record(path, fingerprint)
+        return True
+
+
+def get_render_cache(config: haconfig.Config) -> RenderCache:
+    """Return this process' render cache for the configured database."""
+    cache = _CACHES.get(config.storage.local.path)
+    if cache is None:
+        cache = RenderCache(config)
+        _CACHES[config.storage.local.path] = cache
+    return cache
@@ -1,18 +1,24 @@
 """Schedule appropriate cron jobs and run them (blocks permanently)"""
 import argparse
+import asyncio
 import logging
 import logging.handlers
 import multiprocessing as mp
 import os
 import signal
+import subprocess
 import sys
 import time
+from typing import List, Optional
 
 import setproctitle
-from crontab import CronTab
 from pid.decorator import pidfile
 from watchdog.events import (
+    DirCreatedEvent,
     DirModifiedEvent,
+    DirMovedEvent,
+    FileClosedEvent,
+    FileCreatedEvent,
     FileDeletedEvent,
     FileModifiedEvent,
     FileMovedEvent,
@@ -20,10 +26,12 @@ from watchdog.events import (
 )
 from watchdog.observers import Observer as WatchdogObserver
 
-from home_automation import compression_manager
+from home_automation import archive_manager, compression_manager
 from home_automation import config as haconfig
+from home_automation import continuous_archiver, event_queue, mail_outbox, scheduler
+from home_automation.ignore_registry import get_ignore_registry
 from home_automation.config import ConfigError
-from home_automation import file_coordinator, frontend_deployer
+from home_automation import file_coordinator, frontend_deployer, structured_logging
 from home_automation import utilities as util
 from home_automation.server.backend.run_backend_server import (
     run_backend_server as run_backend_server_blocking,
@@ -32,8 +40,17 @@ from home_automation.server.backend.run_backend_server import (
 # logging system copied from
 # https://fanchenbao.medium.com/python3-logging-with-multiprocessing-f51f460b8778
 
-CRONTAB_FILE_NAME = "home_automation.tab"
 PID_FILE_NAME = "home_automation.runner"
+# run in processes of their own (like from the crontab before), so a hanging
+# download or an upgrade restarting everything doesn't take the scheduler along
+MOODLE_DL_COMMAND = [sys.executable, "script/run-moodle-dl.py"]
+MOODLE_DL_TIMEOUT = 55 * 60
+AUTO_UPGRADE_COMMAND = [
+    sys.executable,
+    "-m",
+    "home_automation.server.backend.version_manager",
+]
+AUTO_UPGRADE_TIMEOUT = 30 * 60
 
 
 class LockError(Exception):
@@ -45,34 +62,93 @@ class _ProcessExit(Exception):
 
 
 class _WatchdogEventHandler(FileSystemEventHandler):
+    """Passes the paths changed according to the observer (thread) to `queue`,
+    which is served by the watchdog process' event loop (see `serve`)."""
+
     config: haconfig.Config
+    queue: event_queue.EventQueue
+    compression: Optional[compression_manager.CompressionManager]
+    coordinator: Optional[file_coordinator.FileCoordinator]
 
     def __init__(self, config: haconfig.Config):
         super().__init__()
         self.config = config
-
-    def act(self):  # pylint: disable=R0102
-        """React to a event triggering compression of the homework
-        directroy as well as invoking `FileCoordinator`"""
-        # this is so much simpler than observing file size over time
-        # or implementing inotify etc. and does the job just fine
-        time.sleep(5)
-        compression_manager.run_compress(self.config)
-        file_coordinator.run_file_coordinator(self.config, self.config.homework_dir)
+        self.queue = event_queue.EventQueue(
+            self.act,
+            config.runner.debounce,
+            config.runner.max_delay,
+            stability=event_queue.StabilityDetector(config.runner.stable_for),
+        )
+        self.compression = None
+        self.coordinator = None
+
+    async def serve(self):
+        """Handle the changes until `queue` is stopped. The compression manager,
+        file coordinator and their middleware (with e.g. HTTP connections) live
+        as long as this, instead of being set up again for every change."""
+        self.compression = compression_manager.create_manager(self.config)
+        self.coordinator = file_coordinator.FileCoordinator(self.config)
+        try:
+            await self.queue.serve()
+        finally:
+            await self.coordinator.close()
+            await self.compression.close()
+
+    async def act(self, changed: Optional[List[str]] = None):
+        """Compress and invoke `FileCoordinator` on the `changed` paths (or
+        everything in the homework and extra directories if not given).
+        Called with the paths coalesced by `queue`."""
+        assert self.compression and self.coordinator, "Not served."
+        if changed is not None:
+            # paths declared (by another process) just after their event
+            changed = self._not_ignored(changed)
+            if not changed:
+                return
+        await self.compression.compress(changed)
+        await self.coordinator.handle_changes(self.config.homework_dir, changed)
+
+    def _not_ignored(self, paths: List[str]) -> List[str]:
+        """Return the `paths` not changed by home_automation itself."""
+        registry = get_ignore_registry(self.config)
+        return [path for path in paths if not registry.is_ignored(path)]
 
     def dispatch(self, event):
+        if isinstance(event, FileClosedEvent):
+            # closed after writing (inotify only), so it's most likely complete
+            closed = self._not_ignored([event.src_path])
+            if closed:
+                self.queue.put(closed, closed=True)
+            return
         event_types = [
             FileModifiedEvent,
+            FileCreatedEvent,
             FileMovedEvent,
             FileDeletedEvent,
             DirModifiedEvent,
+            DirCreatedEvent,
+            DirMovedEvent,
         ]
         for event_type in event_types:
             if isinstance(event, event_type):
-                self.act()
+                changed = self._not_ignored(_changed_paths(event))
+                if changed:
+                    # don't block the observer thread
+                    self.queue.put(changed)
                 break
 
 
+def _changed_paths(event) -> List[str]:
+    """Return the paths to be handled by `FileCoordinator` after `event`.
+    A modified directory only means its entries changed, which have
+    events of their own."""
+    if isinstance(event, DirModifiedEvent):
+        return []
+    if isinstance(event, (FileMovedEvent, DirMovedEvent)):
+        # documents depending on the source need to be handled as well
+        return [event.src_path, event.dest_path]
+    return [event.src_path]
+
+
 def _signal_handler(num, frame):  # pylint: disable=unused-argument
     """Respond to signal. Supports: SIGINT, SIGTERM."""
     supported = [signal.SIGINT, signal.SIGTERM]
@@ -80,49 +156,61 @@ def _signal_handler(num, frame):  # pylint: disable=unused-argument
         raise _ProcessExit()
 
 
-def _configure_log_listener(config: haconfig.Config):
-    root = logging.getLogger()
-    file_handler = logging.handlers.RotatingFileHandler(
-        os.path.join(config.log_dir, "home_automation_runner.log")
+def _configure_log_listener(
+    config: haconfig.Config, queue: mp.Queue
+) -> structured_logging.BatchingQueueListener:
+    """Log to stdout and as JSON lines to the runner's log file (or one file per
+    process, see `logging.per_subsystem`). Return the (not yet started) listener
+    passing the records of all processes from `queue` to both."""
+    file_handler = structured_logging.JSONLinesFileHandler(
+        os.path.join(config.log_dir, "home_automation_runner.log"),
+        config.logging.max_bytes,
+        config.logging.backup_count,
+        per_logger=config.logging.per_subsystem,
     )
     console_handler = logging.StreamHandler()
-    formatter = logging.Formatter(
-        "%(asctime)s %(processName)-10s %(levelname)-8s %(message)s"
+    console_handler.setFormatter(
+        logging.Formatter("%(asctime)s %(processName)-10s %(levelname)-8s %(message)s")
     )
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
+    # the workers filter by level already, this is for the listener's own records
+    root = logging.getLogger()
     root.addHandler(file_handler)
     root.addHandler(console_handler)
-    root.setLevel(logging.INFO)
+    root.setLevel(structured_logging.level_from_name(config.logging.level))
+    return structured_logging.BatchingQueueListener(
+        queue, file_handler, console_handler, batch_size=config.logging.buffer_size
+    )
 
 
 def _logging_listener(config: haconfig.Config, queue: mp.Queue):
-    def handle_logs():
-        while not queue.empty():
-            record = queue.get()
-            logger = logging.getLogger(record.name)
-            logger.handle(record)
-
+    listener: Optional[structured_logging.BatchingQueueListener] = None
     try:
         util.drop_privileges(config)
         signal.signal(signal.SIGINT, _signal_handler)
         signal.signal(signal.SIGTERM, _signal_handler)
-        _configure_log_listener(config)
+        listener = _configure_log_listener(config, queue)
+        # blocks until records arrive, so there's nothing to do here
+        listener.start()
         user, group = util.check_current_user()
         logging.info("Running log listener as %s / %s", user, group)
+        # logged by the listener's handlers directly, not through the queue
+        listener.flush()
         while True:
-            handle_logs()
-            time.sleep(1)
+            signal.pause()
     except (KeyboardInterrupt, _ProcessExit):
         time.sleep(3)  # for the "piped" processes to stop first
+        if listener is not None:
+            listener.stop()
+        logging.shutdown()
         sys.exit(0)
 
 
-def _configure_log_worker(queue: mp.Queue):
+def _configure_log_worker(config: haconfig.Config, queue: mp.Queue):
     queue_handler = logging.handlers.QueueHandler(queue)
     root = logging.getLogger()
     root.addHandler(queue_handler)
-    root.setLevel(logging.INFO)
+    # filter in the worker so dropped records are never formatted or sent
+    root.setLevel(structured_logging.level_from_name(config.logging.level))
 
 
 def setup(config: haconfig.Config):
@@ -137,68 +225,111 @@ def setup(config: haconfig.Config):
     signal.signal(signal.SIGTERM, _signal_handler)
 
 
+def _run_command(command: List[str], timeout: float):
+    """Run `command`, raising if it fails or takes longer than `timeout` seconds
+    (it's killed then), so the job run is recorded as failed."""
+    subprocess.run(command, check=True, timeout=timeout)
+
+
+def schedule_jobs(config: haconfig.Config, jobs: scheduler.Scheduler):
+    """Add home_automation's periodic jobs to `jobs`."""
+    # archiving is done continuously by `run_continuous_archiver`
+    jobs.add("reorganize", "0 0 1 * *", lambda: archive_manager.reorganize(config))
+    if config.archiving.cold_tier.directory:
+        jobs.add("tier", "0 3 1 * *", lambda: archive_manager.tier(config))
+    if config.moodle_dl_dir is not None:
+        if not os.path.isdir(config.moodle_dl_dir):
+            raise ConfigError(f"Directory not found: {config.moodle_dl_dir}")
+        jobs.add(
+            "moodle_dl",
+            "0 * * * *",
+            lambda: _run_command(MOODLE_DL_COMMAND, MOODLE_DL_TIMEOUT),
+        )
+    jobs.add(
+        "auto_upgrade",
+        "*/10 * * * *",
+        lambda: _run_command(AUTO_UPGRADE_COMMAND, AUTO_UPGRADE_TIMEOUT),
+    )
+
+
 def run_cron_jobs(config: haconfig.Config, queue: mp.Queue):
     """Schedule cron jobs and run them."""
     signal.signal(signal.SIGINT, _signal_handler)
     signal.signal(signal.SIGTERM, _signal_handler)
-    _configure_log_worker(queue)
+    _configure_log_worker(config, queue)
     logger = logging.getLogger("home_automation_runner_cron")
     util.drop_privileges(config, logger)
     user, group = util.check_current_user()
     logger.info("Running cron jobs as %s / %s", user, group)
-    if config.runner:
-        cron_user = config.runner.cron_user
-    else:
-        cron_user = None
-
-    def load_crontab():
-        cron = CronTab(user=cron_user, tabfile=CRONTAB_FILE_NAME)
-        return cron
+    jobs = scheduler.Scheduler(config)
+    interrupted = jobs.recover()
+    if interrupted:
+        logger.warning("%s job runs were interrupted by the last restart.", interrupted)
+    schedule_jobs(config, jobs)
 
+    logger.info("Running cron jobs until interrupted...")
     try:
-        cron = load_crontab()
-    except FileNotFoundError:
-        with open(CRONTAB_FILE_NAME, "w", encoding="utf-8"):
-            pass
-        cron = load_crontab()
-
-    cron.remove_all()
-
-    archiving_job = cron.new(
-        command="python3 -m home_automation.archive_manager archive"
-    )
-    reorganization_job = cron.new(
-        command="python3 -m home_automation.archive_manager reorganize"
-    )
-    if config.moodle_dl_dir is not None and not os.path.isdir(config.moodle_dl_dir):
-        raise ConfigError(f"Directory not found: {config.moodle_dl_dir}")
-    moodle_dl_job = cron.new(command="script/run-moodle-dl.py")
-    auto_upgrade_job = cron.new(
-        command=f"curl -X POST --insecure \
-https://{config.local_hostname}/api/home_automation/autoupgrade"
-    )
-
-    archiving_job.minute.on(0)
-    archiving_job.hour.on(0)
-    archiving_job.dow.on("SAT")
-
-    reorganization_job.minute.on(0)
-    reorganization_job.hour.on(0)
-    reorganization_job.day.on(1)
+        while True:
+            if jobs.run_pending():
+                jobs.clean_up()
+            next_run_in = jobs.next_run_in()
+            if next_run_in is None:
+                next_run_in = 60
+            # wake up regularly in case the system clock jumps
+            time.sleep(min(max(next_run_in, 0), 60))
+    except (KeyboardInterrupt, _ProcessExit):
+        logger.info("Stopped cron scheduler. home_automation will not run future jobs.")
+        sys.exit(0)
 
-    moodle_dl_job.minute.on(0)
-    moodle_dl_job.hour.every(1)
 
-    auto_upgrade_job.minute.every(10)
+def run_continuous_archiver(config: haconfig.Config, queue: mp.Queue):
+    """Archive files in homework_dir as soon as they get old enough
+    (and send the digest mail every now and then)."""
+    signal.signal(signal.SIGINT, _signal_handler)
+    signal.signal(signal.SIGTERM, _signal_handler)
+    _configure_log_worker(config, queue)
+    logger = logging.getLogger("home_automation_runner_archiver")
+    util.drop_privileges(config, logger)
+    user, group = util.check_current_user()
+    logger.info("Running continuous archiver as %s / %s", user, group)
+    archiver = continuous_archiver.ContinuousArchiver(config)
+    try:
+        while True:
+            try:
+                archived = archiver.tick()
+                if archived:
+                    logger.info("Archived %s entries.", len(archived))
+            except Exception as error:  # pylint: disable=broad-except
+                logger.exception(error)
+            time.sleep(config.archiving.tick_interval)
+    except (KeyboardInterrupt, _ProcessExit):
+        archiver.manager.logger.close()
+        logger.info("Stopped continuous archiver.")
+        sys.exit(0)
 
-    cron.write()  # not sure if I could run the scheduler without writing the file
 
-    logger.info("Running cron jobs until interrupted...")
+def run_mail_outbox(config: haconfig.Config, queue: mp.Queue):
+    """Send queued mails (retrying failed ones with backoff)."""
+    signal.signal(signal.SIGINT, _signal_handler)
+    signal.signal(signal.SIGTERM, _signal_handler)
+    _configure_log_worker(config, queue)
+    logger = logging.getLogger("home_automation_runner_mail")
+    util.drop_privileges(config, logger)
+    user, group = util.check_current_user()
+    logger.info("Running mail outbox as %s / %s", user, group)
+    outbox = mail_outbox.MailOutbox(config)
     try:
-        for result in cron.run_scheduler():
-            logger.info("Ran cron job. Ouput: %s", result)
+        while True:
+            try:
+                sent = outbox.send_due()
+                if sent:
+                    logger.info("Sent %s mails.", sent)
+                outbox.clean_up()
+            except Exception as error:  # pylint: disable=broad-except
+                logger.exception(error)
+            time.sleep(config.email.outbox_interval)
     except (KeyboardInterrupt, _ProcessExit):
-        logger.info("Stopped cron scheduler. home_automation will not run future jobs.")
+        logger.info("Stopped mail outbox. Queued mails will be sent on next start.")
         sys.exit(0)
 
 
@@ -207,7 +338,7 @@ def run_watchdog(config: haconfig.Config, queue: mp.Queue):
     to compress uncompressed files."""
     signal.signal(signal.SIGINT, _signal_handler)
     signal.signal(signal.SIGTERM, _signal_handler)
-    _configure_log_worker(queue)
+    _configure_log_worker(config, queue)
     logger = logging.getLogger("home_automation_runner_watchdog")
     util.drop_privileges(config, logger)
     user, group = util.check_current_user()
@@ -218,26 +349,36 @@ def run_watchdog(config: haconfig.Config, queue: mp.Queue):
     extra_dirs = config.extra_compress_dirs if config.extra_compress_dirs else []
     for extra_dir in extra_dirs:
         observer.schedule(event_handler, extra_dir, True)
-    observer.start()
-    logger.info("Started watchdog observer.")
-    # yes, 'simulate' is a strong word
-    logger.info("Simulating first event on startup.")
-    event_handler.act()
+
+    async def serve():
+        loop = asyncio.get_running_loop()
+        for signum in [signal.SIGINT, signal.SIGTERM]:
+            # let the batch being handled finish, then clean up
+            loop.add_signal_handler(signum, event_handler.queue.stop)
+        observer.start()
+        logger.info("Started watchdog observer.")
+        # yes, 'simulate' is a strong word
+        logger.info("Simulating first event on startup.")
+        event_handler.queue.put_everything()
+        await event_handler.serve()
+
     try:
-        while True:
-            time.sleep(60)
+        asyncio.run(serve())
     except (KeyboardInterrupt, _ProcessExit):
+        # signaled before the event loop took over
+        event_handler.queue.stop()
+    if observer.is_alive():
         observer.stop()
         observer.join()
-        logger.info("Stopped watchdog observer.")
-        sys.exit(0)
+    logger.info("Stopped watchdog observer.")
+    sys.exit(0)
 
 
 def run_backend_server(config: haconfig.Config, queue: mp.Queue):
     """Run the WSGI gunicorn server (not the frontend)."""
     signal.signal(signal.SIGINT, _signal_handler)
     signal.signal(signal.SIGTERM, _signal_handler)
-    _configure_log_worker(queue)
+    _configure_log_worker(config, queue)
     logger = logging.getLogger("home_automation_backend")
     user, group = util.check_current_user()
     logger.info("Running backend as %s / %s", user, group)
@@ -253,7 +394,7 @@ def deploy_frontend(config: haconfig.Config, queue: mp.Queue):
     """Deploy frontend k8s infrastructure."""
     signal.signal(signal.SIGINT, _signal_handler)
     signal.signal(signal.SIGTERM, _signal_handler)
-    _configure_log_worker(queue)
+    _configure_log_worker(config, queue)
     logger = logging.getLogger("home_automation_backend")
     logger.info("Deploying frontend infrastructure...")
     frontend_deployer.build_and_deploy_frontend(config)
@@ -291,6 +432,16 @@ def main():
             args=(config_data, queue),
             name="home_automation.runner.cron",
         ),
+        mp.Process(
+            target=run_continuous_archiver,
+            args=(config_data, queue),
+            name="home_automation.runner.archiver",
+        ),
+        mp.Process(
+            target=run_mail_outbox,
+            args=(config_data, queue),
+            name="home_automation.runner.mail",
+        ),
         mp.Process(
             target=run_watchdog,
             args=(
@@ -0,0 +1,234 @@
+"""Run periodic jobs (reorganizing the archive, moodle-dl, auto-upgrades, ...)
+in the runner's cron process instead of as fresh processes, so they start right
+away without paying for interpreter startup, imports and loading the config.
+
+Jobs are scheduled with cron expressions (local time) and run on threads of
+their own. A job is skipped while its previous run is still going. Runs are
+recorded in `storage.local` (see `get_runs`)."""
+import datetime
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Union
+
+from croniter import croniter
+
+from home_automation import config as haconfig
+
+HISTORY_RETENTION = 30 * 24 * 60 * 60
+
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+STATUS_SKIPPED = "skipped"
+
+JobFunction = Callable[[], None]
+
+
+class Job:  # pylint: disable=too-few-public-methods
+    """A function run whenever the cron `expression` matches."""
+
+    name: str
+    expression: str
+    function: JobFunction
+    next_run_at: float
+
+    def __init__(self, name: str, expression: str, function: JobFunction, now: float):
+        self.name = name
+        self.expression = expression
+        self.function = function
+        self.next_run_at = self.get_next_run(now)
+
+    def get_next_run(self, after: float) -> float:
+        """Return when the job is due next after `after`."""
+        start = datetime.datetime.fromtimestamp(after).astimezone()
+        return croniter(self.expression, start).get_next(float)
+
+
+class Scheduler:
+    """Jobs and their run history, see above."""
+
+    config: haconfig.Config
+    path: str
+    clock: Callable[[], float]
+    jobs: Dict[str, Job]
+    _threads: Dict[str, threading.Thread]
+    _lock: threading.Lock
+
+    def __init__(self, config: haconfig.Config, clock: Callable[[], float] = time.time):
+        self.config = config
+        self.path = config.storage.local.path
+        self.clock = clock
+        self.jobs = {}
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._prepare_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _prepare_db(self):
+        """Create tables if necessary."""
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS job_runs \
+(id INTEGER PRIMARY KEY AUTOINCREMENT, job TEXT NOT NULL, status TEXT NOT NULL, \
+started_at REAL NOT NULL, finished_at REAL, error TEXT)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS job_runs_job ON job_runs (job, started_at)"
+            )
+        connection.close()
+
+    def add(self, name: str, expression: str, function: JobFunction) -> Job:
+        """Run `function` whenever the cron `expression` matches."""
+        job = Job(name, expression, function, self.clock())
+        self.jobs[name] = job
+        return job
+
+    def _record(
+        self,
+        job: str,
+        status: str,
+        started_at: float,
+        finished_at: Optional[float] = None,
+        error: Optional[str] = None,
+    ) -> int:
+        connection = self._connect()
+        try:
+            with connection:
+                return connection.execute(
+                    "INSERT INTO job_runs \
+(job, status, started_at, finished_at, error) VALUES (?, ?, ?, ?, ?)",
+                    (job, status, started_at, finished_at, error),
+                ).lastrowid
+        finally:
+            connection.close()
+
+    def _finish(self, run_id: int, status: str, error: Optional[str] = None):
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    "UPDATE job_runs SET status=?, finished_at=?, error=? WHERE id=?",
+                    (status, self.clock(), error, run_id),
+                )
+        finally:
+            connection.close()
+
+    def recover(self) -> int:
+        """Mark runs interrupted by a restart as failed and return how many.
+        Only to be called by the process running the jobs, before running any."""
+        connection = self._connect()
+        try:
+            with connection:
+                return connection.execute(
+                    "UPDATE job_runs SET status=?, finished_at=?, error=? \
+WHERE status=?",
+                    (STATUS_FAILED, self.clock(), "Interrupted", STATUS_RUNNING),
+                ).rowcount
+        finally:
+            connection.close()
+
+    def is_running(self, name: str) -> bool:
+        """Return whether the job `name` is running right now."""
+        with self._lock:
+            thread = self._threads.get(name)
+            return thread is not None and thread.is_alive()
+
+    def _run(self, job: Job, run_id: int):
+        logger = logging.getLogger(__name__)
+        logger.info("Running job %s.", job.name)
+        try:
+            job.function()
+        except (Exception, SystemExit) as error:  # pylint: disable=broad-except
+            logger.exception("Job %s failed.", job.name)
+            self._finish(run_id, STATUS_FAILED, repr(error))
+        else:
+            logger.info("Job %s succeeded.", job.name)
+            self._finish(run_id, STATUS_SUCCEEDED)
+
+    def start(self, name: str) -> bool:
+        """Start running the job `name` in the background unless it is still
+        running, which is recorded as skipped. Return whether it was started."""
+        job = self.jobs[name]
+        now = self.clock()
+        if self.is_running(name):
+            logging.getLogger(__name__).warning(
+                "Skipping job %s, its previous run is still going.", name
+            )
+            self._record(name, STATUS_SKIPPED, now, now)
+            return False
+        run_id = self._record(name, STATUS_RUNNING, now)
+        thread = threading.Thread(
+            target=self._run, args=(job, run_id), name=f"home_automation.job.{name}"
+        )
+        thread.daemon = True
+        with self._lock:
+            self._threads[name] = thread
+        thread.start()
+        return True
+
+    def run_pending(self) -> List[str]:
+        """Start all jobs that are due and return their names. Runs missed
+        (e.g. while the runner was down) aren't caught up on."""
+        now = self.clock()
+        started = []
+        for job in self.jobs.values():
+            if job.next_run_at > now:
+                continue
+            job.next_run_at = job.get_next_run(now)
+            if self.start(job.name):
+                started.append(job.name)
+        return started
+
+    def next_run_in(self) -> Optional[float]:
+        """Return in how many seconds the next job is due, None without jobs."""
+        if not self.jobs:
+            return None
+        return min(job.next_run_at for job in self.jobs.values()) - self.clock()
+
+    def join(self, timeout: Optional[float] = None):
+        """Wait for the running jobs to finish (at most `timeout` seconds each)."""
+        with self._lock:
+            threads = list(self._threads.values())
+        for thread in threads:
+            thread.join(timeout)
+
+    def get_runs(
+        self, job: Optional[str] = None, limit: int = 100
+    ) -> List[Dict[str, Union[int, float, str, None]]]:
+        """Return the last `limit` runs (of `job`, if given), most recent first."""
+        connection = self._connect()
+        connection.row_factory = sqlite3.Row
+        try:
+            if job is None:
+                rows = connection.execute(
+                    "SELECT * FROM job_runs ORDER BY started_at DESC, id DESC LIMIT ?",
+                    (limit,),
+                )
+            else:
+                rows = connection.execute(
+                    "SELECT * FROM job_runs WHERE job=? \
+ORDER BY started_at DESC, id DESC LIMIT ?",
+                    (job, limit),
+                )
+            return [dict(row) for row in rows]
+        finally:
+            connection.close()
+
+    def clean_up(self, now: Optional[float] = None) -> int:
+        """Forget runs older than `HISTORY_RETENTION` and return how many."""
+        if now is None:
+            now = self.clock()
+        connection = self._connect()
+        try:
+            with connection:
+                return connection.execute(
+                    "DELETE FROM job_runs WHERE status!=? AND started_at<?",
+                    (STATUS_RUNNING, now - HISTORY_RETENTION),
+                ).rowcount
+        finally:
+            connection.close()
@@ -1,15 +1,22 @@
 """Helpers for home_automation's OAuth2 implementation."""
-import google_auth_oauthlib.flow
+# pylint: disable=import-outside-toplevel
+from typing import TYPE_CHECKING
 
-from google.oauth2.credentials import Credentials
 from home_automation.server.backend.state_manager import StateManager
 from home_automation.config import Config
 
+if TYPE_CHECKING:
+    # google's auth libraries take long to import, so only when needed
+    import google_auth_oauthlib.flow
+    from google.oauth2.credentials import Credentials
+
 GOOGLE_MAIL_SEND_SCOPES = ["https://www.googleapis.com/auth/gmail.send"]
 
 
-def get_oauth_flow(config: Config) -> google_auth_oauthlib.flow.Flow:
+def get_oauth_flow(config: Config) -> "google_auth_oauthlib.flow.Flow":
     """Get the OAuth2 flow for Google's OAuth2."""
+    import google_auth_oauthlib.flow
+
     flow = google_auth_oauthlib.flow.Flow.from_client_secrets_file(
         "client_secret.json", GOOGLE_MAIL_SEND_SCOPES
     )
@@ -19,8 +26,10 @@ def get_oauth_flow(config: Config) -> google_auth_oauthlib.flow.Flow:
     return flow
 
 
-def get_google_oauth2_credentials(state_manager: StateManager) -> Credentials:
+def get_google_oauth2_credentials(state_manager: StateManager) -> "Credentials":
     """Get the credentials for Google's OAuth2."""
+    from google.oauth2.credentials import Credentials
+
     credentials = state_manager.get_oauth2_credentials()
     hashmap = {}
     for key, value in credentials:
@@ -34,6 +43,6 @@ def clear_credentials(state_manager: StateManager):
     state_manager.reset_oauth2()
 
 
-def save_credentials(credentials: Credentials, state_manager: StateManager):
+def save_credentials(credentials: "Credentials", state_manager: StateManager):
     """Save the access token provided by the OAuth2 credentials to the persistent database."""
     state_manager.update_oauth2_credentials("access_token", credentials.token)
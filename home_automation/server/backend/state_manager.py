@@ -1,14 +1,16 @@
 """StateManager manages the sqlite3 database under $DB_PATH."""
 import logging
 import sqlite3
-from typing import Dict, Optional
-
-import redis
+from typing import TYPE_CHECKING, Dict, Optional
 
 import home_automation
 from home_automation import config as haconfig
 from home_automation import utilities
 
+if TYPE_CHECKING:
+    # only imported when redis is actually configured
+    import redis
+
 STATUS_KEYS = [
     "pulling",
     "upping",
@@ -41,7 +43,7 @@ class StateManager:
     """StateManager managing the sqlite3 database under $DB_PATH."""
 
     config: haconfig.Config
-    rsdb: Optional[redis.Redis]
+    rsdb: Optional["redis.Redis"]
 
     def __init__(self, config: haconfig.Config):
         self.config = config
@@ -53,6 +55,8 @@ class StateManager:
 
     def _prepare_redis(self):
         """Prepare redis client."""
+        import redis  # pylint: disable=import-outside-toplevel
+
         assert self.config.storage.redis
         self.rsdb = redis.Redis(
             host=self.config.storage.redis.host,
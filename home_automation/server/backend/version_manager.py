@@ -1,18 +1,15 @@
 """VersionManager is responsible for comparing the current
 to the available version and upgrading if wanted."""
+# pylint: disable=import-outside-toplevel
 import datetime
 import logging
 import os
 import re
 from typing import Dict, List, Optional, Tuple, Union
 
-import git
-import requests
-import semver
-
 import home_automation
 import home_automation.config
-from home_automation import constants, utilities
+from home_automation import constants, mail_outbox, utilities
 from home_automation.config import Config
 from home_automation.server.backend.state_manager import StateManager
 
@@ -90,6 +87,8 @@ class VersionManager:
 
     def new_version_available(self) -> Optional[str]:
         """Return any new version available. None if no new version is available."""
+        import semver
+
         info = self.get_version_info()
         if not info.get("version_available") or not info.get("version"):
             raise ValueError("No version_available or version data.")
@@ -101,6 +100,8 @@ class VersionManager:
 
     def update_version_info(self):
         """Refresh the version information. BLOCKING!"""
+        import requests
+
         utilities.drop_privileges(self.config)
 
         def fallback():
@@ -140,6 +141,8 @@ class VersionManager:
 
     def upgrade_server(self) -> None:
         """Upgrade the server. Restarts it. BLOCKING!"""
+        import git
+
         utilities.drop_privileges(self.config)
         logging.info("Upgrading server...")
         self.state_manager.update_status("updating", True)
@@ -198,8 +201,17 @@ class VersionManager:
         """Inform user via mail about upgrading to new version."""
         utilities.drop_privileges(self.config)
         version_available = self.get_version_info()["version_available"]
-        utilities.send_mail(
-            self.config,
+        # queued, so it's sent by the new version if this one goes down first
+        mail_outbox.MailOutbox(self.config).enqueue(
             "Home Automation - VersionManager",
             f"Home Automation will now update to {version_available}",
         )
+
+
+def main():
+    """Upgrade if a new version is available (run periodically by the runner)."""
+    VersionManager(home_automation.config.load_config()).auto_upgrade()
+
+
+if __name__ == "__main__":
+    main()
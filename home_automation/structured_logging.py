@@ -0,0 +1,436 @@
+"""Buffered, structured (JSON lines) logging used throughout home_automation.
+
+`StructuredLogger` is a drop-in for the managers' former `fileloghelper.Logger`
+(same `context`, `success`, `debug`, ..., `handle_exception` and `save`), but
+records below the configured level are dropped before being formatted and
+lines are appended in batches by a background thread instead of rewriting
+the whole log file on every call. `JSONFormatter` produces the same format
+for the stdlib `logging` pipeline of `runner`, where `BatchingQueueListener`
+passes the records of all processes to a `JSONLinesFileHandler`."""
+import atexit
+import collections
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import platform
+import sys
+import threading
+import traceback
+import weakref
+from typing import Any, Deque, Dict, List, Optional
+
+from home_automation import config as haconfig
+
+SUCCESS = 25
+RECENT_LINES = 1000
+
+logging.addLevelName(SUCCESS, "SUCCESS")
+
+_FLUSHERS: Dict[str, "SharedFlusher"] = {}
+_FLUSHERS_LOCK = threading.Lock()
+
+
+def level_from_name(name: str) -> int:
+    """Return the numeric level for `name` (e.g. "INFO"), INFO if unknown."""
+    level = logging.getLevelName(name.upper())
+    return level if isinstance(level, int) else logging.INFO
+
+
+def format_line(
+    level: int,
+    name: str,
+    message: str,
+    context: str = "",
+    created: Optional[float] = None,
+    **fields: Any,
+) -> str:
+    """Format a single log record as a JSON line (including the newline)."""
+    timestamp = (
+        datetime.datetime.fromtimestamp(created) if created else datetime.datetime.now()
+    )
+    record: Dict[str, Any] = {
+        "time": timestamp.isoformat(timespec="milliseconds"),
+        "level": logging.getLevelName(level),
+        "logger": name,
+    }
+    if context:
+        record["context"] = context
+    record["message"] = message
+    record.update(fields)
+    return json.dumps(record, ensure_ascii=False, default=str) + "\n"
+
+
+class RotatingWriter:
+    """Appends lines to `path`, rotating it to `path.1`, `path.2` etc.
+    once it would grow beyond `max_bytes` (keeping `backup_count` files)."""
+
+    path: str
+    max_bytes: int
+    backup_count: int
+
+    def __init__(self, path: str, max_bytes: int, backup_count: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+    def _rotate(self):
+        if self.backup_count <= 0:
+            os.remove(self.path)
+            return
+        for i in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def write(self, lines: List[str]):
+        """Append `lines` (rotating first if necessary)."""
+        data = "".join(lines).encode("utf-8")
+        if not data:
+            return
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            size = 0
+        if self.max_bytes > 0 and size > 0 and size + len(data) > self.max_bytes:
+            self._rotate()
+        with open(self.path, "ab") as file:
+            file.write(data)
+
+
+class SharedFlusher:  # pylint: disable=too-many-instance-attributes
+    """Buffers the lines of all `StructuredLogger`s of this process writing to
+    the same file and appends them from a single background thread, which ends
+    once all of these loggers are closed (or garbage collected) and their lines
+    are written. Use `get_flusher` instead of instantiating directly."""
+
+    writer: RotatingWriter
+    flush_interval: float
+    buffer_size: int
+    loggers: "weakref.WeakSet[StructuredLogger]"
+    thread: Optional[threading.Thread]
+    _buffer: List[str]
+    _lock: threading.Lock
+    _write_lock: threading.Lock
+    _wakeup: threading.Event
+
+    def __init__(self, writer: RotatingWriter, config: haconfig.ConfigLogging):
+        self.writer = writer
+        self.flush_interval = config.flush_interval
+        self.buffer_size = config.buffer_size
+        self.loggers = weakref.WeakSet()
+        self.thread = None
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def append(self, line: str):
+        """Write `line` with the next flush (right away if the buffer is full)."""
+        with self._lock:
+            self._buffer.append(line)
+            pending = len(self._buffer)
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._flush_periodically,
+                    name=f"home_automation.structured_logging.{self.writer.path}",
+                    daemon=True,
+                )
+                self.thread.start()
+        if pending >= self.buffer_size:
+            self._wakeup.set()
+
+    def _flush_periodically(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            with _FLUSHERS_LOCK, self._lock:
+                if self.loggers or self._buffer:
+                    continue
+                # started again by `append` if still in use (e.g. after `close`)
+                self.thread = None
+                if _FLUSHERS.get(self.writer.path) is self:
+                    del _FLUSHERS[self.writer.path]
+                return
+
+    def flush(self):
+        """Write all pending lines now."""
+        with self._write_lock:
+            with self._lock:
+                lines, self._buffer = self._buffer, []
+            if not lines:
+                return
+            try:
+                self.writer.write(lines)
+            except OSError as error:
+                print(
+                    f"Couldn't write {len(lines)} log lines to \
+'{self.writer.path}': {error}",
+                    file=sys.stderr,
+                )
+
+    def release(self, logger: "StructuredLogger"):
+        """Flush and stop flushing in the background for `logger` (the thread
+        ends right away if it was the last logger)."""
+        with _FLUSHERS_LOCK:
+            self.loggers.discard(logger)
+        self.flush()
+        self._wakeup.set()
+
+
+def get_flusher(
+    filename: str, config: haconfig.ConfigLogging, logger: "StructuredLogger"
+) -> SharedFlusher:
+    """Return the flusher for `filename` and register `logger` with it."""
+    with _FLUSHERS_LOCK:
+        flusher = _FLUSHERS.get(filename)
+        if flusher is None:
+            writer = RotatingWriter(filename, config.max_bytes, config.backup_count)
+            flusher = SharedFlusher(writer, config)
+            _FLUSHERS[filename] = flusher
+        flusher.loggers.add(logger)
+        return flusher
+
+
+class StructuredLogger:
+    """Buffered JSON lines logger writing to `filename`.
+
+    Lines are flushed by a background thread (shared by all loggers of the
+    process writing to `filename`, see `SharedFlusher`) every
+    `logging.flush_interval` seconds, as soon as `logging.buffer_size` lines
+    are pending, on `save()`, on `close()` and at exit. The most recent lines
+    are kept in `lines` for inspection."""
+
+    name: str
+    context: str
+    level: int
+    lines: Deque[str]
+    writer: RotatingWriter
+    _flusher: SharedFlusher
+    _closed: bool
+
+    def __init__(
+        self,
+        filename: str,
+        config: Optional[haconfig.ConfigLogging] = None,
+        name: Optional[str] = None,
+        debug: bool = False,
+    ):
+        if config is None:
+            config = haconfig.ConfigLogging()
+        self.name = name if name else os.path.splitext(os.path.basename(filename))[0]
+        self.context = ""
+        self.level = logging.DEBUG if debug else level_from_name(config.level)
+        self.lines = collections.deque(maxlen=RECENT_LINES)
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._flusher = get_flusher(filename, config, self)
+        self.writer = self._flusher.writer
+        self._closed = False
+
+    @property
+    def filename(self) -> str:
+        """The file logged to."""
+        return self.writer.path
+
+    def is_enabled_for(self, level: int) -> bool:
+        """Return whether records of `level` would be logged."""
+        return level >= self.level
+
+    def log(self, level: int, text: str, display: bool = False, **fields: Any):
+        """Log `text` with `level` (and additional structured `fields`)."""
+        if level < self.level and not display:
+            return
+        if display:
+            print(f"[{self.context}] {text}" if self.context else text)
+        if level < self.level:
+            return
+        line = format_line(level, self.name, text, self.context, **fields)
+        self.lines.append(line)
+        self._flusher.append(line)
+        if self._closed:
+            self._flusher.flush()
+
+    def debug(self, text: str, display: bool = False, **fields: Any):
+        """Log on DEBUG level."""
+        self.log(logging.DEBUG, text, display, **fields)
+
+    def info(self, text: str, display: bool = False, **fields: Any):
+        """Log on INFO level."""
+        self.log(logging.INFO, text, display, **fields)
+
+    def success(self, text: str, display: bool = True, **fields: Any):
+        """Log on SUCCESS level (between INFO and WARNING)."""
+        self.log(SUCCESS, text, display, **fields)
+
+    def warning(self, text: str, display: bool = True, **fields: Any):
+        """Log on WARNING level."""
+        self.log(logging.WARNING, text, display, **fields)
+
+    def error(self, text: str, display: bool = True, **fields: Any):
+        """Log on ERROR level."""
+        self.log(logging.ERROR, text, display, **fields)
+
+    def handle_exception(self, exception: BaseException):
+        """Log `exception` including its traceback on ERROR level."""
+        self.log(
+            logging.ERROR,
+            str(exception),
+            True,
+            exception=exception.__class__.__name__,
+            traceback="".join(
+                traceback.format_exception(
+                    type(exception), exception, exception.__traceback__
+                )
+            ),
+        )
+
+    def header(self, sys_stat: bool = False, date: bool = False):
+        """Log a record marking the start of a run."""
+        fields: Dict[str, Any] = {"pid": os.getpid()}
+        if sys_stat:
+            fields["python"] = sys.version.split(" ")[0]
+            fields["platform"] = platform.platform()
+        if date:
+            fields["date"] = datetime.date.today().isoformat()
+        self.log(logging.INFO, "Started", **fields)
+
+    def flush(self):
+        """Write all pending lines (of all loggers writing to the file) now."""
+        self._flusher.flush()
+
+    def save(self):
+        """Write all pending lines now (kept for compatibility)."""
+        self.flush()
+
+    def close(self):
+        """Flush and stop flushing in the background. Lines logged afterwards
+        are written right away."""
+        self._closed = True
+        self._flusher.release(self)
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats stdlib `logging` records like `StructuredLogger` does."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields: Dict[str, Any] = {"process": record.processName}
+        if record.exc_info:
+            fields["exception"] = record.exc_info[0].__name__
+            fields["traceback"] = self.formatException(record.exc_info)
+        return format_line(
+            record.levelno,
+            record.name,
+            record.getMessage(),
+            created=record.created,
+            **fields,
+        ).rstrip("\n")
+
+
+class JSONLinesFileHandler(logging.Handler):
+    """Buffers records (formatted by `JSONFormatter`) and appends them to the
+    rotating file `path` on `flush`. With `per_logger`, each logger gets a file
+    of its own next to `path` instead, named after it (`<logger>.log`)."""
+
+    path: str
+    max_bytes: int
+    backup_count: int
+    per_logger: bool
+    _writers: Dict[str, RotatingWriter]
+    _buffers: Dict[str, List[str]]
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int,
+        backup_count: int,
+        per_logger: bool = False,
+        level: int = logging.NOTSET,
+    ):
+        super().__init__(level)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.per_logger = per_logger
+        self._writers = {}
+        self._buffers = {}
+        self.setFormatter(JSONFormatter())
+
+    def path_for(self, record: logging.LogRecord) -> str:
+        """Return the file `record` is written to."""
+        if not self.per_logger:
+            return self.path
+        return os.path.join(os.path.dirname(self.path), f"{record.name}.log")
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            line = self.format(record) + "\n"
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+            return
+        self._buffers.setdefault(self.path_for(record), []).append(line)
+
+    def flush(self):
+        self.acquire()
+        try:
+            buffers, self._buffers = self._buffers, {}
+            for path, lines in buffers.items():
+                writer = self._writers.get(path)
+                if writer is None:
+                    writer = RotatingWriter(path, self.max_bytes, self.backup_count)
+                    self._writers[path] = writer
+                try:
+                    writer.write(lines)
+                except OSError as error:
+                    print(
+                        f"Couldn't write {len(lines)} log lines to '{path}': {error}",
+                        file=sys.stderr,
+                    )
+        finally:
+            self.release()
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """Blocks until records arrive on `queue` and passes them to `handlers`
+    (respecting their levels). Handlers are flushed once the queue is drained
+    or `batch_size` records were handled, so bursts are written at once."""
+
+    batch_size: int
+    _pending: int
+
+    def __init__(self, queue: Any, *handlers: logging.Handler, batch_size: int = 512):
+        super().__init__(queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+        self._pending = 0
+
+    def handle(self, record: logging.LogRecord):
+        super().handle(record)
+        self._pending += 1
+        if self._pending >= self.batch_size or self.queue.empty():
+            self.flush()
+
+    def flush(self):
+        """Flush all handlers."""
+        self._pending = 0
+        for handler in self.handlers:
+            handler.flush()
+
+    def stop(self):
+        super().stop()
+        self.flush()
+
+
+@atexit.register
+def _flush_all():
+    with _FLUSHERS_LOCK:
+        flushers = list(_FLUSHERS.values())
+    for flusher in flushers:
+        flusher.flush()
@@ -0,0 +1,295 @@
+"""First-page previews of PDFs, rendered once per content hash in the
+background and kept in a size-bounded LRU cache on disk."""
+import concurrent.futures
+import logging
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from home_automation import config as haconfig
+from home_automation.archive_index import file_content_hash, rename_paths
+
+RENDER_TIMEOUT = 60
+THUMBNAIL_EXTENSION = ".png"
+# evict down to this fraction of `thumbnails.max_size_mb`, so not every render
+# after reaching the limit has to look at the whole cache again
+EVICTION_TARGET = 0.9
+
+_CACHES: Dict[str, "ThumbnailCache"] = {}
+
+
+class ThumbnailRenderError(Exception):
+    """A thumbnail couldn't be rendered."""
+
+
+def render_thumbnail(path: str, destination: str, width: int):
+    """Render the first page of the PDF at `path` to the PNG `destination`
+    using `pdftoppm` (poppler-utils)."""
+    with tempfile.TemporaryDirectory() as directory:
+        prefix = os.path.join(directory, "thumbnail")
+        try:
+            subprocess.run(
+                [
+                    "pdftoppm",
+                    "-png",
+                    "-f",
+                    "1",
+                    "-l",
+                    "1",
+                    "-singlefile",
+                    "-scale-to-x",
+                    str(width),
+                    "-scale-to-y",
+                    "-1",
+                    path,
+                    prefix,
+                ],
+                capture_output=True,
+                timeout=RENDER_TIMEOUT,
+                check=True,
+            )
+        except (OSError, subprocess.SubprocessError) as error:
+            raise ThumbnailRenderError(path) from error
+        shutil.move(prefix + THUMBNAIL_EXTENSION, destination)
+
+
+def can_have_thumbnail(path: str) -> bool:
+    """Only PDFs get previews (compressed copies look the same as their original)."""
+    fname = os.path.basename(path)
+    return (
+        fname.endswith(".pdf")
+        and not fname.endswith(".small.pdf")
+        and not fname.startswith(".")
+    )
+
+
+class ThumbnailCache:
+    """Thumbnails are stored as `<directory>/<hash[:2]>/<hash>.png`. The
+    modification time of each thumbnail is bumped whenever it's served, so the
+    least recently used ones are evicted once `thumbnails.max_size_mb` is exceeded.
+
+    Hashing a file on the NAS for every request would be slow as well, so the
+    hash of each path is remembered (by size and mtime) in `storage.local`.
+    Files not hashed yet are hashed by the background workers.
+
+    The cache's total size is only computed once (and whenever evicting), other
+    renders just add to it. Thumbnails added by other processes are noticed
+    on the next eviction."""
+
+    config: haconfig.Config
+    directory: str
+    db_path: str
+    executor: concurrent.futures.ThreadPoolExecutor
+    _pending: Set[str]
+    _failed: Set[str]
+    _size: Optional[int]
+    _lock: threading.Lock
+
+    def __init__(self, config: haconfig.Config):
+        self.config = config
+        self.directory = config.thumbnails.directory
+        self.db_path = config.storage.local.path
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=config.thumbnails.workers,
+            thread_name_prefix="home_automation.thumbnails",
+        )
+        self._pending = set()
+        self._failed = set()
+        self._size = None
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._prepare_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _prepare_db(self):
+        """Create tables if necessary."""
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS thumbnail_sources \
+(path TEXT PRIMARY KEY, size INTEGER, mtime REAL, content_hash TEXT NOT NULL)"
+            )
+        connection.close()
+
+    def cached_content_hash(
+        self, path: str, stat: Optional[os.stat_result] = None
+    ) -> Optional[str]:
+        """Return the content hash of `path` if known (and the file unchanged)."""
+        if stat is None:
+            stat = os.stat(path)
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                "SELECT content_hash FROM thumbnail_sources \
+WHERE path=? AND size=? AND mtime=?",
+                (path, stat.st_size, stat.st_mtime),
+            ).fetchone()
+        finally:
+            connection.close()
+        return row[0] if row else None
+
+    def content_hash(self, path: str) -> str:
+        """Return the content hash of `path`, only hashing it if it changed."""
+        stat = os.stat(path)
+        content_hash = self.cached_content_hash(path, stat)
+        if content_hash is not None:
+            return content_hash
+        content_hash = file_content_hash(path)
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO thumbnail_sources VALUES (?, ?, ?, ?)",
+                    (path, stat.st_size, stat.st_mtime, content_hash),
+                )
+            return content_hash
+        finally:
+            connection.close()
+
+    def rename(self, source: str, destination: str):
+        """Keep the hashes of `source` (file or directory), which was renamed to
+        `destination` without its files changing, so nothing is hashed again."""
+        connection = self._connect()
+        with connection:
+            rename_paths(connection, "thumbnail_sources", source, destination)
+        connection.close()
+
+    def thumbnail_path(self, content_hash: str) -> str:
+        """Return where the thumbnail for `content_hash` is (or would be) stored."""
+        return os.path.join(
+            self.directory, content_hash[:2], content_hash + THUMBNAIL_EXTENSION
+        )
+
+    def lookup(self, path: str) -> Optional[str]:
+        """Return the thumbnail of `path` if cached (marking it as recently used),
+        otherwise queue rendering it and return None. Never hashes `path` itself.
+        Throws ThumbnailRenderError if rendering it failed before."""
+        content_hash = self.cached_content_hash(path)
+        if content_hash is None:
+            self._submit(path)
+            return None
+        thumbnail = self.thumbnail_path(content_hash)
+        try:
+            os.utime(thumbnail)
+            return thumbnail
+        except FileNotFoundError:
+            pass
+        if content_hash in self._failed:
+            raise ThumbnailRenderError(path)
+        self._submit(path)
+        return None
+
+    def submit(self, path: str) -> Optional[concurrent.futures.Future]:
+        """Render the thumbnail of `path` (or all files in the directory `path`)
+        in the background if not cached yet."""
+        if os.path.isdir(path):
+            for directory, _, fnames in os.walk(path):
+                for fname in fnames:
+                    self.submit(os.path.join(directory, fname))
+            return None
+        if not can_have_thumbnail(path) or not os.path.isfile(path):
+            return None
+        return self.executor.submit(self._render_logging_errors, path)
+
+    def _submit(self, path: str) -> Optional[concurrent.futures.Future]:
+        with self._lock:
+            if path in self._pending:
+                return None
+            self._pending.add(path)
+        return self.executor.submit(self._render_logging_errors, path, True)
+
+    def _render_logging_errors(self, path: str, pending: bool = False):
+        content_hash = None
+        try:
+            content_hash = self.content_hash(path)
+            self.render(path, content_hash)
+        except (OSError, sqlite3.Error, ThumbnailRenderError) as error:
+            if content_hash is not None:
+                self._failed.add(content_hash)
+            logging.warning("Couldn't render thumbnail of '%s': %s", path, error)
+        finally:
+            if pending:
+                with self._lock:
+                    self._pending.discard(path)
+
+    def render(self, path: str, content_hash: str) -> str:
+        """Render the thumbnail of `path` now (unless cached) and return its path."""
+        thumbnail = self.thumbnail_path(content_hash)
+        if os.path.isfile(thumbnail):
+            return thumbnail
+        os.makedirs(os.path.dirname(thumbnail), exist_ok=True)
+        tmp_thumbnail = f"{thumbnail}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            render_thumbnail(path, tmp_thumbnail, self.config.thumbnails.width)
+            size = os.path.getsize(tmp_thumbnail)
+            os.replace(tmp_thumbnail, thumbnail)
+        finally:
+            if os.path.exists(tmp_thumbnail):
+                os.remove(tmp_thumbnail)
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+        if self.size() > self.config.thumbnails.max_size_mb * 1024 * 1024:
+            self.evict()
+        return thumbnail
+
+    def size(self) -> int:
+        """Return the total size of the cached thumbnails (in bytes)."""
+        if self._size is None:
+            size = sum(size for _, size, _ in self._list_thumbnails())
+            with self._lock:
+                if self._size is None:
+                    self._size = size
+        return self._size
+
+    def _list_thumbnails(self) -> List[Tuple[float, int, str]]:
+        """Return (mtime, size, path) of all thumbnails."""
+        thumbnails = []
+        for directory, _, fnames in os.walk(self.directory):
+            for fname in fnames:
+                if not fname.endswith(THUMBNAIL_EXTENSION):
+                    continue
+                path = os.path.join(directory, fname)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                thumbnails.append((stat.st_mtime, stat.st_size, path))
+        return thumbnails
+
+    def evict(self):
+        """Remove the least recently used thumbnails until the cache fits
+        into `EVICTION_TARGET` of `thumbnails.max_size_mb`."""
+        max_size = self.config.thumbnails.max_size_mb * 1024 * 1024
+        thumbnails = sorted(self._list_thumbnails())
+        total = sum(size for _, size, _ in thumbnails)
+        if total > max_size:
+            for _, size, path in thumbnails:
+                if total <= max_size * EVICTION_TARGET:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        with self._lock:
+            self._size = total
+
+    def close(self, wait: bool = True):
+        """Stop the background workers (waiting for pending renders by default)."""
+        self.executor.shutdown(wait=wait)
+
+
+def get_thumbnail_cache(config: haconfig.Config) -> ThumbnailCache:
+    """Return this process' thumbnail cache for the configured directory."""
+    cache = _CACHES.get(config.thumbnails.directory)
+    if cache is None:
+        cache = ThumbnailCache(config)
+        _CACHES[config.thumbnails.directory] = cache
+    return cache
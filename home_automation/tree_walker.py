@@ -0,0 +1,60 @@
+"""Walk directory trees reading many directories at once. On high-latency
+(network) mounts, a serial walk mostly waits for round trips, so directories
+are scanned by a bounded thread pool while the caller consumes the results."""
+import collections
+import concurrent.futures
+import os
+from typing import Callable, Deque, Iterator, List, Optional, Tuple
+
+DEFAULT_WORKERS = 8
+
+EntryFilter = Callable[[os.DirEntry], bool]
+
+
+def _scan(
+    path: str, include: Optional[Callable[[str], bool]]
+) -> Tuple[str, List[os.DirEntry]]:
+    with os.scandir(path) as iterator:
+        entries = [
+            entry for entry in iterator if include is None or include(entry.name)
+        ]
+    for entry in entries:
+        # fill the DirEntry's cache while still in the worker thread
+        entry.is_dir(follow_symlinks=False)
+    return path, entries
+
+
+def walk(
+    root: str,
+    descend: Optional[EntryFilter] = None,
+    include: Optional[Callable[[str], bool]] = None,
+    workers: int = DEFAULT_WORKERS,
+    onerror: Optional[Callable[[OSError], None]] = None,
+) -> Iterator[Tuple[str, List[os.DirEntry]]]:
+    """Yield (dirpath, entries) for `root` and every directory below it, top-down
+    in breadth-first order. `entries` are the `os.DirEntry`s of the directory
+    (their type is cached, so `entry.is_dir()` doesn't cost another round trip).
+
+    Only entries whose name passes `include` are yielded at all and only
+    directories passing `descend` are walked into (all by default). `descend`
+    is called before the directory is yielded, so it can't depend on what the
+    caller does with it. Errors reading a directory are passed to `onerror`
+    (and otherwise ignored), just like with `os.walk`."""
+    queue: Deque[concurrent.futures.Future] = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="home_automation.tree_walker"
+    ) as executor:
+        queue.append(executor.submit(_scan, root, include))
+        while queue:
+            try:
+                dirpath, entries = queue.popleft().result()
+            except OSError as error:
+                if onerror is not None:
+                    onerror(error)
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False) and (
+                    descend is None or descend(entry)
+                ):
+                    queue.append(executor.submit(_scan, entry.path, include))
+            yield dirpath, entries
@@ -1,25 +1,64 @@
 """Just some utilities, especially regarding mailing."""
 import argparse
+import asyncio
 import base64
 import grp
 import logging
 import os
 import pwd
+import threading
 from email.mime.text import MIMEText
-from typing import Optional
-
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from kubernetes import client as klient
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    Optional,
+    Tuple,
+    TypeVar,
+)
 
 from home_automation import config as haconfig
 
+if TYPE_CHECKING:
+    # google & kubernetes clients take long to import, so only when needed
+    from google.oauth2.credentials import Credentials
+    from kubernetes import client as klient
+
+_GMAIL_SERVICES: Dict[Optional[str], Any] = {}
+
+T = TypeVar("T")
+
+
+def get_gmail_service(credentials: "Credentials"):
+    """Return a Gmail API client for `credentials`. Clients are cached per access
+    token and built from the discovery document shipped with the client library,
+    so no discovery request is made."""
+    service = _GMAIL_SERVICES.get(credentials.token)
+    if service is None:
+        # pylint: disable=import-outside-toplevel
+        from googleapiclient.discovery import build
+
+        service = build(
+            "gmail",
+            "v1",
+            credentials=credentials,
+            static_discovery=True,
+            cache_discovery=False,
+        )
+        # only keep the client for the current token around
+        _GMAIL_SERVICES.clear()
+        _GMAIL_SERVICES[credentials.token] = service
+    return service
+
 
 def send_mail(
-    config: haconfig.Config, credentials: Credentials, subject: str, body: str = ""
+    config: haconfig.Config, credentials: "Credentials", subject: str, body: str = ""
 ):
-    """Send mail now."""
-    gmail = build("gmail", "v1", credentials=credentials)
+    """Send mail now (see `mail_outbox` for sending it in the background)."""
+    gmail = get_gmail_service(credentials)
     message = MIMEText(body)
     message["To"] = config.email.address
     message["From"] = config.email.address
@@ -31,6 +70,53 @@ def send_mail(
     ).execute()
 
 
+async def run_blocking(function: Callable[..., T], *args: Any) -> T:
+    """Run `function(*args)` on the running event loop's default executor, so
+    e.g. hashing files or walking directories doesn't stall the loop."""
+    return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+async def iterate_blocking(iterator: Iterator[T]) -> AsyncIterator[T]:
+    """Yield the items of `iterator` (e.g. a directory walk) as soon as they are
+    produced, advancing it on the default executor. If the caller stops early,
+    the iterator is stopped (and closed) after its current item."""
+    loop = asyncio.get_running_loop()
+    # (finished, item) or (finished, error)
+    queue: "asyncio.Queue[Tuple[bool, Any]]" = asyncio.Queue()
+    stopped = threading.Event()
+
+    def put(finished: bool, value: Any):
+        if not stopped.is_set():
+            loop.call_soon_threadsafe(queue.put_nowait, (finished, value))
+
+    def produce():
+        error = None
+        try:
+            for item in iterator:
+                if stopped.is_set():
+                    break
+                put(False, item)
+        except Exception as exception:  # pylint: disable=broad-except
+            error = exception
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+        put(True, error)
+
+    loop.run_in_executor(None, produce)
+    try:
+        while True:
+            finished, value = await queue.get()
+            if finished:
+                if value is not None:
+                    raise value
+                return
+            yield value
+    finally:
+        stopped.set()
+
+
 def check_for_root_privileges() -> bool:
     """Return whether this process is run by the root user."""
     return os.getuid() == 0
@@ -105,8 +191,10 @@ def check_current_user():
     return (user, group)
 
 
-def get_k8s_client(config: haconfig.Config) -> klient.ApiClient:
+def get_k8s_client(config: haconfig.Config) -> "klient.ApiClient":
     """Return the k8s client using the specified config."""
+    from kubernetes import client as klient  # pylint: disable=import-outside-toplevel
+
     assert config.kubernetes, "No kubernetes config found."
     konfig = klient.Configuration()
     konfig.host = config.kubernetes.url
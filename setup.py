@@ -25,7 +25,6 @@ packages = ["home_automation"]
 requirements = [
     "argparse",
     "flask[async]",
-    "fileloghelper",
     "httpx>=0.18",
     "pytest",
     "pytest-cov",
@@ -40,9 +39,8 @@ requirements = [
     "mypy-extensions",
     "types-requests",
     "tox==4.*",
-    "python-crontab",
     "croniter",
-    "watchdog",
+    "watchdog>=2.1.0",
     "pid",
     "docker",
     "gunicorn",
@@ -58,6 +56,8 @@ requirements = [
     "google-auth-httplib2",
     "setproctitle",
     "redis",
+    "markdown",
+    "weasyprint>=53",
 ]
 
 with open("requirements.txt", "w") as f:
@@ -0,0 +1,111 @@
+import json
+from unittest import mock
+
+import pytest
+from flask import Response
+from home_automation import quarantine, scheduler, thumbnails
+from home_automation.server import backend
+from home_automation.server.backend import create_app
+
+
+@pytest.fixture
+def client():
+    app = create_app({"TESTING": True})
+    with app.test_client() as test_client:
+        yield test_client
+
+
+def test_search_requires_query(client):
+    res: Response = client.get("/api/archive/search")
+
+    assert res.status_code == 400
+
+
+def test_search(client):
+    res: Response = client.get("/api/archive/search?q=induktion")
+
+    assert res.status_code == 200
+    assert isinstance(json.loads(str(res.data, "utf-8"))["results"], list)
+
+
+def test_stats(client):
+    res: Response = client.get("/api/archive/stats")
+
+    assert res.status_code == 200
+    data = json.loads(str(res.data, "utf-8"))
+    assert set(data["total"]) == {"files", "bytes", "compressed_bytes"}
+    assert isinstance(data["subjects"], dict)
+
+
+def test_thumbnail_requires_path(client):
+    res: Response = client.get("/api/thumbnail")
+
+    assert res.status_code == 400
+
+
+def test_thumbnail_outside_of_allowed_directories(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(backend.CONFIG.thumbnails, "enabled", True)
+    monkeypatch.setattr(backend.CONFIG, "homework_dir", str(tmp_path / "HAs"))
+    monkeypatch.setattr(backend.CONFIG, "archive_dir", str(tmp_path / "Archive"))
+
+    res: Response = client.get("/api/thumbnail?path=/etc/passwd")
+
+    assert res.status_code == 403
+
+
+def test_thumbnail_queued_then_served(client, monkeypatch, tmp_path):
+    path = tmp_path / "HAs" / "PH HA.pdf"
+    path.parent.mkdir()
+    path.write_text("physics")
+    cache = mock.Mock()
+    cache.lookup.return_value = None
+    monkeypatch.setattr(backend.CONFIG.thumbnails, "enabled", True)
+    monkeypatch.setattr(backend.CONFIG, "homework_dir", str(tmp_path / "HAs"))
+    monkeypatch.setattr(thumbnails, "get_thumbnail_cache", lambda config: cache)
+
+    res: Response = client.get(f"/api/thumbnail?path={path}")
+
+    assert res.status_code == 202
+
+    thumbnail = tmp_path / "abc.png"
+    thumbnail.write_bytes(b"png")
+    cache.lookup.return_value = str(thumbnail)
+
+    res = client.get(f"/api/thumbnail?path={path}")
+
+    assert res.status_code == 200
+    assert res.headers["Content-Type"] == "image/png"
+    assert "max-age" in res.headers["Cache-Control"]
+    assert res.headers["ETag"] == '"abc.png"'
+
+
+def test_quarantine_list_and_clear(client, tmp_path):
+    path = str(tmp_path / "PH HA.tex")
+    files = quarantine.get_quarantine(backend.CONFIG)
+    files.record_failure(path, quarantine.SUBSYSTEM_RENDERING, "No PDF was rendered")
+
+    res: Response = client.get("/api/quarantine?subsystem=rendering")
+
+    assert res.status_code == 200
+    entries = json.loads(str(res.data, "utf-8"))["files"]
+    assert path in [entry["path"] for entry in entries]
+
+    res = client.delete(f"/api/quarantine?path={path}")
+
+    assert res.status_code == 200
+    assert json.loads(str(res.data, "utf-8"))["cleared"] == 1
+    assert path not in [entry["path"] for entry in files.get_entries()]
+
+
+def test_job_runs(client):
+    jobs = scheduler.Scheduler(backend.CONFIG)
+    jobs.add("tests", "0 0 1 1 *", lambda: None)
+    jobs.start("tests")
+    jobs.join(5)
+
+    res: Response = client.get("/api/jobs?job=tests&limit=1")
+
+    assert res.status_code == 200
+    runs = json.loads(str(res.data, "utf-8"))["runs"]
+    assert len(runs) == 1
+    assert runs[0]["status"] == scheduler.STATUS_SUCCEEDED
@@ -0,0 +1,161 @@
+import os
+
+import pytest
+from home_automation import archive_index, config
+from home_automation.archive_index import ArchiveIndex, should_be_indexed
+from home_automation.archive_middleware import SearchIndexArchiveMiddleware
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    extracted = []
+
+    def extract_text(path):
+        extracted.append(path)
+        with open(path, "r", encoding="utf-8") as file:
+            return file.read()
+
+    monkeypatch.setattr(archive_index, "extract_text", extract_text)
+    conf = config.Config(
+        str(tmp_path),
+        str(tmp_path / "HAs"),
+        str(tmp_path / "Archive"),
+        {},
+        "",
+        "",
+        frontend={"backend_ip_address": "192.168.0.2"},
+        storage={"local": {"path": str(tmp_path / "local.db")}},
+        search={"enabled": True, "workers": 1},
+    )
+    idx = ArchiveIndex(conf)
+    idx.extracted = extracted
+    yield idx
+    idx.close()
+
+
+def create_file(tmp_path, name: str, text: str) -> str:
+    path = tmp_path / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_should_be_indexed():
+    assert should_be_indexed("/a/PH HA.pdf")
+    assert not should_be_indexed("/a/PH HA.small.pdf")
+    assert not should_be_indexed("/a/PH HA.tex")
+
+
+def test_search(index, tmp_path):
+    path = create_file(tmp_path, "HAs/PH HA.pdf", "Arbeitsblatt zur Induktion")
+    create_file(tmp_path, "HAs/M HA.pdf", "Ableitungen und Integrale")
+    index.submit(str(tmp_path / "HAs"))
+    index.close()
+
+    results = index.search("induktion")
+
+    assert [result["path"] for result in results] == [path]
+    assert "[Induktion]" in results[0]["snippet"]
+
+
+def test_extracts_once_per_content_hash(index, tmp_path):
+    first = create_file(tmp_path, "HAs/PH HA.pdf", "Induktion")
+    second = create_file(tmp_path, "HAs/PH HA Kopie.pdf", "Induktion")
+
+    assert index.index_file(first)
+    assert not index.index_file(second)
+    assert index.extracted == [first]
+    assert len(index.search("Induktion")) == 2
+
+
+def test_concurrently_indexed_copies_share_their_text(index, tmp_path, monkeypatch):
+    first = create_file(tmp_path, "HAs/PH HA.pdf", "Induktion")
+    second = create_file(tmp_path, "HAs/PH HA Kopie.pdf", "Induktion")
+    extract_text = archive_index.extract_text
+
+    def extract_text_while_indexing_copy(path):
+        if path == first:
+            index.index_file(second)  # as if by another worker meanwhile
+        return extract_text(path)
+
+    monkeypatch.setattr(archive_index, "extract_text", extract_text_while_indexing_copy)
+
+    index.index_file(first)
+
+    connection = index._connect()  # pylint: disable=protected-access
+    rows = connection.execute("SELECT count(*) FROM contents").fetchone()[0]
+    connection.close()
+    assert rows == 1
+    assert len(index.search("Induktion")) == 2
+
+
+def test_move_keeps_text_without_extracting_again(index, tmp_path):
+    source = create_file(tmp_path, "HAs/PH Material/PH HA.pdf", "Induktion")
+    index.index_file(source)
+    destination = str(tmp_path / "Archive/Physik/2021/Juni/PH Material")
+    os.makedirs(os.path.dirname(destination))
+    os.rename(os.path.dirname(source), destination)
+
+    index.move(os.path.dirname(source), destination)
+    index.close()
+
+    assert [result["path"] for result in index.search("Induktion")] == [
+        os.path.join(destination, "PH HA.pdf")
+    ]
+    assert index.extracted == [source]
+
+
+def test_remove(index, tmp_path):
+    path = create_file(tmp_path, "HAs/PH HA.pdf", "Induktion")
+    index.index_file(path)
+
+    index.remove(path)
+
+    assert index.search("Induktion") == []
+
+
+def test_remove_directory(index, tmp_path):
+    removed = create_file(tmp_path, "Archive/Physik/2019/Juni/PH HA.pdf", "Induktion")
+    kept = create_file(tmp_path, "Archive/Physik/20190/PH HA.pdf", "Induktion")
+    index.index_file(removed)
+    index.index_file(kept)
+
+    index.remove(str(tmp_path / "Archive/Physik/2019"))
+
+    assert [result["path"] for result in index.search("Induktion")] == [kept]
+
+
+def test_search_leaves_out_deleted_files(index, tmp_path):
+    path = create_file(tmp_path, "HAs/PH HA.pdf", "Induktion")
+    index.index_file(path)
+    os.remove(path)
+
+    assert index.search("Induktion") == []
+
+
+def test_search_index_middleware_removes_paths(index, tmp_path, monkeypatch):
+    monkeypatch.setitem(archive_index._INDICES, index.path, index)
+    path = create_file(tmp_path, "Archive/Physik/2019/Juni/PH HA.pdf", "Induktion")
+    index.index_file(path)
+    middleware = SearchIndexArchiveMiddleware(index.config, None)
+
+    middleware.did_remove(str(tmp_path / "Archive/Physik/2019"))
+
+    assert index.search("Induktion") == []
+
+
+def test_rename_updates_paths_by_prefix(index, tmp_path, monkeypatch):
+    source = create_file(tmp_path, "Archive/Physik/2021/PH HA.pdf", "Induktion")
+    kept = create_file(tmp_path, "Archive/Physik 2/PH HA.pdf", "Induktion")
+    index.index_file(source)
+    index.index_file(kept)
+    destination = str(tmp_path / "Archive/Physics")
+    os.rename(str(tmp_path / "Archive/Physik"), destination)
+    monkeypatch.setattr(os, "walk", None)
+
+    index.rename(str(tmp_path / "Archive/Physik"), destination)
+
+    assert sorted(result["path"] for result in index.search("Induktion")) == [
+        os.path.join(destination, "2021/PH HA.pdf"),
+        kept,
+    ]
@@ -1,18 +1,23 @@
 import datetime
 import os
+import shutil
+import tempfile
 from typing import Dict, Optional
+from unittest import mock
 
 import pytest
 from home_automation import config
 from home_automation.archive_manager import (
     BLACKLIST_EXT,
     BLACKLIST_FILES,
-    TRESHOLD_DATE,
     ArchiveManager,
     InvalidFormattingException,
     IsCompressedFileException,
+    get_threshold_date,
 )
+from home_automation.archive_middleware import ArchiveMiddleware
 from home_automation.constants import ABBR_TO_SUBJECT, MONTH_TO_DIR
+from home_automation.quarantine import SUBSYSTEM_ARCHIVING, get_quarantine
 from pyfakefs.fake_filesystem_unittest import TestCase
 
 from tests.test_config import TESTING_CONFIG
@@ -25,9 +30,11 @@ class AnyTestCase(TestCase):
     def setUp(self):
         self.setUpPyfakefs()
         self.manager = ArchiveManager(TESTING_CONFIG, debug=True)
+        get_quarantine(TESTING_CONFIG).clear()
+        threshold_date = get_threshold_date()
         self.useful_data = {
-            "year": str(TRESHOLD_DATE.year),
-            "month": MONTH_TO_DIR[TRESHOLD_DATE.month],
+            "year": str(threshold_date.year),
+            "month": MONTH_TO_DIR[threshold_date.month],
         }
         self.extra_setup()
 
@@ -310,7 +317,7 @@ class TestTransferFile(AnyTestCase):
             self.fs.create_file(path)
             self.manager.transfer_file(path)
             assert self.fs.exists(path)
-            for line in self.manager.logger._lines:
+            for line in self.manager.logger.lines:
                 assert not f"Transferred file from {path} to {path}" in line
 
         assert self.manager.transferred_files == []
@@ -404,6 +411,28 @@ class TestTransferDirectory(AnyTestCase):
         assert self.manager.transferred_files == [s1, s2, s3]
         assert self.manager.not_transferred_files == [s5]
 
+    def test_failing_files_are_quarantined(self):
+        path = "/volume2/Hausaufgaben/HAs/PH HA 22-06-2021.pdf"
+        self.fs.create_file(path)
+        attempts = []
+
+        def transfer_file(fname):
+            attempts.append(fname)
+            raise PermissionError(fname)
+
+        self.manager.transfer_file = transfer_file
+        self.manager.transfer_directory(TESTING_CONFIG.homework_dir)
+        self.manager.transfer_directory(TESTING_CONFIG.homework_dir)
+
+        assert attempts == [path]
+        entries = get_quarantine(TESTING_CONFIG).get_entries(SUBSYSTEM_ARCHIVING)
+        assert [entry["path"] for entry in entries] == [path]
+
+        get_quarantine(TESTING_CONFIG).clear(path)
+        self.manager.transfer_directory(TESTING_CONFIG.homework_dir)
+
+        assert attempts == [path, path]
+
     def test_transfer_directory_with_folder_valid_formatting(self):
         def f1(name: str) -> str:
             return "/volume2/Hausaufgaben/HAs" + ("/" if len(name) > 0 else "") + name
@@ -711,3 +740,251 @@ def test_does_override_default_subject_abbreviations():
     )
     manager = ArchiveManager(conf)
     assert manager.abbr_to_subject["PH"] == "Physics"
+
+
+class RecordingMiddleware(ArchiveMiddleware):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.events = []
+
+    def did_transfer(self, source, destination):
+        self.events.append(("transfer", source, destination))
+
+    def did_rename(self, source, destination):
+        self.events.append(("rename", source, destination))
+
+    def did_remove(self, path):
+        self.events.append(("remove", path))
+
+
+class TestRenameSubjects(TestCase):
+    archive_dir = "/volume2/Hausaufgaben/Archive"
+
+    def setUp(self):
+        # SQLite isn't affected by pyfakefs, so the database is a real file
+        storage_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, storage_dir)
+        self.setUpPyfakefs()
+        self.manager = self.create_manager({"PH": "Physics"}, storage_dir)
+
+    def create_manager(self, abbreviations, storage_dir=None) -> ArchiveManager:
+        storage_dir = storage_dir or os.path.dirname(
+            self.manager.config.storage.local.path
+        )
+        conf = config.Config(
+            "/var/logs",
+            "/volume2/Hausaufgaben/HAs",
+            self.archive_dir,
+            {},
+            "",
+            "",
+            subject_abbreviations=abbreviations,
+            frontend={"backend_ip_address": "192.168.0.2"},
+            storage={"local": {"path": os.path.join(storage_dir, "local.db")}},
+        )
+        return ArchiveManager(conf)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.archive_dir, name)
+
+    def test_detect_subject_renames(self):
+        self.fs.create_file(self.path("Physik/2021/Juni/PH HA 22-06-2021.pdf"))
+        self.fs.create_file(self.path("Physik/2021/Juni/text.pdf"))
+        self.fs.create_file(self.path("Mathe/2021/Juni/M HA 22-06-2021.pdf"))
+        self.fs.create_file(self.path("Sonstiges/PH HA.pdf"))
+        self.fs.create_file(self.path("Sonstiges/M HA.pdf"))
+        self.fs.create_file(self.path("Klausuren/PH HA 22-06-2021.pdf"))
+        self.fs.create_file(self.path("Klausuren/PH HA 23-06-2021.pdf"))
+        self.fs.create_file(self.path("Klausuren/PH HA 24-06-2021.pdf"))
+        self.fs.create_dir(self.path("Leer"))
+
+        assert self.manager.detect_subject_renames() == {"Physik": "Physics"}
+
+    def test_rename_subjects_renames_directory(self):
+        self.fs.create_file(self.path("Physik/2021/Juni/PH HA 22-06-2021.pdf"))
+
+        self.manager.rename_subjects()
+
+        assert not self.fs.exists(self.path("Physik"))
+        assert self.fs.exists(self.path("Physics/2021/Juni/PH HA 22-06-2021.pdf"))
+        assert self.manager.detect_subject_renames() == {}
+
+    def test_rename_subjects_renames_custom_subjects(self):
+        self.fs.create_file(self.path("Physik/2021/Juni/PH HA 22-06-2021.pdf"))
+        self.manager.rename_subjects()
+        self.manager = self.create_manager({"PH": "Physics 2"})
+
+        assert self.manager.detect_subject_renames() == {"Physics": "Physics 2"}
+        self.manager.rename_subjects()
+        self.manager = self.create_manager({})
+
+        assert self.manager.detect_subject_renames() == {"Physics 2": "Physik"}
+
+    def test_failed_renames_are_retried(self):
+        self.fs.create_file(self.path("Physik/2021/Juni/PH HA 22-06-2021.pdf"))
+        with mock.patch.object(
+            self.manager, "rename_subject_directory", side_effect=OSError
+        ):
+            self.manager.rename_subjects()
+
+        assert self.manager.detect_subject_renames() == {"Physik": "Physics"}
+
+    def test_rename_subjects_updates_middleware_without_walking(self):
+        middleware = RecordingMiddleware(self.manager.config, self.manager.logger)
+        self.manager.register_middleware(middleware)
+        self.fs.create_file(self.path("Physik/2021/Juni/PH HA 22-06-2021.pdf"))
+        self.fs.create_file(self.path("Physik/2021/Juni/PH HA.pdf"), contents="a")
+        self.fs.create_file(self.path("Physik/2021/Juni/M HA.pdf"), contents="a")
+        self.fs.create_file(self.path("Physics/2021/Juni/PH HA.pdf"), contents="b")
+        self.fs.create_file(self.path("Physics/2021/Juni/M HA.pdf"), contents="a")
+
+        self.manager.rename_subjects()
+
+        assert sorted(middleware.events[:-1]) == [
+            ("remove", self.path("Physik/2021/Juni/M HA.pdf")),
+            (
+                "transfer",
+                self.path("Physik/2021/Juni/PH HA.pdf"),
+                self.path("Physics/2021/Juni/PH HA (2).pdf"),
+            ),
+        ]
+        assert middleware.events[-1] == (
+            "rename",
+            self.path("Physik"),
+            self.path("Physics"),
+        )
+
+    def test_rename_subjects_merges_into_existing_directory(self):
+        self.fs.create_file(self.path("Physik/2021/Juni/PH HA 22-06-2021.pdf"))
+        self.fs.create_file(self.path("Physik/2021/Mai/PH HA 22-05-2021.pdf"))
+        self.fs.create_file(self.path("Physik/2021/Juni/PH HA.pdf"), contents="a")
+        self.fs.create_file(self.path("Physik/2021/Juni/M HA.pdf"), contents="a")
+        self.fs.create_file(self.path("Physics/2021/Juni/PH HA 23-06-2021.pdf"))
+        self.fs.create_file(self.path("Physics/2021/Juni/PH HA.pdf"), contents="b")
+        self.fs.create_file(self.path("Physics/2021/Juni/M HA.pdf"), contents="a")
+
+        self.manager.rename_subjects()
+
+        assert not self.fs.exists(self.path("Physik"))
+        assert sorted(os.listdir(self.path("Physics/2021/Juni"))) == [
+            "M HA.pdf",
+            "PH HA (2).pdf",
+            "PH HA 22-06-2021.pdf",
+            "PH HA 23-06-2021.pdf",
+            "PH HA.pdf",
+        ]
+        assert self.fs.exists(self.path("Physics/2021/Mai/PH HA 22-05-2021.pdf"))
+
+    def test_get_destination_for_file_replaces_only_subject_directory(self):
+        s = self.path("Physics/2021/Physics/M HA.pdf")
+        self.fs.create_dir(self.path("Physics/2021/Juni"))
+
+        dest = self.manager.get_destination_for_file(
+            self.path("Physics/2021/Juni/M HA.pdf")
+        )
+
+        assert dest == self.path("Mathe/2021/Juni/M HA.pdf")
+        assert self.manager.get_destination_for_file(s) == self.path(
+            "Mathe/2021/Physics/M HA.pdf"
+        )
+
+
+class TestTierOldYears(TestCase):
+    archive_dir = "/volume2/Hausaufgaben/Archive"
+    cold_dir = "/volume3/Cold"
+
+    def setUp(self):
+        self.setUpPyfakefs()
+        self.manager = self.create_manager(False)
+
+    def create_manager(self, keep_only_compressed: bool) -> ArchiveManager:
+        conf = config.Config(
+            "/var/logs",
+            "/volume2/Hausaufgaben/HAs",
+            self.archive_dir,
+            {},
+            "",
+            "",
+            frontend={"backend_ip_address": "192.168.0.2"},
+            archiving={
+                "cold_tier": {
+                    "directory": self.cold_dir,
+                    "min_age_years": 2,
+                    "keep_only_compressed": keep_only_compressed,
+                }
+            },
+        )
+        return ArchiveManager(conf)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.archive_dir, name)
+
+    def test_tier_old_years_packs_old_years_only(self):
+        self.fs.create_file(self.path("Physik/2019/Juni/PH HA 22-06-2019.pdf"), contents="a")
+        self.fs.create_file(self.path("Physik/2019/Mai/PH HA 22-05-2019.pdf"), contents="b")
+        self.fs.create_file(self.path("Physik/2020/Juni/PH HA 22-06-2020.pdf"))
+
+        containers = self.manager.tier_old_years(datetime.date(2022, 6, 28))
+
+        assert containers == [os.path.join(self.cold_dir, "Physik", "2019.zip")]
+        assert not self.fs.exists(self.path("Physik/2019"))
+        assert self.fs.exists(self.path("Physik/2020/Juni/PH HA 22-06-2020.pdf"))
+        assert sorted(self.manager.list_cold_tier("Physik", "2019")) == [
+            "Juni/PH HA 22-06-2019.pdf",
+            "Mai/PH HA 22-05-2019.pdf",
+        ]
+        assert (
+            self.manager.read_from_cold_tier("Physik", "2019", "Mai/PH HA 22-05-2019.pdf")
+            == b"b"
+        )
+
+    def test_tier_old_years_appends_to_existing_container(self):
+        self.fs.create_file(self.path("Physik/2019/Juni/PH HA 22-06-2019.pdf"))
+        self.manager.tier_old_years(datetime.date(2022, 6, 28))
+        self.fs.create_file(self.path("Physik/2019/Juni/PH HA 23-06-2019.pdf"))
+
+        self.manager.tier_old_years(datetime.date(2022, 6, 28))
+
+        assert sorted(self.manager.list_cold_tier("Physik", "2019")) == [
+            "Juni/PH HA 22-06-2019.pdf",
+            "Juni/PH HA 23-06-2019.pdf",
+        ]
+
+    def test_tier_old_years_keeps_files_already_in_container(self):
+        self.fs.create_file(self.path("Physik/2019/Juni/PH HA 22-06-2019.pdf"), contents="a")
+        self.fs.create_file(self.path("Physik/2019/Juni/PH HA 23-06-2019.pdf"), contents="b")
+        self.manager.tier_old_years(datetime.date(2022, 6, 28))
+        self.fs.create_file(self.path("Physik/2019/Juni/PH HA 22-06-2019.pdf"), contents="c")
+        self.fs.create_file(self.path("Physik/2019/Juni/PH HA 23-06-2019.pdf"), contents="b")
+
+        self.manager.tier_old_years(datetime.date(2022, 6, 28))
+
+        assert not self.fs.exists(self.path("Physik/2019"))
+        assert sorted(self.manager.list_cold_tier("Physik", "2019")) == [
+            "Juni/PH HA 22-06-2019 (2).pdf",
+            "Juni/PH HA 22-06-2019.pdf",
+            "Juni/PH HA 23-06-2019.pdf",
+        ]
+        assert (
+            self.manager.read_from_cold_tier("Physik", "2019", "Juni/PH HA 22-06-2019.pdf")
+            == b"a"
+        )
+        assert (
+            self.manager.read_from_cold_tier(
+                "Physik", "2019", "Juni/PH HA 22-06-2019 (2).pdf"
+            )
+            == b"c"
+        )
+
+    def test_tier_old_years_keeps_only_compressed(self):
+        manager = self.create_manager(True)
+        self.fs.create_file(self.path("Physik/2019/Juni/PH HA 22-06-2019.pdf"))
+        self.fs.create_file(self.path("Physik/2019/Juni/PH HA 22-06-2019.small.pdf"))
+        self.fs.create_file(self.path("Physik/2019/Juni/PH HA 23-06-2019.pdf"))
+
+        manager.tier_old_years(datetime.date(2022, 6, 28))
+
+        assert sorted(manager.list_cold_tier("Physik", "2019")) == [
+            "Juni/PH HA 22-06-2019.small.pdf",
+            "Juni/PH HA 23-06-2019.pdf",
+        ]
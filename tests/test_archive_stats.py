@@ -0,0 +1,167 @@
+import os
+
+import pytest
+from home_automation import config
+from home_automation.archive_middleware import StatsArchiveMiddleware
+from home_automation.archive_stats import ArchiveStats
+
+
+@pytest.fixture
+def conf(tmp_path):
+    return config.Config(
+        str(tmp_path),
+        str(tmp_path / "HAs"),
+        str(tmp_path / "Archive"),
+        {},
+        "",
+        "",
+        frontend={"backend_ip_address": "192.168.0.2"},
+        storage={"local": {"path": str(tmp_path / "local.db")}},
+    )
+
+
+@pytest.fixture
+def stats(conf):
+    return ArchiveStats(conf)
+
+
+def create_file(directory: str, name: str, size: int) -> str:
+    path = os.path.join(directory, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(b"x" * size)
+    return path
+
+
+def month(stats: ArchiveStats, subject: str, year: str, month_name: str):
+    return stats.usage()["subjects"][subject]["years"][year]["months"][month_name]
+
+
+def test_key_for(stats, conf):
+    assert stats.key_for(
+        os.path.join(conf.archive_dir, "Physik/2021/Juni/PH HA.pdf")
+    ) == ("Physik", "2021", "Juni")
+    assert stats.key_for(
+        os.path.join(conf.archive_dir, "Physik/2021/Juni/Projekt/a.pdf")
+    ) == ("Physik", "2021", "Juni")
+    assert stats.key_for(os.path.join(conf.archive_dir, "Physik/a.pdf")) == (
+        "Physik",
+        "",
+        "",
+    )
+    assert stats.key_for(os.path.join(conf.homework_dir, "PH HA.pdf")) is None
+
+
+def test_record_move_from_homework_dir(stats, conf):
+    create_file(conf.homework_dir, "PH HA.pdf", 10)
+    destination = create_file(conf.archive_dir, "Physik/2021/Juni/PH HA.pdf", 10)
+    create_file(conf.archive_dir, "Physik/2021/Juni/Projekt/a.pdf", 5)
+
+    stats.record_move(os.path.join(conf.homework_dir, "PH HA.pdf"), destination)
+    stats.record_added(os.path.join(conf.archive_dir, "Physik/2021/Juni/Projekt"))
+
+    assert month(stats, "Physik", "2021", "Juni") == {
+        "files": 2,
+        "bytes": 15,
+        "compressed_bytes": 0,
+    }
+    assert stats.usage()["total"]["files"] == 2
+
+
+def test_record_move_within_archive(stats, conf):
+    source = create_file(conf.archive_dir, "Physik/2021/Juni/M HA.pdf", 10)
+    create_file(conf.archive_dir, "Physik/2021/Juni/PH HA.pdf", 20)
+    stats.rebuild()
+    destination = os.path.join(conf.archive_dir, "Mathe/2021/Juni/M HA.pdf")
+    os.makedirs(os.path.dirname(destination))
+    os.rename(source, destination)
+
+    stats.record_move(source, destination)
+
+    assert month(stats, "Physik", "2021", "Juni")["bytes"] == 20
+    assert month(stats, "Mathe", "2021", "Juni")["bytes"] == 10
+    assert stats.usage()["total"] == {"files": 2, "bytes": 30, "compressed_bytes": 0}
+
+
+def test_compressed_files_are_counted_separately(stats, conf):
+    create_file(conf.archive_dir, "Physik/2021/Juni/PH HA.pdf", 20)
+    stats.rebuild()
+
+    stats.record_added(
+        create_file(conf.archive_dir, "Physik/2021/Juni/PH HA.small.pdf", 4)
+    )
+
+    assert month(stats, "Physik", "2021", "Juni") == {
+        "files": 1,
+        "bytes": 20,
+        "compressed_bytes": 4,
+    }
+
+
+def test_empty_groups_are_dropped(stats, conf):
+    source = create_file(conf.archive_dir, "Physik/2021/Juni/M HA.pdf", 10)
+    stats.rebuild()
+    destination = create_file(conf.archive_dir, "Mathe/2021/Juni/M HA.pdf", 10)
+    os.remove(source)
+
+    stats.record_move(source, destination)
+
+    assert list(stats.usage()["subjects"]) == ["Mathe"]
+
+
+def test_middleware_recounts_merged_subjects(stats, conf):
+    create_file(conf.archive_dir, "Mathe/2021/Juni/M HA 1.pdf", 10)
+    create_file(conf.archive_dir, "Mathematik/2021/Juni/M HA 2.pdf", 5)
+    stats.rebuild()
+    # as if "Mathe" had been merged into "Mathematik"
+    os.rename(
+        os.path.join(conf.archive_dir, "Mathe/2021/Juni/M HA 1.pdf"),
+        os.path.join(conf.archive_dir, "Mathematik/2021/Juni/M HA 1.pdf"),
+    )
+    middleware = StatsArchiveMiddleware(conf, None)
+
+    middleware.did_transfer(
+        os.path.join(conf.archive_dir, "Mathe"),
+        os.path.join(conf.archive_dir, "Mathematik"),
+    )
+
+    assert list(stats.usage()["subjects"]) == ["Mathematik"]
+    assert month(stats, "Mathematik", "2021", "Juni")["files"] == 2
+
+
+def test_middleware_forgets_removed_years(stats, conf):
+    create_file(conf.archive_dir, "Physik/2019/Juni/PH HA.pdf", 10)
+    create_file(conf.archive_dir, "Physik/2021/Juni/PH HA.pdf", 10)
+    stats.rebuild()
+
+    StatsArchiveMiddleware(conf, None).did_remove(
+        os.path.join(conf.archive_dir, "Physik/2019")
+    )
+
+    assert list(stats.usage()["subjects"]["Physik"]["years"]) == ["2021"]
+
+
+def test_middleware_moves_counters_of_renamed_subjects(stats, conf, monkeypatch):
+    create_file(conf.archive_dir, "Mathe/2021/Juni/M HA 1.pdf", 10)
+    duplicate = create_file(conf.archive_dir, "Mathe/2021/Juni/M HA 2.pdf", 5)
+    create_file(conf.archive_dir, "Mathematik/2021/Juni/M HA 2.pdf", 5)
+    create_file(conf.archive_dir, "Mathematik/2021/Mai/M HA 3.pdf", 7)
+    stats.rebuild()
+    middleware = StatsArchiveMiddleware(conf, None)
+    # as if "Mathe" had been merged into "Mathematik", dropping the duplicate
+    middleware.did_remove(duplicate)
+    os.remove(duplicate)
+    monkeypatch.setattr(os, "walk", None)
+
+    middleware.did_rename(
+        os.path.join(conf.archive_dir, "Mathe"),
+        os.path.join(conf.archive_dir, "Mathematik"),
+    )
+
+    assert list(stats.usage()["subjects"]) == ["Mathematik"]
+    assert month(stats, "Mathematik", "2021", "Juni") == {
+        "files": 2,
+        "bytes": 15,
+        "compressed_bytes": 0,
+    }
+    assert month(stats, "Mathematik", "2021", "Mai")["files"] == 1
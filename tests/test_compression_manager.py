@@ -1,13 +1,15 @@
 from tests.test_config import TESTING_CONFIG
-from home_automation import config
+from home_automation import config, tree_walker
 
 from home_automation.compression_middleware import (
     ChangeStatusInThingsMiddleware,
     FlashLightsInHomeAssistantMiddleware
 )
 from home_automation.compression_manager import CompressionManager
+from home_automation.quarantine import SUBSYSTEM_COMPRESSION, get_quarantine
 import os
 import re
+import threading
 from typing import List
 
 import pytest
@@ -23,6 +25,7 @@ class AnyTestCase:
         [self.manager.register_middleware(m(TESTING_CONFIG, self.manager.logger)) for m in [
             FlashLightsInHomeAssistantMiddleware,
             ChangeStatusInThingsMiddleware]]
+        get_quarantine(TESTING_CONFIG).clear()
         try:
             fs.rmdir("/volume2")
         except FileNotFoundError:
@@ -81,14 +84,14 @@ class TestCompressDirectory(AnyTestCase):
                 """Assert whether files were compressed.
                 Got a better synonyme for 'assert'?"""
                 self.did_evaluate = True
-                for line in manager.logger._lines:
+                for line in manager.logger.lines:
                     for f in self.files:
                         path = os.path.join(TESTING_CONFIG.homework_dir, f)
                         if f"Compressing '{path}'" in line:
                             self.did_try_to_compress_files[f] = True
 
                 # don't double newlines
-                [print(line[:-1]) for line in manager.logger._lines]
+                [print(line[:-1]) for line in manager.logger.lines]
 
                 for k, v in self.did_try_to_compress_files.items():
                     assert v, \
@@ -307,6 +310,72 @@ class TestCompressDirectory(AnyTestCase):
 
         assert result == expected
 
+    async def test_failing_files_are_quarantined(self, fs, monkeypatch):
+        monkeypatch.setattr(os, "system", lambda cmd: 256)
+        create_file(fs, "test.pdf")
+        path = os.path.join(TESTING_CONFIG.homework_dir, "test.pdf")
+
+        await self.manager.compress_directory(TESTING_CONFIG.homework_dir)
+        await self.manager.compress_directory(TESTING_CONFIG.homework_dir)
+
+        attempts = [line for line in self.manager.logger.lines
+                    if f"Compressing '{path}'" in line]
+        assert len(attempts) == 1
+        entries = get_quarantine(TESTING_CONFIG).get_entries(SUBSYSTEM_COMPRESSION)
+        assert [entry["path"] for entry in entries] == [path]
+        assert entries[0]["failures"] == 1
+
+        with open(path, "w", encoding="utf-8") as file:
+            file.write("%PDF fixed")
+        await self.manager.compress_directory(TESTING_CONFIG.homework_dir)
+
+        attempts = [line for line in self.manager.logger.lines
+                    if f"Compressing '{path}'" in line]
+        assert len(attempts) == 2
+
+    async def test_compress_paths_only_compresses_given_paths(self, fs, monkeypatch):
+        monkeypatch.setattr(os, "system", lambda cmd: 0)
+        for name in ["a.pdf", "b.pdf", "Physik/c.pdf", "Physik/d.txt"]:
+            create_file(fs, name)
+
+        await self.manager.compress_paths([
+            os.path.join(TESTING_CONFIG.homework_dir, "a.pdf"),
+            os.path.join(TESTING_CONFIG.homework_dir, "Physik"),
+            os.path.join(TESTING_CONFIG.homework_dir, "deleted.pdf"),
+        ])
+
+        compressed = sorted(
+            os.path.relpath(line.split("'")[1], TESTING_CONFIG.homework_dir)
+            for line in self.manager.logger.lines if "Compressing '" in line
+        )
+        assert compressed == ["Physik/c.pdf", "a.pdf"]
+
+    async def test_compress_directory_compresses_while_walking(self, fs, monkeypatch):
+        for name in ["a.pdf", "Physik/c.pdf"]:
+            create_file(fs, name)
+        compressed = []
+        first_compressed = threading.Event()
+        walk = tree_walker.walk
+        waited = []
+
+        def slow_walk(*args, **kwargs):
+            walker = walk(*args, **kwargs)
+            yield next(walker)
+            waited.append(first_compressed.wait(timeout=5))
+            yield from walker
+
+        async def compress_file(path, dirlist):
+            compressed.append(os.path.basename(path))
+            first_compressed.set()
+
+        monkeypatch.setattr(tree_walker, "walk", slow_walk)
+        monkeypatch.setattr(self.manager, "compress_file", compress_file)
+
+        await self.manager.compress_directory()
+
+        assert waited == [True]
+        assert compressed == ["a.pdf", "c.pdf"]
+
 
 class TestCleanUpDirectory(AnyTestCase):
     def test_clean_up_directory(self, fs):
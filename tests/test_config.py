@@ -84,7 +84,7 @@ class TestConfig:
             user: 'user'
             group: 'group'
         runner:
-            cron_user: 'user'
+            debounce: 2.5
         frontend:
             backend_ip_address: 192.168.0.1
         admin:
@@ -113,7 +113,7 @@ class TestConfig:
             portainer={"url": "http://portainer.local:10201"},
             things_server={"url": "http://things.local:8001"},
             process={"user": "user", "group": "group"},
-            runner={"cron_user": "user"},
+            runner={"debounce": 2.5},
             storage={"file": {"path": "./home_automation.backend.db"}},
             frontend={"backend_ip_address": "192.168.0.1"},
             admin={"user": "admin", "password": "admin"},
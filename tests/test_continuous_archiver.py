@@ -0,0 +1,131 @@
+import datetime
+import os
+
+from home_automation.archive_manager import ArchiveManager, get_threshold_date
+from home_automation.continuous_archiver import ContinuousArchiver, TimerWheel
+from pyfakefs.fake_filesystem_unittest import TestCase
+
+from tests.test_config import TESTING_CONFIG
+
+NOW = datetime.datetime(2021, 6, 28, 12)
+HOMEWORK_DIR = TESTING_CONFIG.homework_dir
+
+
+def test_get_threshold_date():
+    assert get_threshold_date(5, datetime.date(2021, 6, 28)) == datetime.date(
+        2021, 6, 23
+    )
+
+
+class TestTimerWheel:
+    def test_advance_returns_due_keys_oldest_first(self):
+        wheel = TimerWheel(datetime.timedelta(days=1), 4)
+        wheel.schedule("b", NOW - datetime.timedelta(hours=1))
+        wheel.schedule("a", NOW - datetime.timedelta(days=2))
+        wheel.schedule("c", NOW + datetime.timedelta(days=1))
+
+        assert wheel.advance(NOW) == ["a", "b"]
+        assert "c" in wheel
+        assert len(wheel) == 1
+
+    def test_keys_beyond_one_revolution_stay_scheduled(self):
+        wheel = TimerWheel(datetime.timedelta(days=1), 2)
+        wheel.schedule("late", NOW + datetime.timedelta(days=5))
+
+        assert wheel.advance(NOW + datetime.timedelta(days=1)) == []
+        assert wheel.advance(NOW + datetime.timedelta(days=3)) == []
+        assert wheel.advance(NOW + datetime.timedelta(days=5)) == ["late"]
+
+    def test_overdue_keys_scheduled_after_advancing(self):
+        wheel = TimerWheel(datetime.timedelta(days=1), 8)
+        wheel.advance(NOW)
+        wheel.schedule("overdue", NOW - datetime.timedelta(days=3))
+
+        assert wheel.advance(NOW + datetime.timedelta(minutes=10)) == ["overdue"]
+
+    def test_reschedule_and_cancel(self):
+        wheel = TimerWheel(datetime.timedelta(days=1), 4)
+        wheel.schedule("a", NOW - datetime.timedelta(days=1))
+        wheel.schedule("a", NOW + datetime.timedelta(days=1))
+        wheel.schedule("b", NOW)
+        wheel.cancel("b")
+
+        assert wheel.advance(NOW) == []
+        assert wheel.due_date("a") == NOW + datetime.timedelta(days=1)
+
+
+class TestContinuousArchiver(TestCase):
+    def setUp(self):
+        self.setUpPyfakefs()
+        self.fs.create_dir(HOMEWORK_DIR)
+        self.fs.create_dir(TESTING_CONFIG.archive_dir)
+        self.manager = ArchiveManager(TESTING_CONFIG)
+        self.archiver = ContinuousArchiver(TESTING_CONFIG, self.manager, NOW)
+
+    def create_file(self, name: str, age: datetime.timedelta) -> str:
+        path = os.path.join(HOMEWORK_DIR, name)
+        self.fs.create_file(path)
+        mtime = (NOW - age).timestamp()
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_only_archives_files_older_than_threshold(self):
+        old = self.create_file("PH HA 22-06-2021.pdf", datetime.timedelta(days=6))
+        new = self.create_file("M HA 27-06-2021.pdf", datetime.timedelta(days=1))
+
+        archived = self.archiver.tick(NOW)
+
+        assert archived == [old]
+        assert not os.path.exists(old)
+        assert os.path.exists(new)
+        assert os.path.exists(
+            os.path.join(
+                TESTING_CONFIG.archive_dir, "Physik/2021/Juni/PH HA 22-06-2021.pdf"
+            )
+        )
+
+        archived = self.archiver.tick(NOW + datetime.timedelta(days=5))
+
+        assert archived == [new]
+        assert not os.path.exists(new)
+
+    def test_respects_daily_batch_size(self):
+        self.config_max = TESTING_CONFIG.archiving.max_files_per_day
+        TESTING_CONFIG.archiving.max_files_per_day = 2
+        try:
+            for day in range(1, 6):
+                self.create_file(f"PH HA 0{day}-06-2021.pdf", datetime.timedelta(days=10))
+
+            assert len(self.archiver.tick(NOW)) == 2
+            assert len(self.archiver.tick(NOW + datetime.timedelta(hours=1))) == 0
+            assert len(self.archiver.tick(NOW + datetime.timedelta(days=1))) == 2
+            assert len(self.archiver.tick(NOW + datetime.timedelta(days=2))) == 1
+        finally:
+            TESTING_CONFIG.archiving.max_files_per_day = self.config_max
+
+    def test_modified_file_gets_rescheduled(self):
+        path = self.create_file("PH HA 22-06-2021.pdf", datetime.timedelta(days=4))
+        self.archiver.scan()
+        mtime = NOW.timestamp()
+        os.utime(path, (mtime, mtime))
+
+        assert self.archiver.tick(NOW + datetime.timedelta(days=2)) == []
+        assert os.path.exists(path)
+
+    def test_invalidly_formatted_file_is_not_retried_until_modified(self):
+        path = self.create_file("test.pdf", datetime.timedelta(days=10))
+
+        assert self.archiver.tick(NOW) == []
+        assert self.archiver.tick(NOW + datetime.timedelta(days=1)) == []
+        assert self.manager.not_transferred_files == [path]
+
+    def test_entries_left_in_place_do_not_count_against_batch_size(self):
+        self.config_max = TESTING_CONFIG.archiving.max_files_per_day
+        TESTING_CONFIG.archiving.max_files_per_day = 1
+        try:
+            self.create_file("test.pdf", datetime.timedelta(days=10))
+            path = self.create_file("PH HA 22-06-2021.pdf", datetime.timedelta(days=9))
+
+            assert self.archiver.tick(NOW) == [path]
+        finally:
+            TESTING_CONFIG.archiving.max_files_per_day = self.config_max
@@ -0,0 +1,134 @@
+import asyncio
+import threading
+
+import pytest
+
+from home_automation.event_queue import EventQueue, StabilityDetector
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_paths_are_coalesced_until_quiet():
+    clock = FakeClock()
+    queue = EventQueue(lambda paths: None, debounce=5, max_delay=60, clock=clock)
+    assert queue.due_in() is None
+
+    for i in range(40):
+        clock.now = i * 0.5
+        queue.put([f"/HAs/{i % 10}.pdf"])
+
+    assert queue.due_in() == 5
+    clock.now += 5
+    assert queue.due_in() == 0
+    assert queue.take() == [f"/HAs/{i}.pdf" for i in range(10)]
+    assert queue.due_in() is None
+
+
+def test_continuous_changes_are_handled_after_max_delay():
+    clock = FakeClock()
+    queue = EventQueue(lambda paths: None, debounce=5, max_delay=60, clock=clock)
+
+    while clock.now < 60:
+        queue.put(["/HAs/growing.pdf"])
+        clock.now += 1
+
+    assert queue.due_in() <= 0
+
+
+def test_everything_supersedes_paths():
+    queue = EventQueue(lambda paths: None)
+
+    queue.put(["/HAs/a.pdf"])
+    queue.put_everything()
+
+    assert queue.take() is None
+    assert queue.take() == []
+
+
+def test_bursts_are_handled_in_one_batch():
+    batches = []
+    handled = threading.Event()
+
+    def handler(paths):
+        batches.append(paths)
+        handled.set()
+
+    queue = EventQueue(handler, debounce=0.2, max_delay=10)
+    queue.start()
+    try:
+        for i in range(40):
+            queue.put([f"/HAs/{i}.pdf", f"/HAs/{i}.pdf"])
+        assert handled.wait(5)
+    finally:
+        queue.stop(5)
+
+    assert batches == [[f"/HAs/{i}.pdf" for i in range(40)]]
+
+
+def test_event_loop_is_woken_up_by_other_threads():
+    batches = []
+
+    async def handler(paths):
+        batches.append(paths)
+        queue.stop()
+
+    queue = EventQueue(handler, debounce=0.2, max_delay=10)
+
+    async def serve():
+        loop = asyncio.get_running_loop()
+        observer = threading.Thread(
+            target=lambda: [queue.put([f"/HAs/{i}.pdf"]) for i in range(10)]
+        )
+        loop.call_later(0.1, observer.start)
+        await asyncio.wait_for(queue.serve(), 5)
+        observer.join()
+
+    asyncio.run(serve())
+
+    assert batches == [[f"/HAs/{i}.pdf" for i in range(10)]]
+
+
+@pytest.fixture
+def upload(tmp_path):
+    path = tmp_path / "Scan.pdf"
+    path.write_bytes(b"%PDF")
+    return str(path)
+
+
+def test_growing_files_are_held_back(upload):
+    clock = FakeClock()
+    stability = StabilityDetector(stable_for=2, clock=clock)
+    queue = EventQueue(
+        lambda paths: None, debounce=1, max_delay=60, clock=clock, stability=stability
+    )
+
+    queue.put([upload])
+    clock.now = 1
+    with open(upload, "ab") as file:
+        file.write(b"more")
+    assert queue.take() == []
+    assert queue.due_in() == 2
+
+    clock.now = 3
+    assert queue.take() == [upload]
+    assert queue.due_in() is None
+
+
+def test_closed_files_are_handled_right_away(upload, tmp_path):
+    clock = FakeClock()
+    stability = StabilityDetector(stable_for=2, clock=clock)
+    queue = EventQueue(
+        lambda paths: None, debounce=1, max_delay=60, clock=clock, stability=stability
+    )
+
+    queue.put([upload, str(tmp_path / "deleted.pdf"), str(tmp_path)])
+    queue.put([upload], closed=True)
+    clock.now = 1
+
+    assert queue.take() == [upload, str(tmp_path / "deleted.pdf"), str(tmp_path)]
@@ -0,0 +1,451 @@
+import asyncio
+import os
+import threading
+
+import pytest
+from home_automation import config
+from home_automation import file_coordinator_middleware, markdown_renderer, tree_walker
+from home_automation.file_coordinator import FileCoordinator
+from home_automation.file_coordinator_middleware import latex_preamble
+from home_automation.ignore_registry import get_ignore_registry
+from home_automation.quarantine import SUBSYSTEM_RENDERING, get_quarantine
+
+
+@pytest.fixture
+def conf(tmp_path):
+    return config.Config(
+        str(tmp_path),
+        str(tmp_path / "HAs"),
+        str(tmp_path / "Archive"),
+        {},
+        "",
+        "",
+        frontend={"backend_ip_address": "192.168.0.2"},
+        middleware={
+            "render_workers": 2,
+            "latex": {"delete_byproducts": True},
+        },
+        storage={"local": {"path": str(tmp_path / "local.db")}},
+    )
+
+
+def output_base(args):
+    """Where pdflatex/pandoc would write their outputs (without extension)."""
+    stem = os.path.splitext(os.path.basename(args[-1]))[0]
+    for i, arg in enumerate(args):
+        if arg.startswith("-output-directory="):
+            return os.path.join(arg.split("=", 1)[1], stem)
+        if arg == "-o":
+            return os.path.splitext(args[i + 1])[0]
+    return os.path.splitext(args[-1])[0]
+
+
+class FakeRenderer:
+    """Stands in for pdflatex/pandoc, recording how many run at once."""
+
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+        self.commands = []
+
+    async def __call__(self, *args, cwd=None):
+        self.commands.append(args)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        source = args[-1]
+        base = output_base(args)
+        with open(base + ".pdf", "w", encoding="utf-8") as file:
+            file.write("%PDF")
+        if source.endswith(".tex"):
+            texlive_dir = os.path.join(os.path.dirname(base), "texlive2020")
+            os.makedirs(texlive_dir, exist_ok=True)
+            with open(base + ".aux", "w", encoding="utf-8"):
+                pass
+        return 0
+
+
+@pytest.fixture
+def renderer(monkeypatch):
+    fake = FakeRenderer()
+    monkeypatch.setattr(file_coordinator_middleware, "run_command", fake)
+    return fake
+
+
+def create_files(directory, *names):
+    for name in names:
+        with open(os.path.join(directory, name), "w", encoding="utf-8") as file:
+            file.write("")
+
+
+def test_documents_are_rendered_concurrently(conf, renderer, tmp_path):
+    create_files(tmp_path, "a.tex", "b.tex", "c.md", "d.md", "e.txt")
+
+    asyncio.run(FileCoordinator(conf).handle_directory(str(tmp_path)))
+
+    for name in "abcd":
+        assert (tmp_path / f"{name}.pdf").is_file()
+    assert renderer.max_running == 2
+    assert (tmp_path / "c.md").is_file()
+    assert not (tmp_path / "a.aux").exists()
+    assert not (tmp_path / "texlive2020").exists()
+
+
+def test_same_document_is_rendered_once(conf, renderer, tmp_path):
+    create_files(tmp_path, "a.tex", "a.md")
+
+    asyncio.run(FileCoordinator(conf).handle_directory(str(tmp_path)))
+
+    sources = {command[-1] for command in renderer.commands}
+    assert len(sources) == 1
+
+
+def test_existing_pdfs_are_skipped(conf, renderer, tmp_path):
+    create_files(tmp_path, "a.tex", "a.pdf")
+
+    asyncio.run(FileCoordinator(conf).handle_directory(str(tmp_path)))
+
+    assert renderer.commands == []
+
+
+def test_byproducts_are_ignored_by_the_runner(conf, renderer, tmp_path):
+    create_files(tmp_path, "a.tex")
+
+    asyncio.run(FileCoordinator(conf).handle_directory(str(tmp_path)))
+
+    registry = get_ignore_registry(conf)
+    assert registry.is_ignored(str(tmp_path / "a.aux"))
+    assert registry.is_ignored(str(tmp_path / "texlive2020/a.fmt"))
+    assert not registry.is_ignored(str(tmp_path / "a.pdf"))
+
+
+def test_changed_documents_are_rendered_again(conf, renderer, tmp_path):
+    create_files(tmp_path, "a.tex", "b.md")
+    asyncio.run(FileCoordinator(conf).handle_directory(str(tmp_path)))
+    asyncio.run(FileCoordinator(conf).handle_directory(str(tmp_path)))
+    assert len(renderer.commands) == 2
+
+    with open(tmp_path / "b.md", "w", encoding="utf-8") as file:
+        file.write("# Changed")
+    asyncio.run(FileCoordinator(conf).handle_directory(str(tmp_path)))
+
+    assert len(renderer.commands) == 3
+    assert renderer.commands[-1][-1] == str(tmp_path / "b.md")
+
+
+class FakePdflatex:
+    """Writes the .aux/.toc/.log of each pass as given by `passes`."""
+
+    def __init__(self, *passes):
+        self.passes = list(passes)
+        self.runs = 0
+
+    async def __call__(self, *args, cwd=None):
+        base = output_base(args)
+        outputs = self.passes[min(self.runs, len(self.passes) - 1)]
+        self.runs += 1
+        for extension in ["aux", "toc", "log"]:
+            with open(f"{base}.{extension}", "w", encoding="utf-8") as file:
+                file.write(outputs.get(extension, ""))
+        with open(f"{base}.pdf", "w", encoding="utf-8") as file:
+            file.write("%PDF")
+        return 0
+
+
+@pytest.mark.parametrize(
+    "passes,expected_runs",
+    [
+        # a simple sheet only gets the aux lines written into every .aux
+        ([{"aux": "\\relax \n\\gdef \\@abspage@last{1}\n"}], 1),
+        # \tableofcontents: the .toc is only filled by the first pass
+        ([{"toc": "\\contentsline {section}{A}{1}\n"}], 2),
+        (
+            [
+                {"aux": "\\newlabel{a}{{1}{1}}\n"},
+                {
+                    "aux": "\\newlabel{a}{{1}{2}}\n",
+                    "log": "LaTeX Warning: Label(s) may have changed. "
+                    "Rerun to get cross-references right.",
+                },
+                {"aux": "\\newlabel{a}{{1}{2}}\n"},
+            ],
+            3,
+        ),
+        # never converges
+        ([{"log": "Rerun to get cross-references right."}], 5),
+    ],
+)
+def test_latex_is_rerun_until_fixpoint(
+    conf, tmp_path, monkeypatch, passes, expected_runs
+):
+    pdflatex = FakePdflatex(*passes)
+    monkeypatch.setattr(file_coordinator_middleware, "run_command", pdflatex)
+    create_files(tmp_path, "a.tex")
+
+    asyncio.run(FileCoordinator(conf).handle_directory(str(tmp_path)))
+
+    assert pdflatex.runs == expected_runs
+
+
+def test_scan_is_recursive(conf, renderer, tmp_path):
+    os.makedirs(tmp_path / "Physik" / "Projekt")
+    os.makedirs(tmp_path / ".hidden")
+    create_files(
+        tmp_path, "a.md", "Physik/b.tex", "Physik/Projekt/c.md", ".hidden/d.md"
+    )
+
+    asyncio.run(FileCoordinator(conf).scan(str(tmp_path)))
+
+    assert (tmp_path / "Physik/b.pdf").is_file()
+    assert (tmp_path / "Physik/Projekt/c.pdf").is_file()
+    assert not (tmp_path / ".hidden/d.pdf").exists()
+    assert len(renderer.commands) == 3
+
+
+def test_directories_are_walked_off_the_event_loop(conf, renderer, tmp_path, monkeypatch):
+    walked_on = []
+    walk = tree_walker.walk
+
+    def recording_walk(*args, **kwargs):
+        walked_on.append(threading.current_thread())
+        return walk(*args, **kwargs)
+
+    monkeypatch.setattr(tree_walker, "walk", recording_walk)
+    create_files(tmp_path, "a.tex")
+
+    asyncio.run(FileCoordinator(conf).scan(str(tmp_path)))
+
+    assert (tmp_path / "a.pdf").is_file()
+    assert walked_on and threading.main_thread() not in walked_on
+
+
+def test_only_changed_paths_are_handled(conf, renderer, tmp_path):
+    os.makedirs(tmp_path / "Physik" / "Projekt")
+    create_files(tmp_path, "a.md", "b.md", "Physik/Projekt/c.md")
+
+    asyncio.run(
+        FileCoordinator(conf).handle_paths(
+            [str(tmp_path / "a.md"), str(tmp_path / "Physik"), str(tmp_path / "x.md")]
+        )
+    )
+
+    assert sorted(command[-1] for command in renderer.commands) == [
+        str(tmp_path / "Physik/Projekt/c.md"),
+        str(tmp_path / "a.md"),
+    ]
+
+
+def test_changed_dependencies_render_their_documents(conf, renderer, tmp_path):
+    os.makedirs(tmp_path / "sections")
+    create_files(tmp_path, "a.tex", "sections/intro.tex")
+    with open(tmp_path / "a.tex", "w", encoding="utf-8") as file:
+        file.write("\\input{sections/intro}")
+    asyncio.run(FileCoordinator(conf).handle_paths([str(tmp_path / "a.tex")]))
+
+    with open(tmp_path / "sections/intro.tex", "w", encoding="utf-8") as file:
+        file.write("Changed")
+    asyncio.run(
+        FileCoordinator(conf).handle_paths([str(tmp_path / "sections/intro.tex")])
+    )
+
+    # intro.tex is rendered on its own as well, like any .tex file
+    assert sorted(command[-1] for command in renderer.commands) == [
+        str(tmp_path / "a.tex"),
+        str(tmp_path / "a.tex"),
+        str(tmp_path / "sections/intro.tex"),
+    ]
+
+
+def test_rendering_in_scratch_dir(conf, renderer, tmp_path):
+    conf.middleware.scratch_dir = str(tmp_path / "scratch")
+    os.makedirs(tmp_path / "HAs")
+    create_files(tmp_path / "HAs", "a.tex", "b.md")
+
+    asyncio.run(FileCoordinator(conf).scan(str(tmp_path / "HAs")))
+
+    assert sorted(os.listdir(tmp_path / "HAs")) == ["a.pdf", "a.tex", "b.md", "b.pdf"]
+    assert os.listdir(tmp_path / "scratch") == []
+    for command in renderer.commands:
+        assert output_base(command).startswith(str(tmp_path / "scratch"))
+
+
+def test_failing_documents_are_quarantined(conf, tmp_path, monkeypatch):
+    commands = []
+
+    async def failing_pdflatex(*args, cwd=None):
+        commands.append(args)
+        return 1
+
+    monkeypatch.setattr(file_coordinator_middleware, "run_command", failing_pdflatex)
+    create_files(tmp_path, "a.tex")
+    asyncio.run(FileCoordinator(conf).handle_directory(str(tmp_path)))
+    asyncio.run(FileCoordinator(conf).handle_directory(str(tmp_path)))
+
+    assert len(commands) == 1
+    entries = get_quarantine(conf).get_entries(SUBSYSTEM_RENDERING)
+    assert [entry["path"] for entry in entries] == [str(tmp_path / "a.tex")]
+    assert entries[0]["quarantined"]
+
+    with open(tmp_path / "a.tex", "w", encoding="utf-8") as file:
+        file.write("Fixed")
+    asyncio.run(FileCoordinator(conf).handle_directory(str(tmp_path)))
+
+    assert len(commands) == 2
+
+
+def test_unexpected_errors_only_affect_their_file(conf, renderer, tmp_path, monkeypatch):
+    async def run_command(*args, cwd=None):
+        if args[-1].endswith("a.tex"):
+            raise RuntimeError("bug")
+        return await renderer(*args, cwd=cwd)
+
+    monkeypatch.setattr(file_coordinator_middleware, "run_command", run_command)
+    create_files(tmp_path, "a.tex", "b.tex")
+    coordinator = FileCoordinator(conf)
+
+    asyncio.run(coordinator.handle_directory(str(tmp_path)))
+
+    assert (tmp_path / "b.pdf").is_file()
+    assert not (tmp_path / "b.aux").exists()
+    entries = get_quarantine(conf).get_entries(SUBSYSTEM_RENDERING)
+    assert [entry["path"] for entry in entries] == [str(tmp_path / "a.tex")]
+    assert coordinator._document_locks == {}  # pylint: disable=protected-access
+
+
+class FakeFormatPdflatex:
+    """pdflatex dumping formats (unless `dump_fails`) and only producing
+    output with a format if `format_works` (and never for `broken` files)."""
+
+    def __init__(self, dump_fails=False, format_works=True, broken=()):
+        self.dump_fails = dump_fails
+        self.format_works = format_works
+        self.broken = broken
+        self.dumps = 0
+        self.compiles = []
+
+    async def __call__(self, *args, cwd=None):
+        options = dict(arg[1:].split("=", 1) for arg in args if "=" in arg)
+        if "-ini" in args:
+            self.dumps += 1
+            if not self.dump_fails:
+                fmt = os.path.join(
+                    options["output-directory"], options["jobname"] + ".fmt"
+                )
+                with open(fmt, "w", encoding="utf-8"):
+                    pass
+            return 0
+        self.compiles.append(options.get("fmt"))
+        base = output_base(args)
+        with open(base + ".log", "w", encoding="utf-8") as file:
+            if os.path.basename(args[-1]) in self.broken:
+                pass
+            elif "fmt" not in options or self.format_works:
+                file.write("Output written on a.pdf (1 page).")
+                with open(base + ".pdf", "w", encoding="utf-8") as pdf:
+                    pdf.write("%PDF")
+        return 0
+
+
+PREAMBLE = "\\documentclass{article}\n\\usepackage{tikz}\n"
+
+
+@pytest.fixture
+def format_conf(conf, tmp_path):
+    conf.middleware.latex.format_dir = str(tmp_path / "formats")
+    os.makedirs(tmp_path / "HAs")
+    for name in ["a.tex", "b.tex"]:
+        with open(tmp_path / "HAs" / name, "w", encoding="utf-8") as file:
+            file.write(PREAMBLE + f"\\begin{{document}}{name}\\end{{document}}")
+    return conf
+
+
+def test_latex_preamble(tmp_path):
+    create_files(tmp_path, "part.tex")
+    with open(tmp_path / "a.tex", "w", encoding="utf-8") as file:
+        file.write(PREAMBLE + "% \\begin{document}\n\\begin{document}\n")
+
+    assert latex_preamble(str(tmp_path / "a.tex")) == PREAMBLE + "\n"
+    assert latex_preamble(str(tmp_path / "part.tex")) is None
+
+
+def test_documents_share_a_dumped_format(format_conf, tmp_path, monkeypatch):
+    pdflatex = FakeFormatPdflatex()
+    monkeypatch.setattr(file_coordinator_middleware, "run_command", pdflatex)
+
+    asyncio.run(FileCoordinator(format_conf).scan(str(tmp_path / "HAs")))
+
+    assert pdflatex.dumps == 1
+    assert len(pdflatex.compiles) == 2
+    assert pdflatex.compiles[0] and pdflatex.compiles[0] == pdflatex.compiles[1]
+    assert os.path.isfile(pdflatex.compiles[0] + ".fmt")
+    assert (tmp_path / "HAs" / "b.pdf").is_file()
+
+
+def test_failing_preambles_are_remembered(format_conf, tmp_path, monkeypatch):
+    pdflatex = FakeFormatPdflatex(dump_fails=True)
+    monkeypatch.setattr(file_coordinator_middleware, "run_command", pdflatex)
+
+    asyncio.run(FileCoordinator(format_conf).scan(str(tmp_path / "HAs")))
+
+    assert pdflatex.dumps == 1
+    assert pdflatex.compiles == [None, None]
+
+
+def test_unusable_format_falls_back(format_conf, tmp_path, monkeypatch):
+    pdflatex = FakeFormatPdflatex(format_works=False)
+    monkeypatch.setattr(file_coordinator_middleware, "run_command", pdflatex)
+
+    asyncio.run(FileCoordinator(format_conf).scan(str(tmp_path / "HAs")))
+
+    assert pdflatex.compiles[0] is not None
+    assert pdflatex.compiles.count(None) == 2
+    assert (tmp_path / "HAs" / "a.pdf").is_file()
+    assert (tmp_path / "HAs" / "b.pdf").is_file()
+
+
+def test_broken_documents_keep_the_format(format_conf, tmp_path, monkeypatch):
+    pdflatex = FakeFormatPdflatex(broken=("a.tex",))
+    monkeypatch.setattr(file_coordinator_middleware, "run_command", pdflatex)
+
+    asyncio.run(FileCoordinator(format_conf).scan(str(tmp_path / "HAs")))
+
+    fmt = next(compile for compile in pdflatex.compiles if compile)
+    assert os.path.isfile(fmt + ".fmt")
+    assert not os.path.exists(fmt + ".failed")
+    assert not (tmp_path / "HAs" / "a.pdf").exists()
+    assert (tmp_path / "HAs" / "b.pdf").is_file()
+    entries = get_quarantine(format_conf).get_entries(SUBSYSTEM_RENDERING)
+    assert [entry["path"] for entry in entries] == [str(tmp_path / "HAs" / "a.tex")]
+
+
+class FakeMarkdownRenderer:
+    available = True
+
+    def __init__(self):
+        self.rendered = []
+
+    async def render(self, path, output):
+        self.rendered.append(path)
+        with open(output, "w", encoding="utf-8") as file:
+            file.write("%PDF")
+
+
+def test_simple_markdown_is_rendered_in_process(conf, renderer, tmp_path, monkeypatch):
+    conf.middleware.markdown_renderer = "html"
+    in_process = FakeMarkdownRenderer()
+    monkeypatch.setattr(markdown_renderer, "get_markdown_renderer", lambda: in_process)
+    os.makedirs(tmp_path / "HAs")
+    with open(tmp_path / "HAs/simple.md", "w", encoding="utf-8") as file:
+        file.write("# Notes\n\n- a\n- b\n")
+    with open(tmp_path / "HAs/math.md", "w", encoding="utf-8") as file:
+        file.write("# Notes\n\n$a^2 + b^2 = c^2$\n")
+
+    asyncio.run(FileCoordinator(conf).scan(str(tmp_path / "HAs")))
+
+    assert in_process.rendered == [str(tmp_path / "HAs/simple.md")]
+    assert [command[-1] for command in renderer.commands] == [
+        str(tmp_path / "HAs/math.md")
+    ]
+    assert (tmp_path / "HAs/simple.pdf").is_file()
+    assert (tmp_path / "HAs/math.pdf").is_file()
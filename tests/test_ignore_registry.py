@@ -0,0 +1,63 @@
+import pytest
+from home_automation import config
+from home_automation.ignore_registry import GRACE_PERIOD, IgnoreRegistry
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def conf(tmp_path):
+    return config.Config(
+        str(tmp_path),
+        str(tmp_path / "HAs"),
+        str(tmp_path / "Archive"),
+        {},
+        "",
+        "",
+        frontend={"backend_ip_address": "192.168.0.2"},
+        storage={"local": {"path": str(tmp_path / "local.db")}},
+    )
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_paths_are_ignored_until_after_the_operation(conf, clock):
+    registry = IgnoreRegistry(conf, clock)
+
+    with registry.ignoring(["/HAs/PH HA.small.pdf"]):
+        assert registry.is_ignored("/HAs/PH HA.small.pdf")
+        assert not registry.is_ignored("/HAs/PH HA.pdf")
+
+    clock.now += GRACE_PERIOD - 1
+    assert registry.is_ignored("/HAs/PH HA.small.pdf")
+    clock.now += 2
+    assert not registry.is_ignored("/HAs/PH HA.small.pdf")
+
+
+def test_directories_are_ignored_recursively(conf, clock):
+    registry = IgnoreRegistry(conf, clock)
+
+    with registry.ignoring(["/HAs/a.aux"], ["/HAs/texlive2020"]):
+        assert registry.is_ignored("/HAs/texlive2020")
+        assert registry.is_ignored("/HAs/texlive2020/pdflatex/a.fmt")
+        assert not registry.is_ignored("/HAs/texlive2020.pdf")
+        assert not registry.is_ignored("/HAs/a.aux/b")
+
+
+def test_paths_ignored_by_other_processes(conf, clock):
+    watchdog = IgnoreRegistry(conf, clock)
+    archiver = IgnoreRegistry(conf, clock)
+    assert not watchdog.is_ignored("/HAs/PH HA 22-06-2021.pdf")
+
+    with archiver.ignoring(["/HAs/PH HA 22-06-2021.pdf"]):
+        clock.now += 1
+        assert watchdog.is_ignored("/HAs/PH HA 22-06-2021.pdf")
@@ -0,0 +1,71 @@
+import subprocess
+import sys
+
+from home_automation.import_time import main, measure, parse_import_times
+
+OUTPUT = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:       300 |        300 |     home_automation.constants
+import time:       500 |        800 |   home_automation.archive_stats
+import time:       200 |       1000 | home_automation.archive_manager
+"""
+
+HEAVY_DEPENDENCIES = [
+    "docker",
+    "kubernetes",
+    "googleapiclient",
+    "google_auth_oauthlib",
+    "redis",
+    "git",
+    "semver",
+    "httpx",
+    "flask",
+]
+
+
+def test_parse_import_times():
+    times = parse_import_times(OUTPUT)
+
+    assert [(time.module, time.depth) for time in times] == [
+        ("_io", 1),
+        ("home_automation.constants", 2),
+        ("home_automation.archive_stats", 1),
+        ("home_automation.archive_manager", 0),
+    ]
+    assert times[2].self_us == 500
+    assert times[2].cumulative_us == 800
+
+
+def test_measure():
+    report = measure("home_automation.constants")
+
+    assert report.error is None
+    assert report.total_us > 0
+    assert report.times[-1].module == "home_automation.constants"
+
+
+def test_budget(capsys):
+    assert main(["home_automation.constants", "--budget", "0"]) == 1
+    assert "over budget" in capsys.readouterr().out
+
+
+def test_heavy_dependencies_are_imported_lazily():
+    code = f"""import sys
+import home_automation.runner, home_automation.archive_manager
+print(sorted(name for name in {HEAVY_DEPENDENCIES!r} if name in sys.modules))"""
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+
+    assert output.strip() == "[]"
+
+
+def test_importing_the_backend_has_no_side_effects():
+    code = """import sys
+from home_automation.server.backend import app
+print("docker" in sys.modules, app.CONFIG, app.CLIENT)"""
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+
+    assert output.strip() == "False None None"
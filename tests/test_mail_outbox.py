@@ -0,0 +1,106 @@
+import pytest
+from home_automation import config
+from home_automation.mail_outbox import (
+    BACKOFF_BASE,
+    STATUS_FAILED,
+    STATUS_PENDING,
+    STATUS_SENT,
+    MailOutbox,
+    get_backoff,
+)
+
+NOW = 1_000_000.0
+
+
+@pytest.fixture
+def sent():
+    return []
+
+
+@pytest.fixture
+def outbox(tmp_path, sent):
+    conf = config.Config(
+        str(tmp_path),
+        str(tmp_path / "HAs"),
+        str(tmp_path / "Archive"),
+        {"address": "hello@example.com", "digest_delay": 600, "max_attempts": 3},
+        "",
+        "",
+        frontend={"backend_ip_address": "192.168.0.2"},
+        storage={"local": {"path": str(tmp_path / "local.db")}},
+    )
+    return MailOutbox(conf, lambda subject, body: sent.append((subject, body)))
+
+
+def test_mails_are_sent_in_order(outbox, sent):
+    outbox.enqueue("First", "1", now=NOW)
+    outbox.enqueue("Second", "2", now=NOW)
+
+    assert outbox.send_due(NOW) == 2
+    assert sent == [("First", "1"), ("Second", "2")]
+    assert outbox.send_due(NOW + 1) == 0
+    assert [mail["status"] for mail in outbox.get_mails()] == [STATUS_SENT] * 2
+
+
+def test_digests_are_coalesced(outbox, sent):
+    first = outbox.enqueue("[NAS] Archiving", "a.pdf", "archiving", now=NOW)
+    second = outbox.enqueue("[NAS] Archiving", "b.pdf", "archiving", now=NOW + 60)
+
+    assert first == second
+    assert outbox.send_due(NOW + 599) == 0
+    assert outbox.send_due(NOW + 600) == 1
+    assert sent[0][0] == "[NAS] Archiving (2 notifications)"
+    assert "a.pdf" in sent[0][1] and "b.pdf" in sent[0][1]
+
+    outbox.enqueue("[NAS] Archiving", "c.pdf", "archiving", now=NOW + 700)
+
+    assert len(outbox.get_mails(STATUS_PENDING)) == 1
+
+
+def test_failed_mails_are_retried_with_backoff(outbox, sent):
+    failures = [1, 2]
+
+    def sender(subject, body):
+        if failures:
+            failures.pop()
+            raise ConnectionError("Google is slow today.")
+        sent.append((subject, body))
+
+    outbox.sender = sender
+    outbox.enqueue("Test", "body", now=NOW)
+
+    assert outbox.send_due(NOW) == 0
+    mail = outbox.get_mails()[0]
+    assert mail["attempts"] == 1
+    assert mail["next_attempt_at"] == NOW + BACKOFF_BASE
+    assert "ConnectionError" in mail["last_error"]
+    assert outbox.send_due(NOW + BACKOFF_BASE) == 0
+    assert outbox.send_due(NOW + BACKOFF_BASE + get_backoff(2)) == 1
+    assert sent == [("Test", "body")]
+
+
+def test_gives_up_after_max_attempts(outbox):
+    def sender(subject, body):
+        raise ConnectionError()
+
+    outbox.sender = sender
+    outbox.enqueue("Test", "body", now=NOW)
+    for attempt in range(3):
+        outbox.send_due(NOW + attempt * 10_000)
+
+    assert outbox.get_mails()[0]["status"] == STATUS_FAILED
+
+
+def test_clean_up(outbox):
+    outbox.enqueue("Old", "body", now=NOW)
+    outbox.send_due(NOW)
+
+    assert outbox.clean_up(60, NOW + 30) == 0
+    assert outbox.clean_up(60, NOW + 61) == 1
+    assert outbox.get_mails() == []
+
+
+def test_get_backoff():
+    assert get_backoff(1) == BACKOFF_BASE
+    assert get_backoff(3) == 4 * BACKOFF_BASE
+    assert get_backoff(100) == 6 * 60 * 60
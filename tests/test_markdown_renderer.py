@@ -0,0 +1,42 @@
+import pytest
+from home_automation.markdown_renderer import (
+    MarkdownRenderer,
+    needs_pandoc,
+    split_metadata,
+)
+
+
+@pytest.mark.parametrize(
+    "source,expected",
+    [
+        ("# Notes\n\n- a\n- **b**\n\n| a | b |\n|---|---|\n| 1 | 2 |\n", False),
+        ("Costs 5 $ and more", False),
+        ("Energy: $E = mc^2$", True),
+        ("$$\n\\int_0^1 x dx\n$$", True),
+        ("Some \\textbf{bold} text", True),
+        ("As shown [@knuth84, p. 3]", True),
+        ("---\ntitle: A\nbibliography: refs.bib\n---\nText", True),
+        ("---\ntitle: A\n---\nText", False),
+    ],
+)
+def test_needs_pandoc(source, expected):
+    assert needs_pandoc(source) == expected
+
+
+def test_split_metadata():
+    assert split_metadata("---\ntitle: 'Notes'\n---\n# Heading\n") == (
+        "Notes",
+        "# Heading\n",
+    )
+    assert split_metadata("Intro\n\n# Heading\n") == ("Heading", "Intro\n\n# Heading\n")
+    assert split_metadata("Text") == (None, "Text")
+
+
+def test_to_html():
+    pytest.importorskip("markdown")
+    renderer = MarkdownRenderer()
+
+    document = renderer.to_html("---\ntitle: A & B\n---\n# Heading\n\nText")
+
+    assert "<title>A &amp; B</title>" in document
+    assert "<p>Text</p>" in document
@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+from home_automation import config
+from home_automation.middleware_registry import (
+    COMPRESSION_MIDDLEWARE,
+    FILE_COORDINATOR_MIDDLEWARE,
+    MiddlewareRegistry,
+)
+
+
+class RecordingMiddleware:
+    created = []
+
+    def __init__(self, conf, logger):
+        self.conf = conf
+        self.logger = logger
+        RecordingMiddleware.created.append(self)
+
+
+class ClosableMiddleware(RecordingMiddleware):
+    closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+class DisabledMiddleware(RecordingMiddleware):
+    @classmethod
+    def enabled(cls, conf):
+        return False
+
+
+TARGET = f"{__name__}:RecordingMiddleware"
+
+
+@pytest.fixture
+def conf(tmp_path):
+    RecordingMiddleware.created = []
+    return config.Config(
+        str(tmp_path),
+        str(tmp_path / "HAs"),
+        str(tmp_path / "Archive"),
+        {},
+        "",
+        "",
+        frontend={"backend_ip_address": "192.168.0.2"},
+    )
+
+
+def test_dispatch_by_extension(conf):
+    registry = MiddlewareRegistry(conf, None, [("*.tex", TARGET), ("*.TXT", TARGET)])
+
+    assert registry.targets_for("/HAs/a.tex") == [TARGET]
+    assert registry.targets_for("/HAs/a.txt") == [TARGET]
+    assert registry.targets_for("/HAs/a.md") == []
+    assert registry.targets_for("/HAs/tex") == []
+
+
+def test_glob_patterns(conf):
+    registry = MiddlewareRegistry(
+        conf, None, [("*.small.pdf", TARGET), ("Scan *", TARGET)]
+    )
+
+    assert registry.targets_for("/HAs/a.small.pdf") == [TARGET]
+    assert registry.targets_for("/HAs/a.pdf") == []
+    assert registry.targets_for("/HAs/Scan 1.jpg") == [TARGET]
+
+
+def test_middleware_is_loaded_lazily_and_once(conf):
+    registry = MiddlewareRegistry(conf, "logger", [("*.tex", TARGET), ("*.md", TARGET)])
+    assert RecordingMiddleware.created == []
+
+    assert registry.middleware_for("/HAs/a.pdf") == []
+    assert RecordingMiddleware.created == []
+
+    middleware = registry.middleware_for("/HAs/a.tex")
+    assert middleware == RecordingMiddleware.created
+    assert middleware[0].logger == "logger"
+    assert registry.middleware_for("/HAs/b.md") == middleware
+    assert len(RecordingMiddleware.created) == 1
+    assert registry.loaded == middleware
+
+
+def test_disabled_and_broken_middleware_is_skipped(conf):
+    registry = MiddlewareRegistry(
+        conf,
+        None,
+        [
+            ("*.tex", f"{__name__}:DisabledMiddleware"),
+            ("*.tex", f"{__name__}:MissingMiddleware"),
+            ("*.tex", "home_automation.does_not_exist:Middleware"),
+        ],
+    )
+
+    assert registry.middleware_for("/HAs/a.tex") == []
+    assert registry.middleware_for("/HAs/b.tex") == []
+    assert RecordingMiddleware.created == []
+
+
+def test_compression_middleware_depends_on_config(conf):
+    registry = MiddlewareRegistry.for_group(COMPRESSION_MIDDLEWARE, conf)
+
+    names = [type(m).__name__ for m in registry.middleware_for("/HAs/M HA.pdf")]
+
+    assert "StatsCompressionMiddleware" in names
+    assert "SearchIndexCompressionMiddleware" not in names
+    assert "ThumbnailCompressionMiddleware" not in names
+
+
+def test_file_coordinator_group(conf):
+    registry = MiddlewareRegistry.for_group(FILE_COORDINATOR_MIDDLEWARE, conf)
+
+    assert [type(m).__name__ for m in registry.middleware_for("/HAs/a.md")] == [
+        "MarkdownToPDFMiddleware"
+    ]
+
+
+def test_close_closes_loaded_middleware(conf):
+    registry = MiddlewareRegistry(
+        conf,
+        None,
+        [("*.tex", f"{__name__}:ClosableMiddleware"), ("*.md", TARGET)],
+    )
+    closable = registry.middleware_for("/HAs/a.tex")[0]
+    registry.middleware_for("/HAs/a.md")
+
+    asyncio.run(registry.close())
+
+    assert closable.closed
@@ -0,0 +1,80 @@
+import pytest
+from home_automation import config
+from home_automation.quarantine import (
+    SUBSYSTEM_COMPRESSION,
+    SUBSYSTEM_RENDERING,
+    Quarantine,
+)
+
+NOW = 1_000_000.0
+
+
+@pytest.fixture
+def quarantine(tmp_path):
+    conf = config.Config(
+        str(tmp_path),
+        str(tmp_path / "HAs"),
+        str(tmp_path / "Archive"),
+        {},
+        "",
+        "",
+        frontend={"backend_ip_address": "192.168.0.2"},
+        storage={"local": {"path": str(tmp_path / "local.db")}},
+        quarantine={"backoff_base": 60, "max_backoff": 300},
+    )
+    return Quarantine(conf)
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    path = tmp_path / "PH HA.pdf"
+    path.write_text("corrupt")
+    return str(path)
+
+
+def test_backoff_is_exponential_and_capped(quarantine, pdf):
+    retries = [
+        quarantine.record_failure(pdf, SUBSYSTEM_COMPRESSION, "gs failed", now=NOW)
+        for _ in range(5)
+    ]
+
+    assert [retry - NOW for retry in retries] == [60, 120, 240, 300, 300]
+    assert quarantine.get_entries()[0]["failures"] == 5
+
+
+def test_files_are_skipped_until_retry(quarantine, pdf):
+    assert not quarantine.is_quarantined(pdf, SUBSYSTEM_COMPRESSION, now=NOW)
+
+    quarantine.record_failure(pdf, SUBSYSTEM_COMPRESSION, "gs failed", now=NOW)
+
+    assert quarantine.is_quarantined(pdf, SUBSYSTEM_COMPRESSION, now=NOW + 59)
+    assert not quarantine.is_quarantined(pdf, SUBSYSTEM_COMPRESSION, now=NOW + 60)
+    assert not quarantine.is_quarantined(pdf, SUBSYSTEM_RENDERING, now=NOW + 1)
+
+
+def test_changed_files_are_retried(quarantine, pdf):
+    quarantine.record_failure(pdf, SUBSYSTEM_COMPRESSION, "gs failed", now=NOW)
+    quarantine.record_failure(pdf, SUBSYSTEM_COMPRESSION, "gs failed", now=NOW)
+
+    with open(pdf, "w", encoding="utf-8") as file:
+        file.write("%PDF")
+
+    assert not quarantine.is_quarantined(pdf, SUBSYSTEM_COMPRESSION, now=NOW + 1)
+    quarantine.record_failure(pdf, SUBSYSTEM_COMPRESSION, "gs failed", now=NOW)
+    assert quarantine.get_entries()[0]["failures"] == 1
+
+
+def test_success_and_clear_lift_the_quarantine(quarantine, pdf, tmp_path):
+    other = str(tmp_path / "M HA.tex")
+    quarantine.record_failure(pdf, SUBSYSTEM_COMPRESSION, "gs failed", now=NOW)
+    quarantine.record_failure(pdf, SUBSYSTEM_RENDERING, "no PDF", "abc", now=NOW)
+    quarantine.record_failure(other, SUBSYSTEM_RENDERING, "no PDF", now=NOW)
+
+    quarantine.record_success(pdf, SUBSYSTEM_COMPRESSION)
+
+    assert not quarantine.is_quarantined(pdf, SUBSYSTEM_COMPRESSION, now=NOW)
+    assert quarantine.is_quarantined(pdf, SUBSYSTEM_RENDERING, "abc", now=NOW)
+    assert quarantine.clear(pdf) == 1
+    assert [entry["path"] for entry in quarantine.get_entries()] == [other]
+    assert quarantine.clear() == 1
+    assert quarantine.get_entries() == []
@@ -0,0 +1,115 @@
+import os
+
+import pytest
+from home_automation import config
+from home_automation.render_cache import RenderCache, dependencies_of
+
+
+@pytest.fixture
+def conf(tmp_path):
+    return config.Config(
+        str(tmp_path),
+        str(tmp_path / "HAs"),
+        str(tmp_path / "Archive"),
+        {},
+        "",
+        "",
+        frontend={"backend_ip_address": "192.168.0.2"},
+        storage={"local": {"path": str(tmp_path / "local.db")}},
+    )
+
+
+@pytest.fixture
+def cache(conf):
+    return RenderCache(conf)
+
+
+def write(path, content=""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(content)
+    return str(path)
+
+
+def test_latex_dependencies(tmp_path):
+    document = write(
+        tmp_path / "a.tex",
+        "\\input{sections/intro}\n"
+        "\\include{appendix.tex}\n"
+        "% \\input{commented}\n"
+        "\\includegraphics[width=5cm]{figure}\n"
+        "\\bibliography{one,two}\n",
+    )
+    write(tmp_path / "sections/intro.tex", "\\input{sections/nested}")
+    write(tmp_path / "sections/nested.tex")
+    write(tmp_path / "figure.png")
+
+    assert dependencies_of(document) == [
+        str(tmp_path / "sections/intro.tex"),
+        str(tmp_path / "appendix.tex"),
+        str(tmp_path / "figure.png"),
+        str(tmp_path / "one.bib"),
+        str(tmp_path / "two.bib"),
+        str(tmp_path / "sections/nested.tex"),
+    ]
+
+
+def test_markdown_dependencies(tmp_path):
+    document = write(
+        tmp_path / "a.md",
+        "---\nbibliography: refs.bib\n---\n"
+        "![A figure](img/figure.png)\n"
+        "![Remote](https://example.com/a.png)\n",
+    )
+
+    assert dependencies_of(document) == [
+        str(tmp_path / "img/figure.png"),
+        str(tmp_path / "refs.bib"),
+    ]
+
+
+def test_changed_dependency_changes_fingerprint(cache, tmp_path):
+    document = write(tmp_path / "a.tex", "\\input{b}")
+    write(tmp_path / "b.tex", "B")
+    fingerprint = cache.fingerprint(document)
+    assert cache.fingerprint(document) == fingerprint
+
+    write(tmp_path / "b.tex", "Changed")
+
+    assert cache.fingerprint(document) != fingerprint
+
+
+def test_missing_dependency_appearing_changes_fingerprint(cache, tmp_path):
+    document = write(tmp_path / "a.tex", "\\includegraphics{figure}")
+    fingerprint = cache.fingerprint(document)
+
+    write(tmp_path / "figure.pdf")
+
+    assert cache.fingerprint(document) != fingerprint
+
+
+def test_is_up_to_date(cache, tmp_path):
+    document = write(tmp_path / "a.tex", "A")
+    output = str(tmp_path / "a.pdf")
+    assert not cache.is_up_to_date(document, output)
+
+    write(output)
+    cache.record(document, cache.fingerprint(document))
+    assert cache.is_up_to_date(document, output)
+
+    write(document, "Changed")
+    assert not cache.is_up_to_date(document, output)
+
+
+def test_older_outputs_are_adopted(cache, tmp_path):
+    document = write(tmp_path / "a.tex", "A")
+    output = write(tmp_path / "a.pdf")
+    os.utime(document, (1000, 1000))
+
+    assert cache.is_up_to_date(document, output)
+    assert cache.get(document) == cache.fingerprint(document)
+
+    other = write(tmp_path / "b.tex", "B")
+    other_output = write(tmp_path / "b.pdf")
+    os.utime(other_output, (500, 500))
+    assert not cache.is_up_to_date(other, other_output)
@@ -0,0 +1,127 @@
+import datetime
+import sys
+import threading
+
+import pytest
+from home_automation import config, runner
+from home_automation.scheduler import (
+    HISTORY_RETENTION,
+    STATUS_FAILED,
+    STATUS_RUNNING,
+    STATUS_SKIPPED,
+    STATUS_SUCCEEDED,
+    Scheduler,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = datetime.datetime(2021, 6, 22, 12, 30).timestamp()
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def conf(tmp_path):
+    return config.Config(
+        str(tmp_path),
+        str(tmp_path / "HAs"),
+        str(tmp_path / "Archive"),
+        {},
+        "",
+        "",
+        frontend={"backend_ip_address": "192.168.0.2"},
+        storage={"local": {"path": str(tmp_path / "local.db")}},
+    )
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_jobs_run_when_due(conf, clock):
+    runs = []
+    scheduler = Scheduler(conf, clock)
+    scheduler.add("moodle_dl", "0 * * * *", lambda: runs.append(clock.now))
+
+    assert scheduler.next_run_in() == 30 * 60
+    assert scheduler.run_pending() == []
+    clock.now += 30 * 60
+    assert scheduler.run_pending() == ["moodle_dl"]
+    scheduler.join(5)
+
+    assert runs == [clock.now]
+    assert scheduler.next_run_in() == 60 * 60
+    assert [run["status"] for run in scheduler.get_runs()] == [STATUS_SUCCEEDED]
+
+
+def test_overlapping_runs_are_skipped(conf, clock):
+    release = threading.Event()
+    scheduler = Scheduler(conf, clock)
+    scheduler.add("reorganize", "* * * * *", lambda: release.wait(5))
+
+    try:
+        assert scheduler.start("reorganize")
+        assert not scheduler.start("reorganize")
+    finally:
+        release.set()
+        scheduler.join(5)
+
+    statuses = {run["status"] for run in scheduler.get_runs("reorganize")}
+    assert statuses == {STATUS_SUCCEEDED, STATUS_SKIPPED}
+
+
+def test_failures_are_recorded(conf, clock):
+    def fail():
+        raise OSError("No space left on device")
+
+    scheduler = Scheduler(conf, clock)
+    scheduler.add("tier", "0 3 1 * *", fail)
+    scheduler.start("tier")
+    scheduler.join(5)
+
+    run = scheduler.get_runs()[0]
+    assert run["status"] == STATUS_FAILED
+    assert "No space left on device" in run["error"]
+
+
+def test_auto_upgrades_are_killed_after_timeout(conf, clock, monkeypatch):
+    hanging = [sys.executable, "-c", "import time; time.sleep(10)"]
+    monkeypatch.setattr(runner, "AUTO_UPGRADE_COMMAND", hanging)
+    monkeypatch.setattr(runner, "AUTO_UPGRADE_TIMEOUT", 0.1)
+    scheduler = Scheduler(conf, clock)
+    runner.schedule_jobs(conf, scheduler)
+
+    scheduler.start("auto_upgrade")
+    scheduler.join(5)
+
+    run = scheduler.get_runs(job="auto_upgrade")[0]
+    assert run["status"] == STATUS_FAILED
+    assert "TimeoutExpired" in run["error"]
+
+
+def test_interrupted_runs_are_recovered(conf, clock):
+    release = threading.Event()
+    scheduler = Scheduler(conf, clock)
+    scheduler.add("auto_upgrade", "*/10 * * * *", lambda: release.wait(5))
+    scheduler.start("auto_upgrade")
+    assert scheduler.get_runs()[0]["status"] == STATUS_RUNNING
+
+    try:
+        assert Scheduler(conf, clock).recover() == 1
+    finally:
+        release.set()
+        scheduler.join(5)
+
+
+def test_old_runs_are_cleaned_up(conf, clock):
+    scheduler = Scheduler(conf, clock)
+    scheduler.add("reorganize", "0 0 1 * *", lambda: None)
+    scheduler.start("reorganize")
+    scheduler.join(5)
+
+    assert scheduler.clean_up(clock.now + HISTORY_RETENTION - 1) == 0
+    assert scheduler.clean_up(clock.now + HISTORY_RETENTION + 1) == 1
+    assert scheduler.get_runs() == []
@@ -0,0 +1,237 @@
+import gc
+import json
+import logging
+import os
+import queue
+import sys
+
+from home_automation import config, runner
+from home_automation.structured_logging import (
+    BatchingQueueListener,
+    JSONFormatter,
+    JSONLinesFileHandler,
+    StructuredLogger,
+)
+
+
+def create_logger(tmp_path, **data) -> StructuredLogger:
+    return StructuredLogger(
+        str(tmp_path / "logs" / "test.log"), config.ConfigLogging(data)
+    )
+
+
+def read_records(path: str):
+    with open(path, "r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+def test_lines_are_buffered_until_flushed(tmp_path):
+    logger = create_logger(tmp_path, flush_interval=60)
+    logger.context = "archiving"
+
+    logger.success("Transferred file", False, path="/a.pdf")
+
+    assert not os.path.exists(logger.filename)
+    logger.save()
+    records = read_records(logger.filename)
+    assert len(records) == 1
+    assert records[0]["level"] == "SUCCESS"
+    assert records[0]["logger"] == "test"
+    assert records[0]["context"] == "archiving"
+    assert records[0]["message"] == "Transferred file"
+    assert records[0]["path"] == "/a.pdf"
+    logger.close()
+
+
+def test_full_buffer_is_flushed_in_background(tmp_path):
+    logger = create_logger(tmp_path, flush_interval=60, buffer_size=2)
+
+    logger.info("first")
+    logger.info("second")
+    logger._flusher.thread.join(timeout=0.5)  # pylint: disable=protected-access
+
+    assert [r["message"] for r in read_records(logger.filename)] == [
+        "first",
+        "second",
+    ]
+    logger.close()
+
+
+def test_loggers_of_a_file_share_one_thread(tmp_path):
+    first = create_logger(tmp_path, flush_interval=0.05)
+    second = create_logger(tmp_path, flush_interval=0.05)
+
+    first.info("first")
+    second.info("second")
+    thread = first._flusher.thread  # pylint: disable=protected-access
+    assert second._flusher.thread is thread  # pylint: disable=protected-access
+    first.close()
+    second.close()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert [r["message"] for r in read_records(first.filename)] == [
+        "first",
+        "second",
+    ]
+
+
+def test_thread_ends_when_logger_is_garbage_collected(tmp_path):
+    logger = create_logger(tmp_path, flush_interval=0.05)
+    logger.info("unclosed")
+    thread = logger._flusher.thread  # pylint: disable=protected-access
+    path = logger.filename
+
+    del logger
+    gc.collect()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert [r["message"] for r in read_records(path)] == ["unclosed"]
+
+
+def test_records_below_level_are_dropped(tmp_path):
+    logger = create_logger(tmp_path, level="warning")
+
+    logger.debug("debug")
+    logger.info("info")
+    logger.warning("warning", False)
+    logger.close()
+
+    assert [r["message"] for r in read_records(logger.filename)] == ["warning"]
+    assert len(logger.lines) == 1
+
+
+def test_debug_logs_everything(tmp_path):
+    logger = StructuredLogger(str(tmp_path / "test.log"), debug=True)
+
+    logger.debug("debug")
+    logger.close()
+
+    assert read_records(logger.filename)[0]["level"] == "DEBUG"
+
+
+def test_exceptions_include_traceback(tmp_path):
+    logger = create_logger(tmp_path)
+    try:
+        raise FileNotFoundError("/a.pdf")
+    except FileNotFoundError as error:
+        logger.handle_exception(error)
+    logger.close()
+
+    record = read_records(logger.filename)[0]
+    assert record["level"] == "ERROR"
+    assert record["exception"] == "FileNotFoundError"
+    assert "raise FileNotFoundError" in record["traceback"]
+
+
+def test_rotation(tmp_path):
+    logger = create_logger(tmp_path, max_bytes=300, backup_count=2)
+
+    for i in range(10):
+        logger.info(f"message {i}")
+        logger.flush()
+    logger.close()
+
+    assert os.path.exists(logger.filename + ".1")
+    assert os.path.exists(logger.filename + ".2")
+    assert not os.path.exists(logger.filename + ".3")
+    assert os.path.getsize(logger.filename) <= 300
+    assert read_records(logger.filename)[-1]["message"] == "message 9"
+
+
+def test_json_formatter():
+    try:
+        raise ValueError("invalid")
+    except ValueError:
+        record = logging.LogRecord(
+            "home_automation_runner_cron",
+            logging.ERROR,
+            __file__,
+            1,
+            "Ran %s",
+            ("job",),
+            sys.exc_info(),
+        )
+
+    data = json.loads(JSONFormatter().format(record))
+
+    assert data["logger"] == "home_automation_runner_cron"
+    assert data["level"] == "ERROR"
+    assert data["message"] == "Ran job"
+    assert data["exception"] == "ValueError"
+
+
+def make_record(name: str, message: str) -> logging.LogRecord:
+    return logging.LogRecord(name, logging.INFO, __file__, 1, message, (), None)
+
+
+def test_handler_writes_on_flush(tmp_path):
+    path = str(tmp_path / "runner.log")
+    handler = JSONLinesFileHandler(path, 1024 * 1024, 1)
+
+    handler.handle(make_record("home_automation_runner_cron", "Ran job"))
+
+    assert not os.path.exists(path)
+    handler.flush()
+    assert [record["message"] for record in read_records(path)] == ["Ran job"]
+    handler.close()
+
+
+def test_handler_per_logger_files(tmp_path):
+    path = str(tmp_path / "runner.log")
+    handler = JSONLinesFileHandler(path, 1024 * 1024, 1, per_logger=True)
+
+    handler.handle(make_record("home_automation_runner_cron", "Ran job"))
+    handler.handle(make_record("home_automation_runner_watchdog", "Compressed"))
+    handler.close()
+
+    assert not os.path.exists(path)
+    cron = read_records(str(tmp_path / "home_automation_runner_cron.log"))
+    watchdog = read_records(str(tmp_path / "home_automation_runner_watchdog.log"))
+    assert [record["message"] for record in cron] == ["Ran job"]
+    assert [record["message"] for record in watchdog] == ["Compressed"]
+
+
+def test_listener_writes_batches(tmp_path):
+    path = str(tmp_path / "runner.log")
+    records: queue.Queue = queue.Queue()
+    handler = JSONLinesFileHandler(path, 1024 * 1024, 1)
+    listener = BatchingQueueListener(records, handler, batch_size=2)
+    for i in range(5):
+        records.put(make_record("home_automation_runner_cron", f"message {i}"))
+
+    listener.start()
+    listener.stop()
+
+    assert [record["message"] for record in read_records(path)] == [
+        f"message {i}" for i in range(5)
+    ]
+
+
+def test_runner_listener_flushes_its_own_handlers(tmp_path):
+    conf = config.Config(
+        str(tmp_path),
+        str(tmp_path / "HAs"),
+        str(tmp_path / "Archive"),
+        {},
+        "",
+        "",
+        frontend={"backend_ip_address": "192.168.0.2"},
+    )
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    root.addHandler(logging.NullHandler())  # not the first handler anymore
+    listener = runner._configure_log_listener(  # pylint: disable=protected-access
+        conf, queue.Queue()
+    )
+    try:
+        logging.info("Running log listener")
+        listener.flush()
+
+        records = read_records(str(tmp_path / "home_automation_runner.log"))
+        assert [record["message"] for record in records] == ["Running log listener"]
+    finally:
+        for handler in listener.handlers:
+            handler.close()
+        root.handlers, root.level = handlers, level
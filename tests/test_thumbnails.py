@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+
+import pytest
+from home_automation import config, thumbnails
+from home_automation.thumbnails import ThumbnailCache, ThumbnailRenderError
+
+
+@pytest.fixture
+def rendered(monkeypatch):
+    calls = []
+
+    def render_thumbnail(path, destination, width):
+        calls.append(path)
+        if "broken" in path:
+            raise ThumbnailRenderError(path)
+        with open(destination, "wb") as file:
+            file.write(b"p" * width)
+
+    monkeypatch.setattr(thumbnails, "render_thumbnail", render_thumbnail)
+    return calls
+
+
+@pytest.fixture
+def cache(tmp_path, rendered):  # pylint: disable=unused-argument
+    conf = config.Config(
+        str(tmp_path),
+        str(tmp_path / "HAs"),
+        str(tmp_path / "Archive"),
+        {},
+        "",
+        "",
+        frontend={"backend_ip_address": "192.168.0.2"},
+        storage={"local": {"path": str(tmp_path / "local.db")}},
+        thumbnails={
+            "enabled": True,
+            "directory": str(tmp_path / "thumbnails"),
+            "max_size_mb": 1,
+            "width": 100,
+            "workers": 1,
+        },
+    )
+    thumbnail_cache = ThumbnailCache(conf)
+    yield thumbnail_cache
+    thumbnail_cache.close()
+
+
+def create_file(tmp_path, name: str, content: str) -> str:
+    path = tmp_path / "HAs" / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content, encoding="utf-8")
+    return str(path)
+
+
+def test_cold_miss_is_queued(cache, tmp_path, rendered):
+    path = create_file(tmp_path, "PH HA.pdf", "physics")
+
+    assert cache.lookup(path) is None
+    cache.close()
+
+    thumbnail = cache.lookup(path)
+    assert thumbnail == cache.thumbnail_path(cache.content_hash(path))
+    assert os.path.isfile(thumbnail)
+    assert rendered == [path]
+
+
+def test_lookup_hashes_in_background(cache, tmp_path, monkeypatch):
+    path = create_file(tmp_path, "PH HA.pdf", "physics")
+    hashed_by = []
+
+    def file_content_hash(hashed):
+        hashed_by.append(threading.current_thread())
+        return f"hash of {os.path.basename(hashed)}"
+
+    monkeypatch.setattr(thumbnails, "file_content_hash", file_content_hash)
+
+    assert cache.lookup(path) is None
+    cache.close()
+
+    assert len(hashed_by) == 1
+    assert hashed_by[0] is not threading.current_thread()
+    assert cache.lookup(path) == cache.thumbnail_path("hash of PH HA.pdf")
+
+
+def test_rendered_once_per_content_hash(cache, tmp_path, rendered):
+    first = create_file(tmp_path, "PH HA.pdf", "same")
+    second = create_file(tmp_path, "Archive/PH HA.pdf", "same")
+
+    cache.submit(first)
+    cache.close()
+    cache.render(second, cache.content_hash(second))
+
+    assert rendered == [first]
+
+
+def test_submit_skips_non_pdfs(cache, tmp_path):
+    create_file(tmp_path, "dir/PH HA.small.pdf", "small")
+    create_file(tmp_path, "dir/notes.txt", "notes")
+
+    assert cache.submit(str(tmp_path / "HAs" / "dir" / "notes.txt")) is None
+    cache.submit(str(tmp_path / "HAs" / "dir"))
+    cache.close()
+
+    assert os.listdir(cache.directory) == []
+
+
+def test_failed_render_is_reported(cache, tmp_path):
+    path = create_file(tmp_path, "broken.pdf", "broken")
+
+    assert cache.lookup(path) is None
+    cache.close()
+
+    with pytest.raises(ThumbnailRenderError):
+        cache.lookup(path)
+
+
+def test_evicts_least_recently_used(cache, tmp_path):
+    cache.config.thumbnails.width = 400 * 1024
+    paths = [create_file(tmp_path, f"{i}.pdf", str(i)) for i in range(3)]
+    thumbs = []
+    for i, path in enumerate(paths[:2]):
+        thumbs.append(cache.render(path, cache.content_hash(path)))
+        os.utime(thumbs[-1], (time.time() - 100 + i, time.time() - 100 + i))
+    # use the older one so the other one is evicted
+    assert cache.lookup(paths[0]) == thumbs[0]
+
+    cache.render(paths[2], cache.content_hash(paths[2]))
+
+    assert os.path.isfile(thumbs[0])
+    assert not os.path.isfile(thumbs[1])
+
+
+def test_size_is_only_computed_once(cache, tmp_path, monkeypatch):
+    listed = []
+    list_thumbnails = cache._list_thumbnails  # pylint: disable=protected-access
+
+    def count_listing():
+        listed.append(True)
+        return list_thumbnails()
+
+    monkeypatch.setattr(cache, "_list_thumbnails", count_listing)
+    for i in range(3):
+        path = create_file(tmp_path, f"{i}.pdf", str(i))
+        cache.render(path, cache.content_hash(path))
+
+    assert cache.size() == 300
+    assert len(listed) == 1
+
+
+def test_rename_keeps_hashes(cache, tmp_path, monkeypatch):
+    path = create_file(tmp_path, "Physik/PH HA.pdf", "physics")
+    content_hash = cache.content_hash(path)
+    os.rename(str(tmp_path / "HAs/Physik"), str(tmp_path / "HAs/Physics"))
+
+    cache.rename(str(tmp_path / "HAs/Physik"), str(tmp_path / "HAs/Physics"))
+
+    monkeypatch.setattr(thumbnails, "file_content_hash", None)
+    assert cache.content_hash(str(tmp_path / "HAs/Physics/PH HA.pdf")) == content_hash
@@ -0,0 +1,53 @@
+import os
+
+from home_automation.tree_walker import walk
+
+
+def create_tree(tmp_path, paths):
+    for path in paths:
+        full_path = tmp_path / path
+        full_path.parent.mkdir(parents=True, exist_ok=True)
+        full_path.write_text("")
+
+
+def test_walks_breadth_first(tmp_path):
+    create_tree(tmp_path, ["a.pdf", "A/b.pdf", "A/B/c.pdf", "D/d.pdf"])
+
+    result = {
+        os.path.relpath(dirpath, tmp_path): sorted(entry.name for entry in entries)
+        for dirpath, entries in walk(str(tmp_path), workers=2)
+    }
+    order = [
+        os.path.relpath(dirpath, tmp_path) for dirpath, _ in walk(str(tmp_path))
+    ]
+
+    assert result == {
+        ".": ["A", "D", "a.pdf"],
+        "A": ["B", "b.pdf"],
+        "D": ["d.pdf"],
+        os.path.join("A", "B"): ["c.pdf"],
+    }
+    assert order[0] == "."
+    assert order[-1] == os.path.join("A", "B")
+
+
+def test_include_and_descend(tmp_path):
+    create_tree(tmp_path, ["a.pdf", "a.aux", "@eaDir/x.pdf", "PH KW25/run.py"])
+
+    result = list(
+        walk(
+            str(tmp_path),
+            descend=lambda entry: not entry.name.startswith("PH"),
+            include=lambda name: not name.startswith("@") and not name.endswith(".aux"),
+        )
+    )
+
+    assert len(result) == 1
+    assert sorted(entry.name for entry in result[0][1]) == ["PH KW25", "a.pdf"]
+
+
+def test_errors_are_passed_to_onerror(tmp_path):
+    errors = []
+
+    assert not list(walk(str(tmp_path / "missing"), onerror=errors.append))
+    assert isinstance(errors[0], FileNotFoundError)